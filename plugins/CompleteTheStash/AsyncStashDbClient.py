@@ -0,0 +1,203 @@
+import asyncio
+from datetime import datetime
+
+import stashapi.log as logger
+
+from AsyncStashboxClient import AsyncStashboxClient
+from RateLimiter import RateLimiter
+from StashboxClient import (
+    SCENE_PROJECTION_FULL,
+    SCENE_PROJECTION_SLIM,
+    StashboxQueryError,
+    get_page_count,
+    remove_duplicate_scenes,
+    take_changed_scenes,
+)
+from StashDbClient import (
+    FIND_PERFORMER_IMAGE_QUERY,
+    FIND_STUDIO_IMAGE_QUERY,
+    MAX_PAGE_SIZE,
+    QUERY_SCENES_QUERY,
+    QUERY_SCENES_UPDATED_SINCE_QUERY,
+    SCENE_FIELDS_FRAGMENTS,
+    build_find_scenes_request,
+    build_find_tags_request,
+    get_detailed_scenes,
+    get_exclude_tags_filter,
+    get_scene_updated_at,
+    get_scenes_page,
+)
+
+
+class AsyncStashDbClient(AsyncStashboxClient):
+    max_page_size = MAX_PAGE_SIZE
+
+    def __init__(
+        self,
+        endpoint,
+        api_key,
+        max_in_flight: int = 100,
+        rate_limiter: RateLimiter | None = None,
+        max_retries: int = 0,
+        page_size: int = 25,
+        scene_projection: str = SCENE_PROJECTION_SLIM,
+        exclude_tag_names: list[str] | None = None,
+    ):
+        super().__init__(
+            endpoint, api_key, max_in_flight, rate_limiter, max_retries, page_size
+        )
+        self.scene_projection = scene_projection
+        self.scene_fields_fragment = SCENE_FIELDS_FRAGMENTS[scene_projection]
+        self.excluded_tag_names = sorted(set(exclude_tag_names or []))
+        self._tags_filter_lock = asyncio.Lock()
+        self._tags_filter_resolved = False
+        self._tags_filter = None
+
+    async def query_performer_image(self, performer_stash_id):
+        result = await self._gql_query(
+            FIND_PERFORMER_IMAGE_QUERY, {"id": performer_stash_id}
+        )
+        if result:
+            performer_data = result["data"]["findPerformer"]
+            if performer_data and performer_data["images"]:
+                return performer_data["images"][0]["url"]
+            logger.error(
+                f"No image found for performer with Stash ID {performer_stash_id}."
+            )
+            return None
+
+        logger.error(f"Failed to query performer with Stash ID {performer_stash_id}.")
+        return None
+
+    async def query_studio_image(self, performer_stash_id):
+        result = await self._gql_query(
+            FIND_STUDIO_IMAGE_QUERY, {"id": performer_stash_id}
+        )
+        if result:
+            studio_data = result["data"]["findStudio"]
+            if studio_data and studio_data["images"]:
+                return studio_data["images"][0]["url"]
+            logger.error(
+                f"No image found for studio with Stash ID {performer_stash_id}."
+            )
+            return None
+
+        logger.error(f"Failed to query studio with Stash ID {performer_stash_id}.")
+        return None
+
+    async def query_scenes(self, performer_stash_id):
+        first_page = await self._query_scenes_page(performer_stash_id, 1)
+        if len(first_page["scenes"]) < self.page_size:
+            return first_page["scenes"]
+
+        remaining_pages = await asyncio.gather(
+            *(
+                self._query_scenes_page(performer_stash_id, page)
+                for page in range(
+                    2, get_page_count(first_page["count"], self.page_size) + 1
+                )
+            )
+        )
+        return remove_duplicate_scenes(
+            [
+                scene
+                for scenes_data in [first_page] + remaining_pages
+                for scene in scenes_data["scenes"]
+            ]
+        )
+
+    async def _query_scenes_page(self, performer_stash_id, page):
+        result = await self._gql_query(
+            QUERY_SCENES_QUERY + self.scene_fields_fragment,
+            {
+                "stash_ids": performer_stash_id,
+                "page": page,
+                "per_page": self.page_size,
+                "tags": await self._get_tags_filter(),
+            },
+        )
+        scenes_data = get_scenes_page(result)
+        if scenes_data is None:
+            raise StashboxQueryError(
+                f"Failed to query page {page} of the scenes of performer {performer_stash_id}."
+            )
+        return scenes_data
+
+    async def query_scene_details(self, scenes):
+        if self.scene_projection == SCENE_PROJECTION_FULL:
+            return scenes
+
+        detailed_chunks = await asyncio.gather(
+            *(
+                self._query_scene_details_chunk(scenes[start : start + self.page_size])
+                for start in range(0, len(scenes), self.page_size)
+            )
+        )
+        return [scene for detailed_scenes in detailed_chunks for scene in detailed_scenes]
+
+    async def _query_scene_details_chunk(self, scenes):
+        return get_detailed_scenes(
+            scenes,
+            await self._gql_query(*build_find_scenes_request(scenes)),
+            self.endpoint,
+        )
+
+    async def query_scenes_updated_since(self, performer_stash_id, since: datetime):
+        # Paged one by one like StashDbClient.query_scenes_updated_since.
+        updated_scenes = []
+        page = 1
+        while True:
+            result = await self._gql_query(
+                QUERY_SCENES_UPDATED_SINCE_QUERY + self.scene_fields_fragment,
+                {
+                    "stash_ids": performer_stash_id,
+                    "page": page,
+                    "per_page": self.page_size,
+                    "tags": await self._get_tags_filter(),
+                },
+            )
+            scenes_data = get_scenes_page(result)
+            if scenes_data is None:
+                return None
+
+            page_result = take_changed_scenes(
+                scenes_data["scenes"], since, get_scene_updated_at
+            )
+            if page_result is None:
+                return None
+            changed_scenes, reached_unchanged_scene = page_result
+            updated_scenes.extend(changed_scenes)
+            if reached_unchanged_scene or len(scenes_data["scenes"]) < self.page_size:
+                return updated_scenes, scenes_data["count"]
+            page += 1
+
+    async def _get_tags_filter(self):
+        # Resolved once like in StashDbClient._get_tags_filter.
+        async with self._tags_filter_lock:
+            if not self._tags_filter_resolved:
+                self._tags_filter = await self._resolve_tags_filter()
+                self._tags_filter_resolved = True
+            return self._tags_filter
+
+    async def _resolve_tags_filter(self):
+        if not self.excluded_tag_names:
+            return None
+
+        try:
+            result = await self._gql_query(
+                *build_find_tags_request(self.excluded_tag_names)
+            )
+        except StashboxQueryError as e:
+            return get_exclude_tags_filter(self.excluded_tag_names, None, str(e))
+        return get_exclude_tags_filter(self.excluded_tag_names, result)
+
+    async def _gql_query(self, query, variables=None):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Apikey"] = self.api_key
+        return await self._request(
+            "POST",
+            self.endpoint,
+            json={"query": query, "variables": variables},
+            headers=headers,
+        )
@@ -0,0 +1,146 @@
+from abc import ABC, abstractmethod
+import asyncio
+from datetime import datetime
+from urllib.parse import urlparse
+
+import stashapi.log as logger
+
+from RateLimiter import (
+    TRANSIENT_STATUS_CODES,
+    RateLimiter,
+    get_retry_delay,
+    parse_retry_after,
+)
+from StashboxClient import SCENE_PROJECTION_FULL, StashboxQueryError
+
+try:
+    import aiohttp
+    has_aiohttp = True
+except ImportError:
+    has_aiohttp = False
+
+
+class AsyncStashboxClient(ABC):
+    """Asynchronous counterpart of StashboxClient built on aiohttp.
+
+    All requests share one aiohttp session and at most max_in_flight of them
+    are sent at the same time, so many performers can be queried concurrently
+    from a single thread. Requests are paced by the rate limiter and retried
+    like in RateLimitedSession. The remaining pages of a listing are all
+    requested at once and only limited by max_in_flight.
+    """
+
+    # Largest page the stash-box serves, set by the subclasses.
+    max_page_size = 25
+
+    scene_projection = SCENE_PROJECTION_FULL
+
+    excluded_tag_names = ()
+
+    def __init__(
+        self,
+        endpoint,
+        api_key,
+        max_in_flight: int = 100,
+        rate_limiter: RateLimiter | None = None,
+        max_retries: int = 0,
+        page_size: int = 25,
+    ):
+        if not has_aiohttp:
+            raise RuntimeError(
+                "aiohttp is not installed. Please install it using 'pip install aiohttp'."
+            )
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.page_size = min(page_size, self.max_page_size)
+        self._session = None
+        self._semaphore = None
+
+    @abstractmethod
+    async def query_performer_image(self, performer_stash_id):
+        pass
+
+    @abstractmethod
+    async def query_studio_image(self, performer_stash_id):
+        pass
+
+    @abstractmethod
+    async def query_scenes(self, performer_stash_id):
+        pass
+
+    async def query_scenes_batch(self, performer_stash_ids):
+        """Queries the scenes of several performers concurrently, keyed by performer stash ID."""
+        scenes = await asyncio.gather(
+            *(
+                self.query_scenes(performer_stash_id)
+                for performer_stash_id in performer_stash_ids
+            )
+        )
+        return dict(zip(performer_stash_ids, scenes))
+
+    async def query_scene_details(self, scenes):
+        """Returns the scenes with every field needed to create them, in the same order."""
+        return scenes
+
+    async def query_scenes_updated_since(self, performer_stash_id, since: datetime):
+        """Queries only the scenes of a performer which changed after since.
+
+        Returns None if the stash-box does not support incremental queries,
+        like StashboxClient.query_scenes_updated_since.
+        """
+        return None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, url, **kwargs):
+        """Sends a request and returns the decoded JSON response.
+
+        Returns None if the request failed permanently and raises
+        StashboxQueryError if it kept failing transiently.
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        host = urlparse(url).netloc
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            await asyncio.sleep(self.rate_limiter.reserve(host))
+            async with self._semaphore:
+                try:
+                    async with self._session.request(method, url, **kwargs) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        if response.status not in TRANSIENT_STATUS_CODES:
+                            logger.error(
+                                f"Query failed with status code {response.status}: {await response.text()}"
+                            )
+                            return None
+                        error = f"status code {response.status}"
+                        retry_after = parse_retry_after(
+                            response.headers.get("Retry-After")
+                        )
+                        if retry_after is not None:
+                            self.rate_limiter.pause(host, retry_after)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = str(e) or type(e).__name__
+
+            if attempt == self.max_retries:
+                break
+            delay = get_retry_delay(attempt, retry_after)
+            logger.warning(
+                f"Request to {host} failed with {error}. Retrying in {delay:.1f} seconds."
+            )
+            await asyncio.sleep(delay)
+
+        raise StashboxQueryError(
+            f"Request to {host} failed after {self.max_retries + 1} attempts with {error}."
+        )
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime
+import threading
+
+from AsyncStashboxClient import AsyncStashboxClient
+from StashboxClient import StashboxClient
+
+
+class AsyncStashboxClientAdapter(StashboxClient):
+    """Drives an AsyncStashboxClient from the synchronous StashCompleter.
+
+    The async client runs on an event loop in a background thread. Batched
+    scene queries are sent to it as one coroutine so that the scenes of a whole
+    chunk of performers are fetched concurrently from that single thread, while
+    the remaining calls from the performer workers are simply awaited there.
+    """
+
+    supports_scene_batches = True
+
+    def __init__(self, async_client: AsyncStashboxClient):
+        self.async_client = async_client
+        self.endpoint = async_client.endpoint
+        self.scene_projection = async_client.scene_projection
+        self.excluded_tag_names = async_client.excluded_tag_names
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def query_performer_image(self, performer_stash_id):
+        return self._run(self.async_client.query_performer_image(performer_stash_id))
+
+    def query_studio_image(self, performer_stash_id):
+        return self._run(self.async_client.query_studio_image(performer_stash_id))
+
+    def query_scenes(self, performer_stash_id):
+        return self._run(self.async_client.query_scenes(performer_stash_id))
+
+    def query_scenes_batch(self, performer_stash_ids):
+        return self._run(self.async_client.query_scenes_batch(performer_stash_ids))
+
+    def query_scene_details(self, scenes):
+        return self._run(self.async_client.query_scene_details(scenes))
+
+    def query_scenes_updated_since(self, performer_stash_id, since: datetime):
+        return self._run(
+            self.async_client.query_scenes_updated_since(performer_stash_id, since)
+        )
+
+    def close(self):
+        self._run(self.async_client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
@@ -0,0 +1,116 @@
+import asyncio
+
+import stashapi.log as logger
+
+from AsyncStashboxClient import AsyncStashboxClient
+from RateLimiter import RateLimiter
+from TpdbClient import (
+    MAX_PAGE_SIZE,
+    build_performer_url,
+    build_scenes_page_url,
+    build_site_url,
+    get_headers,
+    get_last_page,
+    get_performer_record,
+    get_scenes_from_pages,
+    get_site_record,
+    get_site_records,
+)
+from TpdbRecordCache import PERFORMER_RECORD, SITE_RECORD, TpdbRecordCache
+
+
+class AsyncTpdbClient(AsyncStashboxClient):
+    """Asynchronous counterpart of TpdbClient.
+
+    The record cache may be backed by SQLite, so it is only accessed from
+    worker threads to keep the event loop free.
+    """
+
+    max_page_size = MAX_PAGE_SIZE
+
+    def __init__(
+        self,
+        endpoint,
+        api_key,
+        max_in_flight: int = 100,
+        rate_limiter: RateLimiter | None = None,
+        max_retries: int = 0,
+        page_size: int = 25,
+        record_cache: TpdbRecordCache | None = None,
+    ):
+        super().__init__(
+            endpoint, api_key, max_in_flight, rate_limiter, max_retries, page_size
+        )
+        self.record_cache = record_cache or TpdbRecordCache()
+        self.headers = get_headers(self.api_key)
+
+    async def query_performer_image(self, performer_stash_id):
+        performer = await self._get_performer(performer_stash_id)
+        if performer is None:
+            return None
+        return performer["image"]
+
+    async def query_studio_image(self, studio_stash_id):
+        # Sites of all scenes listed so far are known without a request.
+        site = await asyncio.to_thread(
+            self.record_cache.get, SITE_RECORD, studio_stash_id
+        )
+        if site is None:
+            site = get_site_record(
+                studio_stash_id, await self._get(build_site_url(studio_stash_id))
+            )
+            if site is None:
+                return None
+            await asyncio.to_thread(
+                self.record_cache.put, SITE_RECORD, studio_stash_id, site
+            )
+        return site["logo"]
+
+    async def query_scenes(self, performer_stash_id):
+        performer = await self._get_performer(performer_stash_id)
+        if performer is None:
+            return None
+
+        first_page = await self._query_scenes_page(performer, 1)
+        if first_page is None:
+            return None
+
+        remaining_pages = await asyncio.gather(
+            *(
+                self._query_scenes_page(performer, page)
+                for page in range(2, get_last_page(first_page) + 1)
+            )
+        )
+        return get_scenes_from_pages(performer, [first_page] + list(remaining_pages))
+
+    async def close(self):
+        await super().close()
+        await asyncio.to_thread(self.record_cache.close)
+
+    async def _query_scenes_page(self, performer, page):
+        url = build_scenes_page_url(performer, page, self.page_size)
+        logger.debug(f"Querying scenes for performer {performer['name']} from {url}")
+        scenes_data = await self._get(url)
+        if scenes_data is not None:
+            await asyncio.to_thread(
+                self.record_cache.put_many, SITE_RECORD, get_site_records(scenes_data)
+            )
+        return scenes_data
+
+    async def _get_performer(self, performer_stash_id):
+        performer = await asyncio.to_thread(
+            self.record_cache.get, PERFORMER_RECORD, performer_stash_id
+        )
+        if performer is None:
+            performer = get_performer_record(
+                performer_stash_id,
+                await self._get(build_performer_url(performer_stash_id)),
+            )
+            if performer is not None:
+                await asyncio.to_thread(
+                    self.record_cache.put, PERFORMER_RECORD, performer_stash_id, performer
+                )
+        return performer
+
+    async def _get(self, url):
+        return await self._request("GET", url, headers=self.headers)
@@ -0,0 +1,169 @@
+import stashapi.log as logger
+
+from StashboxClient import SCENE_PROJECTION_FULL, StashboxClient, parse_timestamp
+from StashboxSceneCache import StashboxSceneCache
+
+
+class CachedStashboxClient(StashboxClient):
+    """Wraps any StashboxClient and serves scene listings from a persistent cache.
+
+    Everything except query_scenes is passed through to the wrapped client.
+    Listings are cached per projection and set of tags excluded on the
+    stash-box, so that a listing is never served where it lacks fields or
+    scenes that are expected. With incremental enabled, expired listings are brought up to date with
+    only the scenes changed after the listing's watermark instead of
+    downloading the whole listing again.
+    """
+
+    def __init__(
+        self,
+        stashbox_client: StashboxClient,
+        cache: StashboxSceneCache,
+        ttl_seconds: float,
+        force_refresh: bool = False,
+        incremental: bool = False,
+    ):
+        self.stashbox_client = stashbox_client
+        self.cache = cache
+        self.ttl_seconds = ttl_seconds
+        self.force_refresh = force_refresh
+        self.incremental = incremental
+
+    def __getattr__(self, name):
+        return getattr(self.stashbox_client, name)
+
+    @property
+    def supports_scene_batches(self):
+        return self.stashbox_client.supports_scene_batches
+
+    @property
+    def scene_projection(self):
+        return self.stashbox_client.scene_projection
+
+    @property
+    def excluded_tag_names(self):
+        return self.stashbox_client.excluded_tag_names
+
+    def query_performer_image(self, performer_stash_id):
+        return self.stashbox_client.query_performer_image(performer_stash_id)
+
+    def query_studio_image(self, performer_stash_id):
+        return self.stashbox_client.query_studio_image(performer_stash_id)
+
+    def query_scene_details(self, scenes):
+        return self.stashbox_client.query_scene_details(scenes)
+
+    def close(self):
+        # The cache may be shared with other clients, closing it again is harmless.
+        self.stashbox_client.close()
+        self.cache.close()
+
+    def query_scenes(self, performer_stash_id):
+        scenes = self._query_cached_scenes(performer_stash_id)
+        if scenes is not None:
+            return scenes
+
+        scenes = self.stashbox_client.query_scenes(performer_stash_id)
+        self._put_scenes(performer_stash_id, scenes)
+        return scenes
+
+    def query_scenes_batch(self, performer_stash_ids):
+        scenes_by_performer = {}
+        uncached_performer_stash_ids = []
+        for performer_stash_id in performer_stash_ids:
+            scenes = self._query_cached_scenes(performer_stash_id)
+            if scenes is None:
+                uncached_performer_stash_ids.append(performer_stash_id)
+            else:
+                scenes_by_performer[performer_stash_id] = scenes
+
+        if uncached_performer_stash_ids:
+            queried_scenes_by_performer = self.stashbox_client.query_scenes_batch(
+                uncached_performer_stash_ids
+            )
+            for performer_stash_id, scenes in queried_scenes_by_performer.items():
+                self._put_scenes(performer_stash_id, scenes)
+            scenes_by_performer.update(queried_scenes_by_performer)
+
+        return scenes_by_performer
+
+    def _query_cached_scenes(self, performer_stash_id):
+        if self.force_refresh:
+            return None
+
+        endpoint = self._get_cache_endpoint()
+        scenes = self.cache.get(endpoint, performer_stash_id, self.ttl_seconds)
+        if scenes is not None:
+            logger.debug(
+                f"Using {len(scenes)} cached scenes for performer {performer_stash_id} from {endpoint}."
+            )
+            return scenes
+
+        if self.incremental:
+            return self._query_scenes_incrementally(performer_stash_id)
+        return None
+
+    def _put_scenes(self, performer_stash_id, scenes):
+        # Failed queries are not cached so that the next run tries again.
+        if scenes is not None:
+            self.cache.put(
+                self._get_cache_endpoint(),
+                performer_stash_id,
+                scenes,
+                self._get_watermark(scenes),
+            )
+
+    def _query_scenes_incrementally(self, performer_stash_id):
+        endpoint = self._get_cache_endpoint()
+        entry = self.cache.get_with_watermark(endpoint, performer_stash_id)
+        if entry is None:
+            return None
+        known_scenes, watermark = entry
+
+        result = self.stashbox_client.query_scenes_updated_since(
+            performer_stash_id, parse_timestamp(watermark)
+        )
+        if result is None:
+            return None
+        changed_scenes, total_scenes = result
+
+        scenes_by_id = {scene["id"]: scene for scene in known_scenes}
+        scenes_by_id.update({scene["id"]: scene for scene in changed_scenes})
+
+        # Deleted scenes never show up as changes, so a count mismatch means the
+        # merged listing is stale and a full query is needed.
+        if total_scenes is not None and len(scenes_by_id) != total_scenes:
+            logger.debug(
+                f"Incremental listing for performer {performer_stash_id} has {len(scenes_by_id)} scenes but {endpoint} reports {total_scenes}. Querying all scenes."
+            )
+            return None
+
+        scenes = list(scenes_by_id.values())
+        logger.debug(
+            f"Merged {len(changed_scenes)} changed scenes into {len(known_scenes)} cached scenes for performer {performer_stash_id} from {endpoint}."
+        )
+        self.cache.put(
+            endpoint,
+            performer_stash_id,
+            scenes,
+            self._get_watermark(scenes) or watermark,
+        )
+        return scenes
+
+    def _get_cache_endpoint(self):
+        # Unfiltered full listings keep the plain endpoint so that existing
+        # entries stay valid.
+        cache_endpoint = self.stashbox_client.endpoint
+        if self.scene_projection != SCENE_PROJECTION_FULL:
+            cache_endpoint += f"#{self.scene_projection}"
+        if self.excluded_tag_names:
+            cache_endpoint += f"#exclude={','.join(sorted(self.excluded_tag_names))}"
+        return cache_endpoint
+
+    def _get_watermark(self, scenes):
+        timestamps = [
+            timestamp
+            for timestamp in (parse_timestamp(scene.get("updated")) for scene in scenes)
+            if timestamp is not None
+        ]
+        return max(timestamps).isoformat() if timestamps else None
@@ -1,15 +1,71 @@
+from __future__ import annotations
+
+import time
+
+# Taken first so that the startup time includes the imports below.
+STARTED_AT = time.perf_counter()
+
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+import importlib
+import importlib.util
 import json
 import os
 import sys
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
 import stashapi.log as logger
-from LocalStashClient import LocalStashClient
-from MissingStashClient import MissingStashClient
-from StashCompleter import StashCompleter
-from StashDbClient import StashDbClient
-from TpdbClient import TpdbClient
+from HookEventQueue import HookEventQueue
+from HookWorker import (
+    HOOK_EVENT_TYPES,
+    HookWorker,
+    forward_hook_event,
+    get_hook_scene_id,
+    spawn_hook_worker,
+)
+from StashConfigurationProbe import (
+    LOCAL_CONFIGURATION_FRAGMENT,
+    MISSING_CONFIGURATION_FRAGMENT,
+    fetch_plugin_settings,
+)
+
+# Everything which pulls in requests, stashapi.stashapp or the stash-box
+# clients is imported only by the modes which need it, as hooks start the
+# plugin for every scene save.
+if TYPE_CHECKING:
+    from LocalStashClient import LocalStashClient, PerformerImageOptions
+    from PerformerImageCache import PerformerImageCache
+    from RateLimiter import RateLimiter
+    from StashCompleter import StashCompleter
+    from StashboxClient import StashboxClient
+    from StashboxSceneCache import StashboxSceneCache
+    from SyncPlan import SyncPlan
+    from TpdbRecordCache import TpdbRecordCache
+
+MODE_MODULES = {
+    "hooks": [
+        "LocalStashClient",
+        "MissingStashClient",
+        "SourceLogger",
+        "StashCompleter",
+    ],
+    "process_performers": [
+        "CachedStashboxClient",
+        "HttpSession",
+        "LocalStashClient",
+        "MissingStashClient",
+        "PerformerImageCache",
+        "RateLimiter",
+        "SourceLogger",
+        "StashCompleter",
+        "StashboxSceneCache",
+        "StashDbClient",
+        "SyncPlan",
+        "TpdbClient",
+        "TpdbRecordCache",
+    ],
+}
 
 
 @dataclass
@@ -26,6 +82,50 @@ class CompleteTheStashConfiguration:
     stashDbSceneSource: MissingSceneSource
     tpdbSceneSource: MissingSceneSource
     enableSceneHooks: bool
+    performerConcurrency: int
+    connectionPoolSize: int
+    stashboxCacheTtlHours: float
+    stashboxCacheMaxEntries: int
+    incrementalSync: bool
+    stashboxBatchSize: int
+    sceneBatchSize: int
+    performerImageCacheSizeMb: float
+    imageDownloadConcurrency: int
+    performerImageMaxSizeMb: float
+    performerImageMaxDimension: int
+    useAsyncClients: bool
+    asyncMaxInFlight: int
+    stashboxRequestsPerSecond: float
+    stashboxMaxRetries: int
+    useHookWorker: bool
+    hookWorkerIdleMinutes: float
+    hookDebounceSeconds: float
+    tpdbRecordCacheTtlHours: float
+    stashboxPageConcurrency: int
+    stashboxPageSize: int
+
+
+STASHBOX_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "stashbox-cache.sqlite"
+)
+PERFORMER_IMAGE_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "performer-images"
+)
+HOOK_WORKER_STATE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "hook-worker.json"
+)
+HOOK_EVENT_QUEUE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "hook-events.sqlite"
+)
+HOOK_WORKER_LOG_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "hook-worker.log"
+)
+TPDB_RECORD_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "tpdb-records.sqlite"
+)
+SYNC_PLAN_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), ".cache", "sync-plans"
+)
 
 
 def parse_url(url):
@@ -46,6 +146,37 @@ def check_stash_instances_are_unique(local_configuration, missing_configuration)
         )
 
 
+def parse_positive_int(value, setting_name, default):
+    if value is None or value == "":
+        return default
+    try:
+        parsed_value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{setting_name} must be a whole number, got '{value}'.")
+    if parsed_value < 1:
+        raise ValueError(f"{setting_name} must be at least 1, got {parsed_value}.")
+    return parsed_value
+
+
+def parse_positive_number(value, setting_name, default):
+    parsed_value = parse_non_negative_number(value, setting_name, default)
+    if parsed_value == 0:
+        raise ValueError(f"{setting_name} must be greater than 0, got {parsed_value}.")
+    return parsed_value
+
+
+def parse_non_negative_number(value, setting_name, default):
+    if value is None or value == "":
+        return default
+    try:
+        parsed_value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{setting_name} must be a number, got '{value}'.")
+    if parsed_value < 0:
+        raise ValueError(f"{setting_name} must not be negative, got {parsed_value}.")
+    return parsed_value
+
+
 def get_json_input():
     if os.getenv("ENABLE_DEV_MODE"):
         import dotenv
@@ -123,8 +254,137 @@ def get_complete_the_stash_config(local_configuration) -> CompleteTheStashConfig
             )
 
     performer_tags = complete_the_stash_config.get("performerTags").split(",")
-    scene_exclude_tags = complete_the_stash_config.get("sceneExcludeTags", "").split(
-        ","
+    scene_exclude_tags = [
+        tag.strip()
+        for tag in complete_the_stash_config.get("sceneExcludeTags", "").split(",")
+        if tag.strip()
+    ]
+
+    performer_concurrency = parse_positive_int(
+        complete_the_stash_config.get("performerConcurrency"),
+        "Performer concurrency",
+        default=1,
+    )
+
+    stashbox_page_concurrency = parse_positive_int(
+        complete_the_stash_config.get("stashboxPageConcurrency"),
+        "Stash-box page concurrency",
+        default=4,
+    )
+
+    from HttpSession import DEFAULT_POOL_SIZE
+
+    # Every worker needs its own connection so the pool must be at least as
+    # large as the concurrency used anywhere in the plugin. Each performer
+    # worker fetches pages with several requests at once.
+    connection_pool_size = max(
+        parse_positive_int(
+            complete_the_stash_config.get("connectionPoolSize"),
+            "Connection pool size",
+            default=DEFAULT_POOL_SIZE,
+        ),
+        performer_concurrency * stashbox_page_concurrency,
+    )
+
+    stashbox_cache_ttl_hours = parse_non_negative_number(
+        complete_the_stash_config.get("stashboxCacheTtlHours"),
+        "Stash-box cache TTL",
+        default=0,
+    )
+    stashbox_cache_max_entries = parse_positive_int(
+        complete_the_stash_config.get("stashboxCacheMaxEntries"),
+        "Stash-box cache size",
+        default=1000,
+    )
+
+    stashbox_batch_size = parse_positive_int(
+        complete_the_stash_config.get("stashboxBatchSize"),
+        "Stash-box batch size",
+        default=10,
+    )
+
+    scene_batch_size = parse_positive_int(
+        complete_the_stash_config.get("sceneBatchSize"),
+        "Scene batch size",
+        default=25,
+    )
+
+    performer_image_cache_size_mb = parse_non_negative_number(
+        complete_the_stash_config.get("performerImageCacheSizeMb"),
+        "Performer image cache size",
+        default=200,
+    )
+
+    image_download_concurrency = parse_positive_int(
+        complete_the_stash_config.get("imageDownloadConcurrency"),
+        "Image download concurrency",
+        default=4,
+    )
+
+    performer_image_max_size_mb = parse_positive_number(
+        complete_the_stash_config.get("performerImageMaxSizeMb"),
+        "Performer image maximum size",
+        default=20,
+    )
+
+    performer_image_max_dimension = int(
+        parse_non_negative_number(
+            complete_the_stash_config.get("performerImageMaxDimension"),
+            "Performer image maximum dimension",
+            default=0,
+        )
+    )
+
+    use_async_clients = complete_the_stash_config.get("useAsyncClients", False)
+    if use_async_clients and importlib.util.find_spec("aiohttp") is None:
+        logger.warning(
+            "aiohttp is not installed so the async stash-box clients cannot be used. Please install it using 'pip install aiohttp'."
+        )
+        use_async_clients = False
+
+    async_max_in_flight = parse_positive_int(
+        complete_the_stash_config.get("asyncMaxInFlight"),
+        "Async requests in flight",
+        default=100,
+    )
+
+    stashbox_requests_per_second = parse_non_negative_number(
+        complete_the_stash_config.get("stashboxRequestsPerSecond"),
+        "Stash-box requests per second",
+        default=0,
+    )
+
+    stashbox_max_retries = int(
+        parse_non_negative_number(
+            complete_the_stash_config.get("stashboxMaxRetries"),
+            "Stash-box retries",
+            default=5,
+        )
+    )
+
+    hook_worker_idle_minutes = parse_non_negative_number(
+        complete_the_stash_config.get("hookWorkerIdleMinutes"),
+        "Hook worker idle timeout",
+        default=30,
+    )
+
+    hook_debounce_seconds = parse_non_negative_number(
+        complete_the_stash_config.get("hookDebounceSeconds"),
+        "Scene hook debounce",
+        default=2,
+    )
+
+    tpdb_record_cache_ttl_hours = parse_non_negative_number(
+        complete_the_stash_config.get("tpdbRecordCacheTtlHours"),
+        "TPDB record cache duration",
+        default=24,
+    )
+
+    # The clients cap the page size at what their stash-box serves.
+    stashbox_page_size = parse_positive_int(
+        complete_the_stash_config.get("stashboxPageSize"),
+        "Stash-box page size",
+        default=25,
     )
 
     stash_db_configuration = None
@@ -153,10 +413,33 @@ def get_complete_the_stash_config(local_configuration) -> CompleteTheStashConfig
         stashDbSceneSource=stash_db_configuration,
         tpdbSceneSource=tpdb_configuration,
         enableSceneHooks=complete_the_stash_config.get("enableSceneHooks", False),
+        performerConcurrency=performer_concurrency,
+        connectionPoolSize=connection_pool_size,
+        stashboxCacheTtlHours=stashbox_cache_ttl_hours,
+        stashboxCacheMaxEntries=stashbox_cache_max_entries,
+        incrementalSync=complete_the_stash_config.get("incrementalSync", False),
+        stashboxBatchSize=stashbox_batch_size,
+        sceneBatchSize=scene_batch_size,
+        performerImageCacheSizeMb=performer_image_cache_size_mb,
+        imageDownloadConcurrency=image_download_concurrency,
+        performerImageMaxSizeMb=performer_image_max_size_mb,
+        performerImageMaxDimension=performer_image_max_dimension,
+        useAsyncClients=use_async_clients,
+        asyncMaxInFlight=async_max_in_flight,
+        stashboxRequestsPerSecond=stashbox_requests_per_second,
+        stashboxMaxRetries=stashbox_max_retries,
+        useHookWorker=complete_the_stash_config.get("useHookWorker", False),
+        hookWorkerIdleMinutes=hook_worker_idle_minutes,
+        hookDebounceSeconds=hook_debounce_seconds,
+        tpdbRecordCacheTtlHours=tpdb_record_cache_ttl_hours,
+        stashboxPageConcurrency=stashbox_page_concurrency,
+        stashboxPageSize=stashbox_page_size,
     )
 
 
 def create_missing_stash_client(missingSceneSource: MissingSceneSource):
+    from MissingStashClient import MissingStashClient
+
     scheme, host, port = parse_url(missingSceneSource.stashappAddress)
     return MissingStashClient(
         scheme,
@@ -168,112 +451,448 @@ def create_missing_stash_client(missingSceneSource: MissingSceneSource):
     )
 
 
+def create_stashbox_cache(
+    complete_the_stash_config: CompleteTheStashConfiguration,
+) -> StashboxSceneCache | None:
+    if not complete_the_stash_config.stashboxCacheTtlHours:
+        if complete_the_stash_config.incrementalSync:
+            logger.warning(
+                "Incremental sync requires the scene listing cache. Set the cache duration to enable it."
+            )
+        return None
+
+    from StashboxSceneCache import StashboxSceneCache
+
+    return StashboxSceneCache(
+        STASHBOX_CACHE_PATH, complete_the_stash_config.stashboxCacheMaxEntries
+    )
+
+
+def create_performer_image_cache(
+    complete_the_stash_config: CompleteTheStashConfiguration,
+) -> PerformerImageCache | None:
+    if not complete_the_stash_config.performerImageCacheSizeMb:
+        return None
+
+    from PerformerImageCache import PerformerImageCache
+
+    return PerformerImageCache(
+        PERFORMER_IMAGE_CACHE_DIR,
+        int(complete_the_stash_config.performerImageCacheSizeMb * 1024 * 1024),
+    )
+
+
+def create_tpdb_record_cache(
+    complete_the_stash_config: CompleteTheStashConfiguration,
+) -> TpdbRecordCache:
+    from TpdbRecordCache import TpdbRecordCache
+
+    # Without a duration the records are only kept in memory for this run.
+    return TpdbRecordCache(
+        TPDB_RECORD_CACHE_PATH,
+        complete_the_stash_config.tpdbRecordCacheTtlHours * 3600,
+    )
+
+
+def create_performer_image_options(
+    complete_the_stash_config: CompleteTheStashConfiguration,
+) -> PerformerImageOptions:
+    from LocalStashClient import PerformerImageOptions
+
+    return PerformerImageOptions(
+        cache=create_performer_image_cache(complete_the_stash_config),
+        download_workers=complete_the_stash_config.imageDownloadConcurrency,
+        max_size_bytes=int(
+            complete_the_stash_config.performerImageMaxSizeMb * 1024 * 1024
+        ),
+        max_dimension=complete_the_stash_config.performerImageMaxDimension or None,
+    )
+
+
+def get_stashbox_batch_size(
+    complete_the_stash_config: CompleteTheStashConfiguration,
+) -> int:
+    # The async clients query every performer of a batch concurrently, so a
+    # batch should be large enough to keep all allowed requests in flight.
+    if complete_the_stash_config.useAsyncClients:
+        return max(
+            complete_the_stash_config.stashboxBatchSize,
+            complete_the_stash_config.asyncMaxInFlight,
+        )
+    return complete_the_stash_config.stashboxBatchSize
+
+
+def create_stashbox_client(
+    source_name,
+    stashbox_config,
+    complete_the_stash_config: CompleteTheStashConfiguration,
+    stashbox_session,
+    stashbox_rate_limiter: RateLimiter,
+) -> StashboxClient:
+    endpoint = stashbox_config["endpoint"]
+    api_key = stashbox_config["api_key"]
+    if complete_the_stash_config.useAsyncClients:
+        from AsyncStashboxClientAdapter import AsyncStashboxClientAdapter
+        from AsyncStashDbClient import AsyncStashDbClient
+        from AsyncTpdbClient import AsyncTpdbClient
+
+        async_client_options = (
+            endpoint,
+            api_key,
+            complete_the_stash_config.asyncMaxInFlight,
+            stashbox_rate_limiter,
+            complete_the_stash_config.stashboxMaxRetries,
+            complete_the_stash_config.stashboxPageSize,
+        )
+        if source_name == "TPDB":
+            return AsyncStashboxClientAdapter(
+                AsyncTpdbClient(
+                    *async_client_options,
+                    create_tpdb_record_cache(complete_the_stash_config),
+                )
+            )
+        return AsyncStashboxClientAdapter(
+            AsyncStashDbClient(
+                *async_client_options,
+                exclude_tag_names=complete_the_stash_config.sceneExcludeTags,
+            )
+        )
+    if source_name == "TPDB":
+        from TpdbClient import TpdbClient
+
+        return TpdbClient(
+            endpoint,
+            api_key,
+            stashbox_session,
+            create_tpdb_record_cache(complete_the_stash_config),
+            complete_the_stash_config.stashboxPageSize,
+            complete_the_stash_config.stashboxPageConcurrency,
+        )
+
+    from StashDbClient import StashDbClient
+
+    return StashDbClient(
+        endpoint,
+        api_key,
+        stashbox_session,
+        complete_the_stash_config.stashboxBatchSize,
+        complete_the_stash_config.stashboxPageSize,
+        complete_the_stash_config.stashboxPageConcurrency,
+        exclude_tag_names=complete_the_stash_config.sceneExcludeTags,
+    )
+
+
+def wrap_with_cache(
+    stashbox_client: StashboxClient,
+    stashbox_cache: StashboxSceneCache | None,
+    complete_the_stash_config: CompleteTheStashConfiguration,
+    force_refresh: bool,
+) -> StashboxClient:
+    if stashbox_cache is None:
+        return stashbox_client
+
+    from CachedStashboxClient import CachedStashboxClient
+
+    return CachedStashboxClient(
+        stashbox_client,
+        stashbox_cache,
+        complete_the_stash_config.stashboxCacheTtlHours * 3600,
+        force_refresh,
+        complete_the_stash_config.incrementalSync,
+    )
+
+
 def process_input(json_input, stash_completer: StashCompleter):
+    logger = stash_completer.logger
     logger.debug(f"Processing input: {json_input}")
-    event_type = json_input.get("args", {}).get("hookContext", {}).get("type")
     if json_input.get("args", {}).get("mode") == "process_performers":
         logger.info(f"Processing performers for endpoint {stash_completer.stashbox_client.endpoint}.")
-        stash_completer.process_performers()
-    elif event_type in ["Scene.Create.Post", "Scene.Update.Post"]:
-        try:
-            scene_id = json_input.get("args", {}).get("hookContext", {}).get("id")
-        except AttributeError:
-            scene_id = None
-
-        if scene_id is None:
-            logger.debug(
-                f"Scene ID is not provided in the input for type {event_type}. Skipping."
-            )
-            return
-
-        logger.debug(f"Processing scene create type {event_type} for scene {scene_id} for endpoint {stash_completer.stashbox_client.endpoint}.")
-        stash_completer.process_scene_by_id(scene_id)
+        sync_plan = stash_completer.plan_sync()
+        if json_input.get("args", {}).get("dryRun", False):
+            sync_plan_path = write_sync_plan(sync_plan)
+            logger.info(f"Dry run, nothing was changed. The plan was written to {sync_plan_path}.")
+        else:
+            stash_completer.apply_sync_plan(sync_plan)
     else:
         logger.error(f"Invalid input: {json_input}")
 
 
-def execute():
-    json_input = get_json_input()
-    logger.debug(f"Input: {json_input}")
+def write_sync_plan(sync_plan: SyncPlan) -> str:
+    os.makedirs(SYNC_PLAN_DIR, exist_ok=True)
+    sync_plan_path = os.path.join(
+        SYNC_PLAN_DIR, f"{urlparse(sync_plan.endpoint).hostname}.json"
+    )
+    with open(sync_plan_path, "w") as sync_plan_file:
+        json.dump(sync_plan.to_dict(), sync_plan_file, indent=2)
+    return sync_plan_path
 
-    local_stash_client = LocalStashClient(json_input["server_connection"], logger)
-    local_configuration = local_stash_client.get_configuration()
-    logger.debug(f"Local configuration: {local_configuration}")
 
-    complete_the_stash_config = get_complete_the_stash_config(local_configuration)
+def create_hook_event_queue(
+    complete_the_stash_config: CompleteTheStashConfiguration,
+) -> HookEventQueue:
+    return HookEventQueue(
+        HOOK_EVENT_QUEUE_PATH, complete_the_stash_config.hookDebounceSeconds
+    )
+
+
+def drain_hook_events(hook_event_queue: HookEventQueue, get_stash_completers):
+    """Processes queued scene hooks in batches until none are left to claim.
 
-    # Stop processing as soon as possible to improve performance if scene hooks are disabled.
+    The StashCompleters are only requested once there is something to do, as
+    creating them connects to every missing Stash.
+    """
+    stash_completers = None
+    while True:
+        claimed_at, scene_ids = hook_event_queue.claim()
+        if not scene_ids:
+            return
+        if stash_completers is None:
+            stash_completers = get_stash_completers()
+        logger.info(f"Processing scene hooks of {len(scene_ids)} scenes.")
+        run_for_all_sources(
+            lambda stash_completer: stash_completer.process_scenes_by_ids(scene_ids),
+            stash_completers,
+        )
+        hook_event_queue.complete(claimed_at, scene_ids)
+
+
+def process_hook_event(json_input, hook_event_queue: HookEventQueue, get_stash_completers):
     event_type = json_input.get("args", {}).get("hookContext", {}).get("type")
-    if event_type in ["Scene.Create.Post", "Scene.Update.Post"] and not complete_the_stash_config.enableSceneHooks:
+    scene_id = get_hook_scene_id(json_input)
+    if scene_id is None:
+        logger.debug(
+            f"Scene ID is not provided in the input for type {event_type}. Skipping."
+        )
         return
 
-    # StashDB
-    if complete_the_stash_config.stashDbSceneSource:
-        missing_stash_client = create_missing_stash_client(
-            complete_the_stash_config.stashDbSceneSource
+    logger.debug(f"Queueing {event_type} event for scene {scene_id}.")
+    hook_event_queue.put(scene_id)
+    drain_hook_events(hook_event_queue, get_stash_completers)
+
+
+def create_stash_completers(
+    json_input,
+    local_stash_client: LocalStashClient,
+    local_configuration,
+    complete_the_stash_config: CompleteTheStashConfiguration,
+    mode: str,
+) -> list[StashCompleter]:
+    """Creates a StashCompleter per source with the clients the given mode needs.
+
+    Scene hooks only touch the local and missing Stash, so their completers
+    come without stash-box clients and caches.
+    """
+    from SourceLogger import ProgressAggregator, SourceLogger
+    from StashCompleter import StashCompleter
+
+    process_performers = mode == "process_performers"
+    performer_image_options = None
+    if process_performers:
+        from HttpSession import create_pooled_session
+        from RateLimiter import RateLimiter
+
+        # Both stash-box clients share one keep-alive connection pool.
+        # Requests to each stash-box are paced by one shared rate limiter.
+        stashbox_rate_limiter = RateLimiter(
+            complete_the_stash_config.stashboxRequestsPerSecond
+        )
+        stashbox_session = create_pooled_session(
+            complete_the_stash_config.connectionPoolSize,
+            stashbox_rate_limiter,
+            complete_the_stash_config.stashboxMaxRetries,
+        )
+
+        stashbox_cache = create_stashbox_cache(complete_the_stash_config)
+        force_refresh = bool(json_input.get("args", {}).get("forceRefresh", False))
+        performer_image_options = create_performer_image_options(
+            complete_the_stash_config
         )
-        missing_configuration = missing_stash_client.get_configuration()
 
+    scene_sources = [
+        (source_name, scene_source)
+        for source_name, scene_source in [
+            ("StashDB", complete_the_stash_config.stashDbSceneSource),
+            ("TPDB", complete_the_stash_config.tpdbSceneSource),
+        ]
+        if scene_source
+    ]
+    progress_aggregator = ProgressAggregator(
+        logger, [source_name for source_name, _ in scene_sources]
+    )
+
+    stash_completers = []
+    for source_name, scene_source in scene_sources:
+        missing_stash_client = create_missing_stash_client(scene_source)
+
+        missing_configuration = missing_stash_client.get_configuration(
+            MISSING_CONFIGURATION_FRAGMENT
+        )
         check_stash_instances_are_unique(local_configuration, missing_configuration)
 
         stashbox_config = get_matching_stashbox_config(
-            local_configuration, complete_the_stash_config.stashDbSceneSource
-        )
-        stashbox_client = StashDbClient(
-            stashbox_config["endpoint"],
-            stashbox_config["api_key"],
+            local_configuration, scene_source
         )
+        stashbox_client = None
+        if process_performers:
+            stashbox_client = wrap_with_cache(
+                create_stashbox_client(
+                    source_name,
+                    stashbox_config,
+                    complete_the_stash_config,
+                    stashbox_session,
+                    stashbox_rate_limiter,
+                ),
+                stashbox_cache,
+                complete_the_stash_config,
+                force_refresh,
+            )
 
         config = {
             "performerTags": complete_the_stash_config.performerTags,
-            "stashboxEndpoint": complete_the_stash_config.stashDbSceneSource.stashboxEndpoint,
+            "stashboxEndpoint": scene_source.stashboxEndpoint,
             "sceneExcludeTags": complete_the_stash_config.sceneExcludeTags,
             "enableSceneHooks": complete_the_stash_config.enableSceneHooks,
+            "performerConcurrency": complete_the_stash_config.performerConcurrency,
+            "stashboxBatchSize": get_stashbox_batch_size(complete_the_stash_config),
+            "sceneBatchSize": complete_the_stash_config.sceneBatchSize,
         }
-        stash_completer = StashCompleter(
-            config,
-            logger,
-            stashbox_client,
-            local_stash_client,
-            missing_stash_client,
+        stash_completers.append(
+            StashCompleter(
+                config,
+                SourceLogger(logger, source_name, progress_aggregator),
+                stashbox_client,
+                local_stash_client,
+                missing_stash_client,
+                performer_image_options,
+            )
         )
-        process_input(json_input, stash_completer)
 
-    # TPDB
-    if complete_the_stash_config.tpdbSceneSource:
-        missing_stash_client = create_missing_stash_client(
-            complete_the_stash_config.tpdbSceneSource
-        )
-        missing_configuration = missing_stash_client.get_configuration()
+    return stash_completers
 
-        check_stash_instances_are_unique(local_configuration, missing_configuration)
 
-        stashbox_config = get_matching_stashbox_config(
-            local_configuration, complete_the_stash_config.tpdbSceneSource
-        )
-        stashbox_client = TpdbClient(
-            stashbox_config["endpoint"],
-            stashbox_config["api_key"],
+def run_for_all_sources(func, stash_completers: list[StashCompleter]):
+    # The sources query different stash-boxes and write to different missing
+    # Stash instances, so they are processed side by side.
+    if len(stash_completers) == 1:
+        func(stash_completers[0])
+        return
+    with ThreadPoolExecutor(max_workers=len(stash_completers)) as executor:
+        futures = [
+            executor.submit(func, stash_completer)
+            for stash_completer in stash_completers
+        ]
+        for future in futures:
+            future.result()
+
+
+def import_mode_modules(mode: str):
+    """Imports the modules of a mode up front and logs how long that took."""
+    imports_started_at = time.perf_counter()
+    for module_name in MODE_MODULES[mode]:
+        importlib.import_module(module_name)
+    imported_at = time.perf_counter()
+    logger.debug(
+        f"Imported modules for {mode} in {(imported_at - imports_started_at) * 1000:.0f} ms, "
+        f"{(imported_at - STARTED_AT) * 1000:.0f} ms after start."
+    )
+
+
+def load_stash_completers(json_input, mode: str):
+    """Connects to every Stash and returns the configuration and a StashCompleter per source."""
+    import_mode_modules(mode)
+    from LocalStashClient import LocalStashClient
+
+    local_stash_client = LocalStashClient(json_input["server_connection"], logger)
+    local_configuration = local_stash_client.get_configuration(
+        LOCAL_CONFIGURATION_FRAGMENT
+    )
+    logger.debug(f"Local configuration: {local_configuration}")
+
+    complete_the_stash_config = get_complete_the_stash_config(local_configuration)
+    return complete_the_stash_config, create_stash_completers(
+        json_input,
+        local_stash_client,
+        local_configuration,
+        complete_the_stash_config,
+        mode,
+    )
+
+
+def run_hook_worker():
+    json_input = get_json_input()
+    hook_worker = HookWorker(
+        lambda json_input: load_stash_completers(json_input, "hooks"),
+        create_hook_event_queue,
+        drain_hook_events,
+        HOOK_WORKER_STATE_PATH,
+        logger,
+    )
+    hook_worker.serve(json_input)
+
+
+def execute_hook(json_input):
+    event_type = json_input.get("args", {}).get("hookContext", {}).get("type")
+
+    # A running hook worker has everything loaded already, so the event is
+    # handed over before connecting to any Stash.
+    if forward_hook_event(json_input, HOOK_WORKER_STATE_PATH):
+        logger.debug(
+            f"Forwarded {event_type} event to the hook worker {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms after start."
         )
+        return
 
-        config = {
-            "performerTags": complete_the_stash_config.performerTags,
-            "stashboxEndpoint": complete_the_stash_config.tpdbSceneSource.stashboxEndpoint,
-            "sceneExcludeTags": complete_the_stash_config.sceneExcludeTags,
-            "enableSceneHooks": complete_the_stash_config.enableSceneHooks,
-        }
-        stash_completer = StashCompleter(
-            config,
-            logger,
-            stashbox_client,
-            local_stash_client,
-            missing_stash_client,
+    # Stop processing as soon as possible to improve performance if scene
+    # hooks are disabled. Only the settings of this plugin are fetched for
+    # that, without loading any clients.
+    plugin_settings = fetch_plugin_settings(json_input["server_connection"])
+    if not plugin_settings.get("enableSceneHooks"):
+        return
+
+    if plugin_settings.get("useHookWorker"):
+        spawn_hook_worker(
+            json_input,
+            os.path.realpath(__file__),
+            HOOK_WORKER_STATE_PATH,
+            HOOK_WORKER_LOG_PATH,
         )
-        process_input(json_input, stash_completer)
 
+    # Stash waits for each hook process to exit before running the next one,
+    # so no further event can arrive while waiting here. The queue is drained
+    # right away and only the hook worker debounces events. Events left over
+    # by a failed process are processed along with this one.
+    process_hook_event(
+        json_input,
+        HookEventQueue(HOOK_EVENT_QUEUE_PATH, debounce_seconds=0),
+        lambda: load_stash_completers(json_input, "hooks")[1],
+    )
+
+
+def execute():
+    json_input = get_json_input()
+    logger.debug(f"Input: {json_input}")
+
+    event_type = json_input.get("args", {}).get("hookContext", {}).get("type")
+    if event_type in HOOK_EVENT_TYPES:
+        execute_hook(json_input)
+        return
+
+    _, stash_completers = load_stash_completers(json_input, "process_performers")
+    try:
+        run_for_all_sources(
+            lambda stash_completer: process_input(json_input, stash_completer),
+            stash_completers,
+        )
+    finally:
+        # The async clients hold an aiohttp session and an event loop thread,
+        # and the caches hold SQLite connections.
+        for stash_completer in stash_completers:
+            stash_completer.stashbox_client.close()
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.realpath(__file__))
     sys.path.append(script_dir)
 
-    execute()
+    if "--hook-worker" in sys.argv:
+        run_hook_worker()
+    else:
+        execute()
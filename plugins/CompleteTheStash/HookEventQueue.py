@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+# Claims older than this are assumed to belong to a process which died while
+# processing them, so their events are handed out again.
+STALE_CLAIM_SECONDS = 300.0
+
+# Number of scenes processed with one set of requests.
+DEFAULT_BATCH_SIZE = 200
+
+# Events are handed out after this long even if new events keep arriving.
+MAX_DEBOUNCE_SECONDS = 60.0
+
+CLAIMABLE_CONDITION = "(claimed_at IS NULL OR claimed_at < ?)"
+
+
+class HookEventQueue:
+    """Durable SQLite queue of local scene IDs whose scene hooks still need processing.
+
+    Several events for the same scene are coalesced into one entry. Events are
+    only handed out once no new event has arrived for debounce_seconds, or
+    after MAX_DEBOUNCE_SECONDS at the latest, so a
+    bulk edit in Stash is processed in a few large batches instead of scene by
+    scene. Claimed events are deleted once they have been processed; events of
+    a process which dies in between are processed again later.
+    """
+
+    def __init__(self, database_path: str, debounce_seconds: float):
+        os.makedirs(os.path.dirname(database_path), exist_ok=True)
+        self.debounce_seconds = debounce_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            database_path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    scene_id TEXT PRIMARY KEY,
+                    queued_at REAL NOT NULL,
+                    claimed_at REAL
+                )
+                """
+            )
+
+    def put(self, scene_id) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO events (scene_id, queued_at, claimed_at) VALUES (?, ?, NULL)
+                ON CONFLICT (scene_id) DO UPDATE SET queued_at = excluded.queued_at, claimed_at = NULL
+                """,
+                (str(scene_id), time.time()),
+            )
+
+    def seconds_until_ready(self) -> float | None:
+        """Returns how long until the pending events settle, or None if there are none."""
+        with self._lock:
+            first_queued_at, last_queued_at = self._connection.execute(
+                f"SELECT MIN(queued_at), MAX(queued_at) FROM events WHERE {CLAIMABLE_CONDITION}",
+                (time.time() - STALE_CLAIM_SECONDS,),
+            ).fetchone()
+        if last_queued_at is None:
+            return None
+        ready_at = min(
+            last_queued_at + self.debounce_seconds,
+            first_queued_at + MAX_DEBOUNCE_SECONDS,
+        )
+        return max(ready_at - time.time(), 0.0)
+
+    def claim(self, limit: int = DEFAULT_BATCH_SIZE) -> tuple[float, list[str]]:
+        """Claims up to limit settled events and returns the claim time and scene IDs."""
+        now = time.time()
+        with self._lock, self._connection:
+            # BEGIN IMMEDIATE keeps other processes from claiming the same events.
+            self._connection.execute("BEGIN IMMEDIATE")
+            first_queued_at, last_queued_at = self._connection.execute(
+                f"SELECT MIN(queued_at), MAX(queued_at) FROM events WHERE {CLAIMABLE_CONDITION}",
+                (now - STALE_CLAIM_SECONDS,),
+            ).fetchone()
+            if last_queued_at is None or (
+                now - last_queued_at < self.debounce_seconds
+                and now - first_queued_at < MAX_DEBOUNCE_SECONDS
+            ):
+                return now, []
+
+            scene_ids = [
+                row[0]
+                for row in self._connection.execute(
+                    f"SELECT scene_id FROM events WHERE {CLAIMABLE_CONDITION} ORDER BY queued_at LIMIT ?",
+                    (now - STALE_CLAIM_SECONDS, limit),
+                )
+            ]
+            self._connection.executemany(
+                "UPDATE events SET claimed_at = ? WHERE scene_id = ?",
+                [(now, scene_id) for scene_id in scene_ids],
+            )
+        return now, scene_ids
+
+    def complete(self, claimed_at: float, scene_ids: list[str]) -> None:
+        # Scenes which got a new event while they were processed stay queued.
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM events WHERE scene_id = ? AND claimed_at = ?",
+                [(scene_id, claimed_at) for scene_id in scene_ids],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
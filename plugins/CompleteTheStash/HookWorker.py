@@ -0,0 +1,233 @@
+import hmac
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+HOOK_EVENT_TYPES = ["Scene.Create.Post", "Scene.Update.Post"]
+
+# How long forwarding waits for the worker before the hook handles the event itself.
+FORWARD_TIMEOUT_SECONDS = 2.0
+
+# A worker which was spawned this recently is assumed to be still starting up.
+SPAWN_GRACE_SECONDS = 30.0
+
+CONFIG_REFRESH_SECONDS = 300.0
+
+
+def get_hook_scene_id(json_input):
+    hook_context = json_input.get("args", {}).get("hookContext")
+    if not isinstance(hook_context, dict):
+        return None
+    return hook_context.get("id")
+
+
+def forward_hook_event(json_input, state_path) -> bool:
+    """Hands a hook event to a running hook worker.
+
+    Returns False if there is no worker or it did not accept the event, in
+    which case the caller has to process the event itself.
+    """
+    try:
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+        with socket.create_connection(
+            ("127.0.0.1", state["port"]), timeout=FORWARD_TIMEOUT_SECONDS
+        ) as connection:
+            message = {"token": state["token"], "input": json_input}
+            connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+            reply = connection.makefile("r", encoding="utf-8").readline()
+        return json.loads(reply).get("status") == "queued"
+    except (OSError, ValueError, KeyError, AttributeError):
+        return False
+
+
+def spawn_hook_worker(json_input, script_path, state_path, log_path) -> None:
+    """Starts a detached hook worker unless one is already starting up."""
+    spawn_marker_path = f"{state_path}.spawn"
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    try:
+        if time.time() - os.path.getmtime(spawn_marker_path) < SPAWN_GRACE_SECONDS:
+            return
+    except OSError:
+        pass
+    with open(spawn_marker_path, "w"):
+        pass
+
+    if sys.platform == "win32":
+        detach_options = {
+            "creationflags": subprocess.DETACHED_PROCESS
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+        }
+    else:
+        detach_options = {"start_new_session": True}
+
+    with open(log_path, "ab") as log_file:
+        process = subprocess.Popen(
+            [sys.executable, script_path, "--hook-worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=log_file,
+            close_fds=True,
+            **detach_options,
+        )
+    # The worker gets the same input as the hook so that it can connect to the
+    # local Stash with the session of the plugin.
+    process.stdin.write(json.dumps(json_input).encode("utf-8"))
+    process.stdin.close()
+
+
+class HookWorker:
+    """Long-lived process which handles scene hook events forwarded by the plugin.
+
+    The Stash connections, configuration and clients are loaded once and
+    reloaded every CONFIG_REFRESH_SECONDS, so an event costs only the requests
+    needed to process it. The worker listens on localhost only, accepts events
+    carrying the token from its state file and exits after being idle for
+    hookWorkerIdleMinutes or when the hook worker is disabled.
+
+    Accepted events go to the durable hook event queue right away and are
+    drained in batches, so events which are not processed yet when the worker
+    stops are picked up by the next worker or hook.
+    """
+
+    def __init__(
+        self,
+        load_stash_completers,
+        create_hook_event_queue,
+        drain_hook_events,
+        state_path,
+        logger,
+    ):
+        self.load_stash_completers = load_stash_completers
+        self.create_hook_event_queue = create_hook_event_queue
+        self.drain_hook_events = drain_hook_events
+        self.state_path = state_path
+        self.logger = logger
+        self.token = secrets.token_hex(32)
+        self._hook_event_queue = None
+        self._latest_input = None
+        self._stopped = threading.Event()
+        self._last_event_at = time.monotonic()
+        self._server_connection = None
+        self._loaded_at = 0.0
+        self._config = None
+        self._stash_completers = []
+
+    def serve(self, json_input):
+        self._load(json_input)
+        if not self._is_enabled():
+            return
+        self._latest_input = json_input
+        self._hook_event_queue = self.create_hook_event_queue(self._config)
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.bind(("127.0.0.1", 0))
+            server.listen()
+            server.settimeout(1.0)
+            self._write_state(server.getsockname()[1])
+            self.logger.info(
+                f"Hook worker listening on port {server.getsockname()[1]}."
+            )
+
+            processor = threading.Thread(target=self._process_events, daemon=True)
+            processor.start()
+            try:
+                while not self._stopped.is_set() and not self._is_idle():
+                    try:
+                        connection, _ = server.accept()
+                    except socket.timeout:
+                        continue
+                    with connection:
+                        self._handle_connection(connection)
+            finally:
+                self._stopped.set()
+                self._remove_state()
+
+            processor.join()
+        self._hook_event_queue.close()
+        self.logger.info("Hook worker stopped.")
+
+    def _handle_connection(self, connection):
+        connection.settimeout(FORWARD_TIMEOUT_SECONDS)
+        try:
+            message = json.loads(connection.makefile("r", encoding="utf-8").readline())
+        except (OSError, ValueError):
+            return
+        if not hmac.compare_digest(str(message.get("token", "")), self.token):
+            self.logger.warning("Hook worker rejected an event with an invalid token.")
+            connection.sendall(b'{"status": "rejected"}\n')
+            return
+
+        json_input = message.get("input", {})
+        scene_id = get_hook_scene_id(json_input)
+        if scene_id is not None:
+            self._hook_event_queue.put(scene_id)
+            self._latest_input = json_input
+        self._last_event_at = time.monotonic()
+        connection.sendall(b'{"status": "queued"}\n')
+
+    def _process_events(self):
+        while not self._stopped.is_set():
+            wait_seconds = self._hook_event_queue.seconds_until_ready()
+            if wait_seconds is None or wait_seconds > 0:
+                self._stopped.wait(min(wait_seconds or 1.0, 1.0))
+                continue
+            try:
+                self._refresh(self._latest_input)
+                if not self._is_enabled():
+                    self._stopped.set()
+                    continue
+                self.drain_hook_events(
+                    self._hook_event_queue, lambda: self._stash_completers
+                )
+            except Exception as e:
+                self.logger.error(f"Hook worker failed to process events: {str(e)}")
+                self._stopped.wait(1.0)
+
+    def _refresh(self, json_input):
+        # Stash hands out a new session when it restarts, so everything is
+        # reloaded when the connection changes as well as periodically.
+        if (
+            json_input.get("server_connection") != self._server_connection
+            or time.monotonic() - self._loaded_at > CONFIG_REFRESH_SECONDS
+        ):
+            self._load(json_input)
+
+    def _load(self, json_input):
+        self._config, self._stash_completers = self.load_stash_completers(json_input)
+        self._server_connection = json_input.get("server_connection")
+        self._loaded_at = time.monotonic()
+
+    def _is_enabled(self):
+        return self._config.enableSceneHooks and self._config.useHookWorker
+
+    def _is_idle(self):
+        idle_seconds = self._config.hookWorkerIdleMinutes * 60
+        return time.monotonic() - self._last_event_at > idle_seconds
+
+    def _write_state(self, port):
+        temporary_path = f"{self.state_path}.{os.getpid()}.tmp"
+        file_descriptor = os.open(
+            temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with os.fdopen(file_descriptor, "w") as state_file:
+            json.dump(
+                {"port": port, "token": self.token, "pid": os.getpid()}, state_file
+            )
+        os.replace(temporary_path, self.state_path)
+
+    def _remove_state(self):
+        # Only remove the state file if a newer worker hasn't replaced it.
+        try:
+            with open(self.state_path) as state_file:
+                if json.load(state_file).get("token") != self.token:
+                    return
+            os.remove(self.state_path)
+        except (OSError, ValueError):
+            pass
@@ -0,0 +1,92 @@
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+import stashapi.log as logger
+
+from RateLimiter import (
+    TRANSIENT_STATUS_CODES,
+    RateLimiter,
+    get_retry_delay,
+    parse_retry_after,
+)
+from StashboxClient import StashboxQueryError
+
+
+DEFAULT_POOL_SIZE = 10
+
+
+class RateLimitedSession(requests.Session):
+    """Session which paces requests per host and retries transient failures.
+
+    Responses with a transient status code and connection errors are retried
+    up to max_retries times with jittered exponential backoff, or after the
+    delay the server asked for with Retry-After. Once the retries are used up
+    a StashboxQueryError is raised instead of returning the failed response.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, max_retries: int = 0):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlparse(url).netloc
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(host)
+            retry_after = None
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            else:
+                if response.status_code not in TRANSIENT_STATUS_CODES:
+                    return response
+                error = f"status code {response.status_code}"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    self.rate_limiter.pause(host, retry_after)
+                response.close()
+
+            if attempt == self.max_retries:
+                break
+            delay = get_retry_delay(attempt, retry_after)
+            logger.warning(
+                f"Request to {host} failed with {error}. Retrying in {delay:.1f} seconds."
+            )
+            time.sleep(delay)
+
+        raise StashboxQueryError(
+            f"Request to {host} failed after {self.max_retries + 1} attempts with {error}."
+        )
+
+
+def create_pooled_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    rate_limiter: RateLimiter | None = None,
+    max_retries: int = 0,
+) -> requests.Session:
+    """Creates a keep-alive session whose connection pool fits the given concurrency.
+
+    The same session can be shared between clients and threads so that
+    connections to stash-boxes are reused instead of doing a new TCP and TLS
+    handshake for every request. With a rate limiter, requests are paced and
+    transient failures retried as described in RateLimitedSession.
+    """
+    if rate_limiter is not None:
+        session = RateLimitedSession(rate_limiter, max_retries)
+    else:
+        session = requests.Session()
+    session.headers.update({"Connection": "keep-alive"})
+
+    # pool_block makes extra threads wait for a free connection instead of
+    # opening short-lived connections which would be discarded afterwards.
+    adapter = HTTPAdapter(
+        pool_connections=DEFAULT_POOL_SIZE,
+        pool_maxsize=pool_size,
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -1,11 +1,42 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import io
+import mimetypes
+import threading
+
+import requests
 from stashapi.stashapp import StashInterface
 
+from HttpSession import create_pooled_session
+from PerformerImageCache import PerformerImageCache
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageTooLargeError(Exception):
+    pass
+
+
+@dataclass
+class PerformerImageOptions:
+    cache: PerformerImageCache | None = None
+    download_workers: int = 1
+    max_size_bytes: int = 20 * 1024 * 1024
+    # Images larger than this in either dimension are downsampled if Pillow is installed.
+    max_dimension: int | None = None
+
 
 class LocalStashClient:
     def __init__(self, server_connection: dict, logger):
         self.server_connection = server_connection
         self.local_stash = StashInterface(server_connection)
         self.logger = logger
+        self._image_session = None
+        self._image_session_lock = threading.Lock()
 
     @staticmethod
     def create_with_server_connect(server_connection: dict, logger):
@@ -23,55 +54,207 @@ class LocalStashClient:
             logger,
         )
 
-    def get_configuration(self):
-        return self.local_stash.get_configuration()
+    def get_configuration(self, fragment=None):
+        return self.local_stash.get_configuration(fragment=fragment)
 
     def find_tag(self, tag_name):
         return self.local_stash.find_tag({"name": tag_name})
 
-    def find_performers(self, performer_filter, filter):
+    def find_performers(
+        self,
+        performer_filter,
+        filter,
+        image_options: PerformerImageOptions | None = None,
+    ):
         performers = self.local_stash.find_performers(performer_filter, filter)
-        # Download performer images using session cookie
-        if performers:
-            import requests
-
-            session = requests.Session()
-            cookie = self.server_connection.get("SessionCookie", {})
-            session.cookies.set(
-                cookie.get("Name"),
-                cookie.get("Value"),
-                domain=cookie.get("Domain"),
-                path=cookie.get("Path"),
-                secure=cookie.get("Secure"),
+        if performers and image_options and image_options.cache:
+            failures = self.fetch_performer_images(performers, image_options)
+            if failures:
+                failure_details = "; ".join(
+                    f"{name}: {error}" for name, error in failures.items()
+                )
+                self.logger.error(
+                    f"Failed to download images for {len(failures)} performers: {failure_details}"
+                )
+        return performers
+
+    def fetch_performer_images(
+        self, performers, image_options: PerformerImageOptions
+    ) -> dict[str, str]:
+        """Downloads performer images concurrently into the image cache.
+
+        Only the content hash is kept on the performer. The image itself is
+        read back from the cache by get_performer_image_data_url when needed.
+        Performers whose image failed get an image_hash of None so that it is
+        not downloaded again. Returns errors by performer name.
+        """
+        performers_with_images = [
+            performer for performer in performers if "image_path" in performer
+        ]
+        session = self._get_image_session(image_options.download_workers)
+
+        def fetch(performer):
+            try:
+                performer["image_hash"] = self._get_cached_image(
+                    session, performer, image_options
+                )[0]
+                return None
+            except (requests.RequestException, ImageTooLargeError) as e:
+                performer["image_hash"] = None
+                return performer["name"], str(e)
+
+        with ThreadPoolExecutor(max_workers=image_options.download_workers) as executor:
+            results = list(executor.map(fetch, performers_with_images))
+        return dict(result for result in results if result is not None)
+
+    def get_performer_image_data_url(
+        self, performer, image_options: PerformerImageOptions
+    ) -> str | None:
+        """Returns the performer image as a data URL, downloading it if needed.
+
+        The data URL is built only here, right before it is sent, so that only
+        one encoded image is held in memory at a time.
+        """
+        if "image_path" not in performer:
+            return None
+        # The failure was already reported by fetch_performer_images.
+        if "image_hash" in performer and performer["image_hash"] is None:
+            return None
+
+        session = self._get_image_session(image_options.download_workers)
+        try:
+            if image_options.cache:
+                image_hash, content_type = self._get_cached_image(
+                    session, performer, image_options
+                )
+                content = image_options.cache.read(image_hash)
+                performer["image_hash"] = image_hash
+            else:
+                content, content_type = self._download_image(
+                    session, performer, image_options
+                )
+        except (requests.RequestException, ImageTooLargeError) as e:
+            self.logger.error(f"Failed to download image for performer {performer['name']}: {str(e)}")
+            return None
+
+        if content is None:
+            return None
+
+        image_type = mimetypes.guess_extension(content_type)
+        
+        if image_type:
+            image_type = image_type.lstrip('.')  # Remove leading dot
+        else:
+            image_type = 'jpeg'  # Default to jpeg if type can't be determined
+        
+        image_data = base64.b64encode(content).decode('utf-8')
+        return f"data:image/{image_type};base64,{image_data}"
+
+    def _get_image_session(self, workers: int) -> requests.Session:
+        # One session carrying the session cookie is shared by every download so
+        # that connections to the local Stash are reused between pages.
+        with self._image_session_lock:
+            if self._image_session is None:
+                self._image_session = create_pooled_session(max(workers, 1))
+                cookie = self.server_connection.get("SessionCookie", {})
+                self._image_session.cookies.set(
+                    cookie.get("Name"),
+                    cookie.get("Value"),
+                    domain=cookie.get("Domain"),
+                    path=cookie.get("Path"),
+                    secure=cookie.get("Secure"),
+                )
+            return self._image_session
+
+    def _get_cached_image(
+        self, session: requests.Session, performer, image_options: PerformerImageOptions
+    ) -> tuple[str, str]:
+        """Returns the content hash and type of the performer image, caching it first if needed."""
+        image_url = performer["image_path"]
+
+        # Stash changes the image URL whenever the image changes so a cached
+        # image for the same URL is still current.
+        cached_image = image_options.cache.find_by_url(image_url)
+        if cached_image:
+            self.logger.debug(f"Using cached image for performer {performer['name']}")
+            return cached_image
+
+        content, content_type = self._download_image(session, performer, image_options)
+        return image_options.cache.put(image_url, content, content_type), content_type
+
+    def _download_image(
+        self, session: requests.Session, performer, image_options: PerformerImageOptions
+    ) -> tuple[bytes, str]:
+        image_url = performer["image_path"]
+        max_size_bytes = image_options.max_size_bytes
+        with session.get(image_url, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if int(response.headers.get("Content-Length") or 0) > max_size_bytes:
+                raise ImageTooLargeError(
+                    f"Image is larger than the maximum of {max_size_bytes} bytes."
+                )
+
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                content.extend(chunk)
+                if len(content) > max_size_bytes:
+                    raise ImageTooLargeError(
+                        f"Image is larger than the maximum of {max_size_bytes} bytes."
+                    )
+
+        self.logger.debug(f"Downloaded image for performer {performer['name']}")
+        return self._downsample_image(bytes(content), content_type, image_options.max_dimension)
+
+    def _downsample_image(
+        self, content: bytes, content_type: str, max_dimension: int | None
+    ) -> tuple[bytes, str]:
+        if not max_dimension:
+            return content, content_type
+        if Image is None:
+            self.logger.warning(
+                "Pillow is not installed so performer images cannot be downsampled. Please install it using 'pip install Pillow'."
             )
+            return content, content_type
 
-            for performer in performers:
-                if "image_path" in performer:
-                    image_url = performer["image_path"]
-                    try:
-                        response = session.get(image_url)
-                        response.raise_for_status()
-                        import base64
-                        import mimetypes
-
-                        content_type = response.headers.get('Content-Type', '')
-                        image_type = mimetypes.guess_extension(content_type)
-                        
-                        if image_type:
-                            image_type = image_type.lstrip('.')  # Remove leading dot
-                        else:
-                            image_type = 'jpeg'  # Default to jpeg if type can't be determined
-                        
-                        image_data = base64.b64encode(response.content).decode('utf-8')
-                        data_url = f"data:image/{image_type};base64,{image_data}"
-                        performer['image'] = data_url
-                        self.logger.debug(f"Downloaded image for performer {performer['name']}")
-                    except requests.RequestException as e:
-                        self.logger.error(f"Failed to download image for performer {performer['name']}: {str(e)}")
-        return performers
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                if max(image.size) <= max_dimension:
+                    return content, content_type
+
+                image_format = image.format or "JPEG"
+                image.thumbnail((max_dimension, max_dimension))
+                if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                output = io.BytesIO()
+                image.save(output, format=image_format)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Failed to downsample image, using the original: {str(e)}")
+            return content, content_type
 
-    def find_scene_by_id(self, scene_id):
-        return self.local_stash.find_scene(scene_id)
+        return output.getvalue(), Image.MIME.get(image_format, content_type)
+
+    def find_scenes_by_ids(self, scene_ids: list) -> list[dict]:
+        """Finds the stash IDs of several scenes with a single request."""
+        if not scene_ids:
+            return []
+        result = self.local_stash.call_GQL(
+            """
+            query FindScenesByIds($ids: [ID!]) {
+                findScenes(ids: $ids, filter: { per_page: -1 }) {
+                    scenes {
+                        id
+                        stash_ids {
+                            endpoint
+                            stash_id
+                        }
+                    }
+                }
+            }
+            """,
+            {"ids": [str(scene_id) for scene_id in scene_ids]},
+        )
+        return result["findScenes"]["scenes"]
 
     def find_performer(self, performer_id: int) -> dict:
         create = False
@@ -93,5 +276,19 @@ class LocalStashClient:
         """
         return self.local_stash.find_performer(performer_id, create, fragment)
 
-    def find_all_scenes(self):
-        return self.local_stash.find_scenes(fragment="id title stash_ids { stash_id endpoint }")
+    def iter_scene_stash_ids(self, endpoint: str, page_size: int = 1000):
+        """Yields the stash IDs of all scenes for the endpoint one page at a time."""
+        page = 1
+        while True:
+            scenes = self.local_stash.find_scenes(
+                {"stash_id_endpoint": {"endpoint": endpoint, "modifier": "NOT_NULL"}},
+                {"page": page, "per_page": page_size, "sort": "id", "direction": "ASC"},
+                fragment="stash_ids { stash_id endpoint }",
+            )
+            for scene in scenes:
+                for stash_id in scene["stash_ids"]:
+                    if stash_id.get("endpoint") == endpoint:
+                        yield stash_id["stash_id"]
+            if len(scenes) < page_size:
+                break
+            page += 1
@@ -1,6 +1,12 @@
+import threading
+
 from stashapi.stashapp import StashInterface
 
 
+# Number of tags created with a single tagCreate mutation.
+TAG_CREATE_BATCH_SIZE = 100
+
+
 class MissingStashClient:
     def __init__(self, scheme, host, port, api_key, stash_db_endpoint, logger):
         self.stash_db_endpoint = stash_db_endpoint
@@ -14,20 +20,150 @@ class MissingStashClient:
             }
         )
         self.logger = logger
+        self._tag_lock = threading.Lock()
+        self._tags_by_name = None
+        self._studio_lock = threading.Lock()
+        self._studios_by_stash_id = None
+
+    @property
+    def url(self) -> str:
+        return self.missing_stash.url
+
+    def get_configuration(self, fragment=None):
+        return self.missing_stash.get_configuration(fragment=fragment)
+
+    def get_or_create_tags(self, tag_names: list[str]) -> list[dict]:
+        """Returns tags matching the names in the same order, creating the missing ones.
+
+        Tags are looked up from an index of all tags loaded once. Tags which do
+        not exist yet are created in batches and added to the index. Tags which
+        could not be created are left out.
+        """
+        # The lock also makes find-or-create atomic for concurrent callers which
+        # could otherwise try to create the same tag twice.
+        with self._tag_lock:
+            tags_by_name = self._get_tags_by_name()
+            new_tag_names = self._get_new_tag_names(tags_by_name, tag_names)
+            created_tags = self._create_tags(new_tag_names)
+            for tag_name, created_tag in zip(new_tag_names, created_tags):
+                if created_tag is None:
+                    continue
+                # Stash may store a normalised name, e.g. without surrounding
+                # whitespace, so the requested name is indexed as well.
+                tags_by_name[tag_name.lower()] = created_tag
+                tags_by_name[created_tag["name"].lower()] = created_tag
+            return [
+                tags_by_name[tag_name.lower()]
+                for tag_name in tag_names
+                if tag_name.lower() in tags_by_name
+            ]
+
+    def find_new_tag_names(self, tag_names: list[str]) -> list[str]:
+        """Returns the distinct names which get_or_create_tags would create."""
+        with self._tag_lock:
+            return self._get_new_tag_names(self._get_tags_by_name(), tag_names)
+
+    def _get_new_tag_names(self, tags_by_name, tag_names: list[str]) -> list[str]:
+        new_tag_names = {}
+        for tag_name in tag_names:
+            if tag_name.lower() not in tags_by_name:
+                new_tag_names.setdefault(tag_name.lower(), tag_name)
+        return list(new_tag_names.values())
 
-    def get_configuration(self):
-        return self.missing_stash.get_configuration()
+    def _get_tags_by_name(self) -> dict[str, dict]:
+        if self._tags_by_name is None:
+            tags = self.missing_stash.find_tags(fragment="id name aliases")
+            self._tags_by_name = {}
+            for tag in tags:
+                # Aliases are indexed first so that a tag's own name always wins.
+                for alias in tag.get("aliases") or []:
+                    self._tags_by_name[alias.lower()] = tag
+            for tag in tags:
+                self._tags_by_name[tag["name"].lower()] = tag
+            self.logger.debug(f"Loaded {len(tags)} tags from missing Stash.")
+        return self._tags_by_name
+
+    def _create_tags(self, tag_names: list[str]) -> list[dict | None]:
+        """Creates tags in batches, returning None for failed ones."""
+        created_tags = []
+        for start in range(0, len(tag_names), TAG_CREATE_BATCH_SIZE):
+            created_tags.extend(
+                self._create_tags_batch(tag_names[start : start + TAG_CREATE_BATCH_SIZE])
+            )
+        return created_tags
+
+    def _create_tags_batch(self, tag_names: list[str]) -> list[dict | None]:
+        aliases = {f"t{index}": tag_name for index, tag_name in enumerate(tag_names)}
+        variable_definitions = ", ".join(
+            f"${alias}: TagCreateInput!" for alias in aliases
+        )
+        mutations = " ".join(
+            f"{alias}: tagCreate(input: ${alias}) {{ id name aliases }}"
+            for alias in aliases
+        )
+        result = self.missing_stash.call_GQL(
+            f"mutation TagsCreate({variable_definitions}) {{ {mutations} }}",
+            {alias: {"name": tag_name} for alias, tag_name in aliases.items()},
+        )
+        created_tags = []
+        for alias, tag_name in aliases.items():
+            created_tag = result.get(alias)
+            if created_tag is None:
+                self.logger.error(f"Failed to create tag '{tag_name}' in missing Stash.")
+            created_tags.append(created_tag)
+        self.logger.debug(
+            f"Created {sum(tag is not None for tag in created_tags)} tags in missing Stash."
+        )
+        return created_tags
+
+    def create_scenes(self, scenes_data: list[dict]) -> list[dict | None]:
+        """Creates scenes with a single request, returning None for failed ones."""
+        if not scenes_data:
+            return []
+
+        aliases = {
+            f"s{index}": scene_data for index, scene_data in enumerate(scenes_data)
+        }
+        variable_definitions = ", ".join(
+            f"${alias}: SceneCreateInput!" for alias in aliases
+        )
+        mutations = " ".join(
+            f"{alias}: sceneCreate(input: ${alias}) {{ id }}" for alias in aliases
+        )
+        result = self.missing_stash.call_GQL(
+            f"mutation ScenesCreate({variable_definitions}) {{ {mutations} }}",
+            aliases,
+        )
+        return [result.get(alias) for alias in aliases]
 
-    def get_or_create_tag(self, tag_name: str) -> dict:
-        return self.missing_stash.find_tag({"name": tag_name}, True)
+    def destroy_scenes(self, scene_ids: list) -> list[str]:
+        """Destroys the scenes which still exist with a single request and returns their IDs.
 
-    def create_scene(self, scene_data):
-        return self.missing_stash.create_scene(scene_data)
+        scenesDestroy fails as a whole if any of the scenes is gone, and scenes
+        may have been destroyed since they were looked up, e.g. by a scene hook.
+        """
+        if not scene_ids:
+            return []
 
-    def destroy_scene(self, scene_id: int) -> None:
-        scene = self.missing_stash.find_scene(scene_id, fragment="id")
-        if scene:
-            return self.missing_stash.destroy_scene(scene_id)
+        result = self.missing_stash.call_GQL(
+            """
+            query FindExistingScenes($ids: [ID!]) {
+                findScenes(ids: $ids, filter: { per_page: -1 }) {
+                    scenes {
+                        id
+                    }
+                }
+            }
+            """,
+            {"ids": [str(scene_id) for scene_id in scene_ids]},
+        )
+        existing_scene_ids = {scene["id"] for scene in result["findScenes"]["scenes"]}
+        scene_ids_to_destroy = [
+            str(scene_id) for scene_id in scene_ids if str(scene_id) in existing_scene_ids
+        ]
+        if scene_ids_to_destroy:
+            self.missing_stash.destroy_scenes(scene_ids_to_destroy)
+        return scene_ids_to_destroy
 
     def find_performer(self, performer_id: int) -> dict:
         create = False
@@ -49,11 +185,36 @@ class MissingStashClient:
             """
         return self.missing_stash.find_performer(performer_id, create, fragment)
 
-    def find_studios(self, studio_filter):
-        return self.missing_stash.find_studios(studio_filter)
+    def find_studio_by_stash_id(self, stash_id: str, endpoint: str | None = None):
+        """Finds a studio by stash ID from an index of all studios loaded once."""
+        with self._studio_lock:
+            return self._get_studios_by_stash_id().get(
+                (endpoint or self.stash_db_endpoint, stash_id)
+            )
 
     def create_studio(self, studio_data):
-        return self.missing_stash.create_studio(studio_data)
+        studio = self.missing_stash.create_studio(studio_data)
+        if studio:
+            with self._studio_lock:
+                studios_by_stash_id = self._get_studios_by_stash_id()
+                for studio_stash_id in studio_data.get("stash_ids", []):
+                    studios_by_stash_id[
+                        (studio_stash_id["endpoint"], studio_stash_id["stash_id"])
+                    ] = studio
+        return studio
+
+    def _get_studios_by_stash_id(self) -> dict[tuple[str, str], dict]:
+        if self._studios_by_stash_id is None:
+            studios = self.missing_stash.find_studios(
+                fragment="id name stash_ids { endpoint stash_id }"
+            )
+            self._studios_by_stash_id = {
+                (studio_stash_id["endpoint"], studio_stash_id["stash_id"]): studio
+                for studio in studios
+                for studio_stash_id in studio["stash_ids"]
+            }
+            self.logger.debug(f"Loaded {len(studios)} studios from missing Stash.")
+        return self._studios_by_stash_id
 
     def create_performer(self, performer_data):
         return self.missing_stash.create_performer(performer_data)
@@ -61,16 +222,35 @@ class MissingStashClient:
     def update_performer(self, performer_data):
         return self.missing_stash.update_performer(performer_data)
 
-    def find_scenes_by_stash_id(self, stash_id: str):
-        return self.missing_stash.find_scenes(
-            {
-                "stash_id_endpoint": {
-                    "stash_id": stash_id,
-                    "endpoint": self.stash_db_endpoint,
-                    "modifier": "EQUALS",
-                }
-            }
+    def find_scenes_by_stash_ids(self, stash_ids: list[str]) -> list[dict]:
+        """Finds the scenes matching any of the stash IDs with a single request."""
+        if not stash_ids:
+            return []
+
+        # Each stash ID gets its own aliased findScenes field as a scene filter
+        # can only match a single stash ID.
+        aliases = {f"s{index}": stash_id for index, stash_id in enumerate(stash_ids)}
+        variable_definitions = ", ".join(f"${alias}: String!" for alias in aliases)
+        fields = " ".join(
+            f"""{alias}: findScenes(
+                    scene_filter: {{
+                        stash_id_endpoint: {{
+                            stash_id: ${alias},
+                            endpoint: $endpoint,
+                            modifier: EQUALS
+                        }}
+                    }},
+                    filter: {{ per_page: -1 }}
+                ) {{ scenes {{ id title stash_ids {{ stash_id endpoint }} }} }}"""
+            for alias in aliases
         )
+        result = self.missing_stash.call_GQL(
+            f"query FindScenesByStashIds($endpoint: String, {variable_definitions}) {{ {fields} }}",
+            {"endpoint": self.stash_db_endpoint, **aliases},
+        )
+        return [
+            scene for alias in aliases for scene in result[alias]["scenes"]
+        ]
 
     def find_performers_by_stash_id(self, stash_id: str):
         return self.missing_stash.find_performers(
@@ -83,7 +263,21 @@ class MissingStashClient:
             }
         )
 
-    def find_all_scenes(self):
-        return self.missing_stash.find_scenes(
-            fragment="id title stash_ids { stash_id endpoint }"
-        )
+    def iter_scene_pages(self, page_size: int = 1000):
+        """Yields the scenes with a stash ID for the endpoint one page at a time."""
+        page = 1
+        while True:
+            scenes = self.missing_stash.find_scenes(
+                {
+                    "stash_id_endpoint": {
+                        "endpoint": self.stash_db_endpoint,
+                        "modifier": "NOT_NULL",
+                    }
+                },
+                {"page": page, "per_page": page_size, "sort": "id", "direction": "ASC"},
+                fragment="id title stash_ids { stash_id endpoint }",
+            )
+            yield scenes
+            if len(scenes) < page_size:
+                break
+            page += 1
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class PerformerImageCache:
+    """Size-bounded on-disk cache of performer images.
+
+    Image bytes are stored once per content hash and looked up by the image URL
+    they were downloaded from. The cache also remembers which image was last
+    pushed to which performer of a missing Stash so unchanged images do not
+    have to be uploaded again. Least recently used images are evicted when the
+    cache grows past max_size_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    hash TEXT PRIMARY KEY,
+                    content_type TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pushed_images (
+                    target TEXT NOT NULL,
+                    performer_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (target, performer_id)
+                )
+                """
+            )
+
+    def find_by_url(self, url: str):
+        """Returns a tuple of content hash and content type, or None if not cached."""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT images.hash, images.content_type FROM urls JOIN images ON images.hash = urls.hash WHERE urls.url = ?",
+                (url,),
+            ).fetchone()
+            if row is None or not os.path.exists(self._get_path(row[0])):
+                return None
+            self._connection.execute(
+                "UPDATE images SET accessed_at = ? WHERE hash = ?", (time.time(), row[0])
+            )
+        return row[0], row[1]
+
+    def read(self, content_hash: str) -> bytes | None:
+        try:
+            with open(self._get_path(content_hash), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url: str, content: bytes, content_type: str) -> str:
+        """Stores the image downloaded from url and returns its content hash."""
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self._get_path(content_hash)
+        if not os.path.exists(path):
+            temporary_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(content)
+            os.replace(temporary_path, path)
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO images (hash, content_type, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (content_hash, content_type, len(content), time.time()),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)",
+                (url, content_hash),
+            )
+            self._evict(content_hash)
+        return content_hash
+
+    def is_pushed(self, target: str, performer_id, content_hash: str) -> bool:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT hash FROM pushed_images WHERE target = ? AND performer_id = ?",
+                (target, str(performer_id)),
+            ).fetchone()
+        return row is not None and row[0] == content_hash
+
+    def mark_pushed(self, target: str, performer_id, content_hash: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pushed_images (target, performer_id, hash) VALUES (?, ?, ?)",
+                (target, str(performer_id), content_hash),
+            )
+
+    def _evict(self, stored_hash: str) -> None:
+        # The image just stored is kept even if it alone exceeds the budget, as
+        # the caller reads it back right away. It is evicted by a later put.
+        total_size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM images"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        for content_hash, size in self._connection.execute(
+            "SELECT hash, size FROM images ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            if content_hash == stored_hash:
+                continue
+            self._connection.execute("DELETE FROM images WHERE hash = ?", (content_hash,))
+            self._connection.execute("DELETE FROM urls WHERE hash = ?", (content_hash,))
+            try:
+                os.remove(self._get_path(content_hash))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def _get_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash)
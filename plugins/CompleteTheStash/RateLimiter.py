@@ -0,0 +1,88 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import threading
+import time
+
+
+# Responses with these status codes are worth retrying after a while.
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+MAX_BACKOFF_SECONDS = 60.0
+
+
+def parse_retry_after(value) -> float | None:
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def get_retry_delay(attempt: int, retry_after: float | None = None) -> float:
+    """Returns how long to wait before the given retry attempt, starting at 0.
+
+    A delay requested by the server wins. Otherwise the delay grows
+    exponentially with full jitter so that clients which failed together
+    don't retry together.
+    """
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, 2**attempt))
+
+
+class RateLimiter:
+    """Token bucket per host shared by all stash-box clients and threads.
+
+    Up to requests_per_second requests are let through per host on average,
+    with bursts of up to burst requests. A requests_per_second of 0 disables
+    the limit but still honours pauses requested with Retry-After.
+    """
+
+    def __init__(self, requests_per_second: float = 0, burst: int | None = None):
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1, int(requests_per_second))
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def reserve(self, host: str) -> float:
+        """Takes a token for host and returns how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at, paused_until = self._buckets.get(
+                host, (self.burst, now, now)
+            )
+            wait = max(paused_until - now, 0.0)
+            if self.requests_per_second > 0:
+                tokens = min(
+                    self.burst,
+                    tokens + (now - updated_at) * self.requests_per_second,
+                )
+                tokens -= 1
+                if tokens < 0:
+                    wait = max(wait, -tokens / self.requests_per_second)
+            self._buckets[host] = (tokens, now, paused_until)
+            return wait
+
+    def acquire(self, host: str) -> None:
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, host: str, seconds: float) -> None:
+        """Holds back all requests to host for the given number of seconds."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at, paused_until = self._buckets.get(
+                host, (self.burst, now, now)
+            )
+            self._buckets[host] = (tokens, updated_at, max(paused_until, now + seconds))
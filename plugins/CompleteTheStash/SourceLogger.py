@@ -0,0 +1,49 @@
+import threading
+
+
+class ProgressAggregator:
+    """Combines the progress of several scene sources into one progress bar."""
+
+    def __init__(self, logger, source_names):
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._progress = {source_name: 0.0 for source_name in source_names}
+
+    def report(self, source_name, progress: float):
+        with self._lock:
+            self._progress[source_name] = progress
+            self.logger.progress(sum(self._progress.values()) / len(self._progress))
+
+
+class SourceLogger:
+    """Logger for one scene source which prefixes messages with the source name.
+
+    Sources are processed at the same time, so their log lines are interleaved
+    and their progress is reported through a shared ProgressAggregator.
+    """
+
+    def __init__(self, logger, source_name, progress_aggregator: ProgressAggregator):
+        self.logger = logger
+        self.source_name = source_name
+        self.progress_aggregator = progress_aggregator
+
+    def trace(self, message):
+        self.logger.trace(self._prefix(message))
+
+    def debug(self, message):
+        self.logger.debug(self._prefix(message))
+
+    def info(self, message):
+        self.logger.info(self._prefix(message))
+
+    def warning(self, message):
+        self.logger.warning(self._prefix(message))
+
+    def error(self, message):
+        self.logger.error(self._prefix(message))
+
+    def progress(self, progress: float):
+        self.progress_aggregator.report(self.source_name, progress)
+
+    def _prefix(self, message):
+        return f"[{self.source_name}] {message}"
@@ -1,8 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
+import threading
 
-from LocalStashClient import LocalStashClient
+from LocalStashClient import LocalStashClient, PerformerImageOptions
 from MissingStashClient import MissingStashClient
-from StashboxClient import StashboxClient
+from StashboxClient import StashboxClient, StashboxQueryError
+from SyncPlan import SyncPlan
+
+
+@dataclass
+class ScenePlan:
+    scenes_to_create: list[dict] = field(default_factory=list)
+    # Missing scenes which have been added to the local Stash since.
+    scenes_found_locally: list[dict] = field(default_factory=list)
+    # Missing scenes which no longer match the performer's stash-box scenes.
+    scenes_missing_from_stashbox: list[dict] = field(default_factory=list)
+
+    @property
+    def scenes_to_destroy(self) -> list[dict]:
+        return self.scenes_found_locally + self.scenes_missing_from_stashbox
 
 
 class StashCompleter:
@@ -13,50 +30,65 @@ class StashCompleter:
         stashbox_client: StashboxClient,
         local_stash_client: LocalStashClient,
         missing_stash_client: MissingStashClient,
+        performer_image_options: PerformerImageOptions | None = None,
     ):
         self.stashbox_client = stashbox_client
         self.local_stash_client = local_stash_client
         self.missing_stash_client = missing_stash_client
+        self.performer_image_options = performer_image_options or PerformerImageOptions()
+        self.performer_image_cache = self.performer_image_options.cache
         self.config = config
         self.logger = logger
-
-    def compare_scenes(self, local_scenes, existing_missing_scenes, stashbox_scenes):
-        local_scene_ids = {
-            stash_id["stash_id"]
-            for scene in local_scenes
-            for stash_id in scene["stash_ids"]
-            if stash_id.get("endpoint") == self.config.get("stashboxEndpoint")
-        }
+        self._progress_lock = threading.Lock()
+        self._progress_phase_index = 0
+        self._progress_step_count = 1
+        self._progress_steps_done = 0
+        self._prefetched_scenes = {}
+
+    def compare_scenes(
+        self, local_scenes, existing_missing_scenes, stashbox_scenes
+    ) -> ScenePlan:
+        local_scene_ids = self._get_endpoint_stash_ids(local_scenes)
         self.logger.trace(f"Local scene IDs: {local_scene_ids}")
-        existing_missing_scene_ids = {
-            stash_id["stash_id"]
-            for scene in existing_missing_scenes
-            for stash_id in scene["stash_ids"]
-            if stash_id.get("endpoint") == self.config.get("stashboxEndpoint")
-        }
-        self.logger.trace(f"Existing missing scene IDs: {existing_missing_scene_ids}")
+        existing_missing_scenes_by_stash_id = {}
+        for scene in existing_missing_scenes:
+            existing_missing_scenes_by_stash_id.setdefault(
+                self._get_endpoint_stash_id(scene), []
+            ).append(scene)
+        self.logger.trace(
+            f"Existing missing scene IDs: {set(existing_missing_scenes_by_stash_id)}"
+        )
+        stashbox_scene_ids = {scene["id"] for scene in stashbox_scenes}
+
+        scene_plan = ScenePlan()
+        for stash_id, scenes in existing_missing_scenes_by_stash_id.items():
+            if stash_id in local_scene_ids:
+                scene_plan.scenes_found_locally.extend(scenes)
+            elif stash_id not in stashbox_scene_ids:
+                scene_plan.scenes_missing_from_stashbox.extend(scenes)
 
-        new_missing_scenes = [
+        scene_plan.scenes_to_create = [
             scene
             for scene in stashbox_scenes
             if scene["id"] not in local_scene_ids
-            and scene["id"] not in existing_missing_scene_ids
+            and scene["id"] not in existing_missing_scenes_by_stash_id
         ]
-        return new_missing_scenes
+        return scene_plan
 
-    def create_scene(self, scene, performer_ids, studio_id):
+    def build_scene_input(self, scene, performer_ids, studio_id):
         code = scene["code"]
         title = scene["title"]
         studio_url = scene["urls"][0]["url"] if scene["urls"] else None
         date = scene["release_date"]
         cover_image = scene["images"][0]["url"] if scene["images"] else None
         stash_id = scene["id"]
-        tags = scene["tags"]
-        tag_ids = []
-
-        for tag in tags:
-            missing_tag = self.missing_stash_client.get_or_create_tag(tag["name"])
-            tag_ids.append(missing_tag["id"])
+        tags = scene["tags"] or []
+        tag_ids = [
+            missing_tag["id"]
+            for missing_tag in self.missing_stash_client.get_or_create_tags(
+                [tag["name"] for tag in tags]
+            )
+        ]
 
         new_scene = {
             "title": title,
@@ -83,43 +115,18 @@ class StashCompleter:
         except ValueError:
             pass
 
-        result = self.missing_stash_client.create_scene(new_scene)
-        if result:
-            return result["id"]
-
-        self.logger.error(f"Failed to create scene '{title}'")
-        return None
+        return new_scene
 
-    def get_or_create_studio_by_stash_id(
-        self, studio, parent_studio_id: int | None = None
-    ):
-        stash_id = studio["id"]
-        studio_name = studio["name"]
-
-        studios = self.missing_stash_client.find_studios(
-            {
-                "name": {
-                    "value": studio_name,
-                    "modifier": "EQUALS",
-                },
-                "stash_id_endpoint": {
-                    "stash_id": stash_id,
-                    "endpoint": self.config.get("stashboxEndpoint"),
-                    "modifier": "EQUALS",
-                },
-            }
-        )
-        if studios and len(studios) > 0:
-            if len(studios) > 1:
-                self.logger.warning(
-                    f"Multiple studios found with stash ID {stash_id}. Using the first one."
-                )
+    def _get_scene_batches(self, items):
+        batch_size = self.config.get("sceneBatchSize") or 1
+        return [
+            items[start : start + batch_size]
+            for start in range(0, len(items), batch_size)
+        ]
 
-            studio_id = studios[0]["id"]
-            self.logger.debug(
-                f"Studio found with stash ID {stash_id} with ID: {studio_id}"
-            )
-            return studio_id
+    def create_studio(self, studio_to_create: dict):
+        stash_id = studio_to_create["stash_id"]
+        studio_name = studio_to_create["name"]
 
         studio_create_input = {
             "name": studio_name,
@@ -128,10 +135,21 @@ class StashCompleter:
             ],
         }
 
+        # Parents are created in an earlier step, so they are in the index by now.
+        parent_studio_id = self._get_missing_studio_id(
+            studio_to_create["parent_stash_id"]
+        )
         if parent_studio_id:
             studio_create_input["parent_id"] = parent_studio_id
 
-        studio_image = self.stashbox_client.query_studio_image(stash_id)
+        # A missing logo is not worth failing the rest of the run for.
+        try:
+            studio_image = self.stashbox_client.query_studio_image(stash_id)
+        except StashboxQueryError as e:
+            self.logger.warning(
+                f"Studio {studio_name}: Creating it without an image as the image could not be queried: {str(e)}"
+            )
+            studio_image = None
         if studio_image:
             studio_create_input["image"] = studio_image
 
@@ -145,21 +163,22 @@ class StashCompleter:
         self.logger.error(f"Failed to create studio '{studio_name}'")
         return None
 
-    def get_or_create_missing_performer(
-        self, local_performer: any, performer_stash_id: str
-    ) -> int:
-        performer_in = self._convert_local_performer_to_missing_stash_input(local_performer)
-        
-        existing_performers = self.missing_stash_client.find_performers_by_stash_id(
-            performer_stash_id
+    def _get_missing_studio_id(self, studio_stash_id):
+        if not studio_stash_id:
+            return None
+        studio = self.missing_stash_client.find_studio_by_stash_id(
+            studio_stash_id, self.config.get("stashboxEndpoint")
         )
-        if existing_performers and len(existing_performers) > 0:
-            if len(existing_performers) > 1:
-                self.logger.warning(
-                    f"Multiple performers found with stash ID {performer_stash_id}. Using the first one."
-                )
+        return studio["id"] if studio else None
+
+    def upsert_missing_performer(self, performer_upsert: dict) -> int:
+        local_performer = performer_upsert["local_performer"]
+        performer_stash_id = performer_upsert["stash_id"]
+        performer_in = self._convert_local_performer_to_missing_stash_input(local_performer)
+        image_hash = local_performer.get("image_hash")
 
-            performer_id = existing_performers[0]["id"]
+        performer_id = performer_upsert["missing_performer_id"]
+        if performer_id is not None:
             self.logger.debug(
                 f"Performer {performer_in['name']}: Matched with Stash ID {performer_stash_id} to missing Stash ID {performer_id}"
             )
@@ -167,25 +186,66 @@ class StashCompleter:
             performer_in['id'] = performer_id
             if performer_in['custom_fields']:
                 performer_in['custom_fields'] = { "full": performer_in['custom_fields'] }
-            self.missing_stash_client.update_performer(performer_in)            
+            if self._is_image_pushed(performer_id, image_hash):
+                self.logger.debug(
+                    f"Performer {performer_in['name']}: Image is unchanged in missing Stash. Skipping image."
+                )
+            else:
+                image_hash = self._add_performer_image(performer_in, local_performer)
+            if self.missing_stash_client.update_performer(performer_in):
+                self._mark_image_pushed(performer_id, image_hash)
             return performer_id
 
+        image_hash = self._add_performer_image(performer_in, local_performer)
         performer = self.missing_stash_client.create_performer(performer_in)
         if performer:
             self.logger.info(f"Performer created: {performer_in['name']}")
+            self._mark_image_pushed(performer["id"], image_hash)
             return performer["id"]
         self.logger.error(f"Failed to create performer '{performer_in['name']}'")
         return None
 
+    def _add_performer_image(self, performer_in, local_performer):
+        # The image is only encoded right before it is sent so that a single
+        # performer image is held in memory at a time.
+        image = self.local_stash_client.get_performer_image_data_url(
+            local_performer, self.performer_image_options
+        )
+        if not image:
+            # Nothing was uploaded, so the image must not be marked as pushed.
+            return None
+        performer_in['image'] = image
+        return local_performer.get("image_hash")
+
+    def _is_image_pushed(self, missing_performer_id, image_hash) -> bool:
+        return bool(
+            self.performer_image_cache
+            and image_hash
+            and self.performer_image_cache.is_pushed(
+                self.missing_stash_client.url, missing_performer_id, image_hash
+            )
+        )
+
+    def _mark_image_pushed(self, missing_performer_id, image_hash) -> None:
+        if self.performer_image_cache and image_hash:
+            self.performer_image_cache.mark_pushed(
+                self.missing_stash_client.url, missing_performer_id, image_hash
+            )
+
     def _convert_local_performer_to_missing_stash_input(self, local_performer):
         performer_in = local_performer.copy()
         del performer_in['id']
         
-        tag_ids = [self.missing_stash_client.get_or_create_tag(tag['name'])['id'] for tag in performer_in['tags']]
+        tag_ids = [
+            tag["id"]
+            for tag in self.missing_stash_client.get_or_create_tags(
+                [tag["name"] for tag in performer_in["tags"]]
+            )
+        ]
         performer_in['tag_ids'] = tag_ids
         
         keys_to_delete = [
-            'tags', 'scenes', 'scene_count',
+            'tags', 'scenes', 'scene_count', 'image_hash',
             'image_count', 'gallery_count', 'performer_count',
             'created_at', 'updated_at', 'image_path',
             'o_counter',
@@ -214,7 +274,11 @@ class StashCompleter:
                 "tags": {"value": selected_performer_tag_ids, "modifier": "INCLUDES"}
             }
             filter = {"page": page, "per_page": 25}
-            result = self.local_stash_client.find_performers(performer_filter, filter)
+            result = self.local_stash_client.find_performers(
+                performer_filter,
+                filter,
+                self.performer_image_options,
+            )
             performers.extend(result)
             if len(result) < 25:
                 break
@@ -223,254 +287,488 @@ class StashCompleter:
         return performers
 
     def process_performers(self):
-        selected_local_performers = self.find_selected_local_performers()
-        selected_local_performers_with_stash_ids = []
-        missing_performers_by_stash_id = {}
-
-        for local_performer in selected_local_performers:
-            local_performer_name = local_performer["name"]
-            performer_stash_id: str = next(
-                (
-                    sid["stash_id"]
-                    for sid in local_performer["stash_ids"]
-                    if sid.get("endpoint") == self.config.get("stashboxEndpoint")
-                ),
-                None,
-            )
-            if not performer_stash_id:
+        self.apply_sync_plan(self.plan_sync())
+
+    def plan_sync(self) -> SyncPlan:
+        """Computes every change of a run across all selected performers without changing anything.
+
+        Planning the whole run up front lets scenes and studios shared by
+        several performers be created once, and lets the plan be applied in
+        dependency order with parallel batches or only logged for a dry run.
+        """
+        endpoint = self.config.get("stashboxEndpoint")
+        sync_plan = SyncPlan(endpoint)
+
+        local_performers = []
+        for local_performer in self.find_selected_local_performers():
+            if not self._get_endpoint_stash_id(local_performer):
                 self.logger.warning(
-                    f"Performer {local_performer_name} does not have a Stashbox ID for endpoint {self.config.get('stashboxEndpoint')}. Skipping..."
+                    f"Performer {local_performer['name']} does not have a Stashbox ID for endpoint {endpoint}. Skipping..."
                 )
                 continue
+            local_performers.append(local_performer)
 
-            selected_local_performers_with_stash_ids.append(local_performer)
-            missing_performer_id = self.get_or_create_missing_performer(
-                local_performer, performer_stash_id
-            )
-
-            missing_performers_by_stash_id[performer_stash_id] = missing_performer_id
+        # Both Stashes are paged through so that only the local stash IDs of the
+        # configured endpoint are kept in memory, not the whole libraries.
+        local_scene_stash_ids = set(
+            self.local_stash_client.iter_scene_stash_ids(endpoint)
+        )
+        self.logger.debug(
+            f"Found {len(local_scene_stash_ids)} local scenes with a stash ID for {endpoint}."
+        )
 
-        for local_performer in selected_local_performers_with_stash_ids:
-            self.process_performer(
-                local_performer["id"], missing_performers_by_stash_id
+        self._start_progress_phase(0, len(local_performers))
+        performer_plans = []
+        for local_performers_chunk in self._get_work_chunks(local_performers):
+            self._prefetch_stashbox_scenes(local_performers_chunk)
+            performer_plans.extend(
+                self._map_concurrently(
+                    self._plan_performer, local_performers_chunk, "performers"
+                )
             )
 
-        # Destroy scenes which weren't associated with a performer in local Stash but existed both in local and missing Stash.
-        scenes_in_local_stash = self.local_stash_client.find_all_scenes()
-        scenes_in_missing_stash = self.missing_stash_client.find_all_scenes()
-        
-        # Match scenes in local and missing stashes by stash_id
-        local_scene_stash_ids = {
-            stash_id["stash_id"]
-            for scene in scenes_in_local_stash
-            for stash_id in scene["stash_ids"]
-            if stash_id.get("endpoint") == self.config.get("stashboxEndpoint")
+        # A scene which dropped out of one performer's listing is kept as long
+        # as the listing of another performer still has it.
+        listed_stash_ids = {
+            scene["id"]
+            for _, stashbox_scenes, _, _ in performer_plans
+            for scene in stashbox_scenes or []
         }
+        # Scenes of several performers may already exist in the missing Stash
+        # through only one of them.
+        existing_missing_stash_ids = {
+            stash_id
+            for _, _, existing_missing_scenes, _ in performer_plans
+            for stash_id in self._get_endpoint_stash_ids(existing_missing_scenes)
+        }
+        scenes_to_destroy_by_id = {}
+        scenes_to_create_by_stash_id = {}
+        for performer_upsert, _, _, scene_plan in performer_plans:
+            sync_plan.performers_to_upsert.append(performer_upsert)
+            if scene_plan is None:
+                sync_plan.skipped_performers.append(
+                    performer_upsert["local_performer"]["name"]
+                )
+                continue
 
-        scenes_to_destroy = []
-        for missing_scene in scenes_in_missing_stash:
-            missing_scene_stash_id = next(
-                (
-                    stash_id["stash_id"]
-                    for stash_id in missing_scene["stash_ids"]
-                    if stash_id.get("endpoint") == self.config.get("stashboxEndpoint")
-                ),
-                None,
-            )
-            if missing_scene_stash_id in local_scene_stash_ids:
-                scenes_to_destroy.append(missing_scene)
-
-        # Destroy missing scenes that exist in local stash
-        for scene in scenes_to_destroy:
-            self.missing_stash_client.destroy_scene(scene["id"])
-            self.logger.info(f"Destroyed missing scene: {scene['title']} (ID: {scene['id']})")
+            for scene in scene_plan.scenes_found_locally:
+                scenes_to_destroy_by_id.setdefault(
+                    scene["id"], self._get_scene_to_destroy(scene, "found_locally")
+                )
+            for scene in scene_plan.scenes_missing_from_stashbox:
+                if self._get_endpoint_stash_id(scene) not in listed_stash_ids:
+                    scenes_to_destroy_by_id.setdefault(
+                        scene["id"],
+                        self._get_scene_to_destroy(scene, "missing_from_stashbox"),
+                    )
+            for scene in scene_plan.scenes_to_create:
+                # Scenes in the local Stash which aren't associated with the
+                # performer there would only be destroyed again.
+                if (
+                    scene["id"] not in local_scene_stash_ids
+                    and scene["id"] not in existing_missing_stash_ids
+                ):
+                    scenes_to_create_by_stash_id.setdefault(scene["id"], scene)
+
+        # Scenes which weren't associated with a performer in local Stash but
+        # exist both in local and missing Stash are destroyed as well.
+        for missing_scenes in self.missing_stash_client.iter_scene_pages():
+            for missing_scene in missing_scenes:
+                if self._get_endpoint_stash_id(missing_scene) in local_scene_stash_ids:
+                    scenes_to_destroy_by_id.setdefault(
+                        missing_scene["id"],
+                        self._get_scene_to_destroy(missing_scene, "found_locally"),
+                    )
 
-        if len(scenes_to_destroy) > 0:
-            self.logger.info(f"Destroyed {len(scenes_to_destroy)} scenes from missing stash that exist in local stash.")
+        sync_plan.scenes_to_destroy = list(scenes_to_destroy_by_id.values())
+        sync_plan.scenes_to_create = self._query_scene_details(
+            list(scenes_to_create_by_stash_id.values())
+        )
+        sync_plan.studios_to_create = self._plan_studios(sync_plan.scenes_to_create)
+        sync_plan.tags_to_create = self.missing_stash_client.find_new_tag_names(
+            [
+                tag["name"]
+                for performer_upsert in sync_plan.performers_to_upsert
+                for tag in performer_upsert["local_performer"]["tags"]
+            ]
+            + [
+                tag["name"]
+                for scene in sync_plan.scenes_to_create
+                for tag in scene["tags"] or []
+            ]
+        )
+        self.logger.info(f"Plan: {sync_plan.get_summary()}")
+        return sync_plan
+
+    def _plan_performer(self, local_performer):
+        """Returns the upsert, stash-box scenes, existing missing scenes and scene plan of a performer.
+
+        The stash-box scenes and the scene plan are None if the scenes could not
+        be queried, in which case nothing is destroyed for the performer.
+        """
+        performer_stash_id = self._get_endpoint_stash_id(local_performer)
+        performer_upsert = {
+            "stash_id": performer_stash_id,
+            "missing_performer_id": None,
+            "local_performer": local_performer,
+        }
+        try:
+            return (performer_upsert,) + self._plan_performer_scenes(
+                local_performer, performer_stash_id, performer_upsert
+            )
+        finally:
+            self._complete_progress_steps()
 
-    def process_performer(
-        self, local_performer_id: int, missing_performers_by_stash_id: dict[str, int]
+    def _plan_performer_scenes(
+        self, local_performer, performer_stash_id, performer_upsert
     ):
         local_performer_details = self.local_stash_client.find_performer(
-            local_performer_id
+            local_performer["id"]
         )
         if not local_performer_details:
-            self.logger.error("Failed to retrieve details for performer.")
-            return
-
-        self.logger.info(f"Performer {local_performer_details['name']}: Processing...")
+            self.logger.error(
+                f"Performer {local_performer['name']}: Failed to retrieve details."
+            )
+            return None, [], None
 
-        performer_stash_id = next(
-            (
-                sid["stash_id"]
-                for sid in local_performer_details["stash_ids"]
-                if sid.get("endpoint") == self.config.get("stashboxEndpoint")
-            ),
-            None,
+        existing_missing_scenes = []
+        existing_missing_performers = self.missing_stash_client.find_performers_by_stash_id(
+            performer_stash_id
         )
+        if existing_missing_performers:
+            if len(existing_missing_performers) > 1:
+                self.logger.warning(
+                    f"Multiple performers found with stash ID {performer_stash_id}. Using the first one."
+                )
+            missing_performer_id = existing_missing_performers[0]["id"]
+            performer_upsert["missing_performer_id"] = missing_performer_id
+            existing_missing_scenes = self.missing_stash_client.find_performer(
+                missing_performer_id
+            )["scenes"]
+
+        stashbox_scenes = self._prefetched_scenes.pop(performer_stash_id, None)
+        if stashbox_scenes is None:
+            try:
+                stashbox_scenes = self.stashbox_client.query_scenes(performer_stash_id)
+            except StashboxQueryError as e:
+                self.logger.error(str(e))
+        if stashbox_scenes is None:
+            self.logger.error(
+                f"Performer {local_performer['name']}: Skipped as the scenes could not be queried from {self.config.get('stashboxEndpoint')}."
+            )
+            return None, existing_missing_scenes, None
+        # Stash-boxes which support it leave excluded scenes out already, this
+        # catches the rest.
+        exclude_tags = set(self.config.get("sceneExcludeTags") or [])
+        filtered_stashbox_scenes = [
+            scene
+            for scene in stashbox_scenes
+            if not any(tag["name"] in exclude_tags for tag in scene["tags"] or [])
+        ]
+        excluded_scene_count = len(stashbox_scenes) - len(filtered_stashbox_scenes)
+        if excluded_scene_count > 0:
+            self.logger.debug(
+                f"Performer {local_performer['name']}: Excluded {excluded_scene_count} scenes tagged with {', '.join(sorted(exclude_tags))}."
+            )
 
-        missing_performer_id = missing_performers_by_stash_id.get(performer_stash_id)
-        missing_performer_details = self.missing_stash_client.find_performer(
-            missing_performer_id
+        scene_plan = self.compare_scenes(
+            local_performer_details["scenes"],
+            existing_missing_scenes,
+            filtered_stashbox_scenes,
+        )
+        self.logger.debug(
+            f"Performer {local_performer['name']}: {len(scene_plan.scenes_to_create)} scenes to create, {len(scene_plan.scenes_to_destroy)} scenes to destroy."
         )
+        return filtered_stashbox_scenes, existing_missing_scenes, scene_plan
 
-        local_scenes = local_performer_details["scenes"]
-        existing_missing_scenes = missing_performer_details["scenes"]
+    def _query_scene_details(self, scenes):
+        # Listings may only carry what comparing scenes needs, so the remaining
+        # fields are fetched for the scenes which are actually created.
+        try:
+            return self.stashbox_client.query_scene_details(scenes)
+        except StashboxQueryError as e:
+            self.logger.error(
+                f"No scenes are created as their details could not be queried: {str(e)}"
+            )
+            return []
+
+    def _get_scene_to_destroy(self, scene, reason):
+        return {
+            "id": scene["id"],
+            "title": scene["title"],
+            "stash_id": self._get_endpoint_stash_id(scene),
+            "reason": reason,
+        }
 
-        stashbox_scenes = self.stashbox_client.query_scenes(performer_stash_id)
-        filtered_stashbox_scenes = []
-        exclude_tags = self.config.get("sceneExcludeTags")
-        if exclude_tags is None or not exclude_tags:
-            filtered_stashbox_scenes = stashbox_scenes
-        else:
-            for scene in stashbox_scenes:
-                if scene["tags"] is None or not scene["tags"]:
-                    filtered_stashbox_scenes.append(scene)
-                else:
-                    self.logger.debug(f"Scene ID: {scene['id']}")
-                    self.logger.debug(f"Scene title: {scene['title']}")
-                    self.logger.debug(f"Scene tags: {scene['tags']}")
-                    self.logger.debug(f"Exclude tags: {exclude_tags}")
-                    if not any(tag["name"] in exclude_tags for tag in scene["tags"]):
-                        filtered_stashbox_scenes.append(scene)
-
-        # Create a set of stashbox scene IDs for quick lookup
-        stashbox_scene_ids = {scene["id"] for scene in filtered_stashbox_scenes}
-
-        destroyed_scenes_stash_ids = []
-        for local_scene in local_scenes:
-            scene_stash_id = next(
-                (
-                    sid["stash_id"]
-                    for sid in local_scene["stash_ids"]
-                    if sid.get("endpoint") == self.config.get("stashboxEndpoint")
-                ),
-                None,
+    def _plan_studios(self, scenes_to_create) -> list[dict]:
+        # Parents are added before their children so the list stays in
+        # dependency order.
+        studios_to_create = {}
+        for scene in scenes_to_create:
+            studio = scene.get("studio")
+            if not studio:
+                continue
+            parent_studio = studio.get("parent")
+            if parent_studio:
+                self._plan_studio(studios_to_create, parent_studio, None)
+            self._plan_studio(
+                studios_to_create,
+                studio,
+                parent_studio["id"] if parent_studio else None,
             )
-            for existing_missing_scene in existing_missing_scenes:
-                existing_missing_scene_stash_id = next(
-                    (
-                        sid["stash_id"]
-                        for sid in existing_missing_scene["stash_ids"]
-                        if sid.get("endpoint") == self.config.get("stashboxEndpoint")
-                    ),
-                    None,
-                )
-                if scene_stash_id == existing_missing_scene_stash_id:
-                    self.missing_stash_client.destroy_scene(
-                        existing_missing_scene["id"]
-                    )
-                    destroyed_scenes_stash_ids.append(existing_missing_scene_stash_id)
-                    self.logger.info(
-                        f"Scene {existing_missing_scene['title']} (ID: {existing_missing_scene['id']}) destroyed."
-                    )
+        return list(studios_to_create.values())
+
+    def _plan_studio(self, studios_to_create, studio, parent_stash_id):
+        if (
+            not studio["id"]
+            or studio["id"] in studios_to_create
+            or self._get_missing_studio_id(studio["id"])
+        ):
+            return
+        studios_to_create[studio["id"]] = {
+            "stash_id": studio["id"],
+            "name": studio["name"],
+            "parent_stash_id": parent_stash_id,
+        }
 
-        # Destroy existing missing scenes that are not in stashdb_scenes
-        for existing_missing_scene in existing_missing_scenes:
-            existing_missing_scene_stash_id = next(
-                (
-                    sid["stash_id"]
-                    for sid in existing_missing_scene["stash_ids"]
-                    if sid.get("endpoint") == self.config.get("stashboxEndpoint")
-                ),
-                None,
+    def apply_sync_plan(self, sync_plan: SyncPlan):
+        """Applies a plan to the missing Stash.
+
+        Tags and studios are created before the performers and scenes which
+        refer to them. The independent changes within each step are made by up
+        to performerConcurrency workers at a time.
+        """
+        scenes_to_destroy_batches = self._get_scene_batches(sync_plan.scenes_to_destroy)
+        scenes_to_create_batches = self._get_scene_batches(sync_plan.scenes_to_create)
+        self._start_progress_phase(
+            1,
+            len(sync_plan.studios_to_create)
+            + len(sync_plan.performers_to_upsert)
+            + len(scenes_to_destroy_batches)
+            + len(scenes_to_create_batches),
+        )
+
+        # Tags missing from the index are created with a few batched requests.
+        self.missing_stash_client.get_or_create_tags(sync_plan.tags_to_create)
+
+        remaining_studios = sync_plan.studios_to_create
+        while remaining_studios:
+            remaining_stash_ids = {studio["stash_id"] for studio in remaining_studios}
+            self._map_concurrently(
+                self._with_progress(self.create_studio),
+                [
+                    studio
+                    for studio in remaining_studios
+                    if studio["parent_stash_id"] not in remaining_stash_ids
+                ],
+                "studios",
             )
-            if existing_missing_scene_stash_id not in stashbox_scene_ids:
-                self.missing_stash_client.destroy_scene(existing_missing_scene["id"])
-                destroyed_scenes_stash_ids.append(existing_missing_scene_stash_id)
-                self.logger.info(
-                    f"Scene {existing_missing_scene['title']} (ID: {existing_missing_scene['id']}) destroyed as it was no longer found in StashDB scenes."
-                )
+            remaining_studios = [
+                studio
+                for studio in remaining_studios
+                if studio["parent_stash_id"] in remaining_stash_ids
+            ]
 
-        missing_scenes = self.compare_scenes(
-            local_scenes, existing_missing_scenes, filtered_stashbox_scenes
+        missing_performer_ids = self._map_concurrently(
+            self._with_progress(self.upsert_missing_performer),
+            sync_plan.performers_to_upsert,
+            "performers",
         )
+        missing_performers_by_stash_id = {
+            performer_upsert["stash_id"]: missing_performer_id
+            for performer_upsert, missing_performer_id in zip(
+                sync_plan.performers_to_upsert, missing_performer_ids
+            )
+            if missing_performer_id is not None
+        }
 
-        total_scenes = len(missing_scenes)
-        created_scenes_stash_ids = []
-        for scene in missing_scenes:
-            parent_studio_id = None
-            if (
-                "studio" in scene
-                and "parent" in scene["studio"]
-                and scene["studio"]["parent"]
-            ):
-                parent_studio_id = self.get_or_create_studio_by_stash_id(
-                    scene["studio"]["parent"]
+        destroyed_scene_counts = self._map_concurrently(
+            self._with_progress(self._destroy_scenes), scenes_to_destroy_batches, "batches"
+        )
+        created_scene_counts = self._map_concurrently(
+            self._with_progress(
+                lambda scenes: self._create_scenes(
+                    scenes, missing_performers_by_stash_id
                 )
+            ),
+            scenes_to_create_batches,
+            "batches",
+        )
 
-            scene_studio_id = self.get_or_create_studio_by_stash_id(
-                scene["studio"], parent_studio_id
+        created_scene_count = sum(created_scene_counts)
+        destroyed_scene_count = sum(destroyed_scene_counts)
+        if created_scene_count > 0 or destroyed_scene_count > 0:
+            self.logger.info(
+                f"{created_scene_count} new missing scenes created. {destroyed_scene_count} previously missing scenes destroyed."
             )
+        else:
+            self.logger.info("No changes detected.")
 
-            scene_performer_stash_ids = [
-                scene_performer["performer"]["id"]
-                for scene_performer in scene["performers"]
-            ]
-            missing_performer_ids = [
-                missing_performers_by_stash_id.get(sid)
-                for sid in scene_performer_stash_ids
-                if missing_performers_by_stash_id.get(sid) is not None
-            ]
-
-            # Create scene and link it to the new studio
-            created_scene_id = self.create_scene(
-                scene, missing_performer_ids, scene_studio_id
+    def _destroy_scenes(self, scenes_to_destroy) -> int:
+        destroyed_scene_ids = set(
+            self.missing_stash_client.destroy_scenes(
+                [scene["id"] for scene in scenes_to_destroy]
             )
-            if created_scene_id:
+        )
+        for scene in scenes_to_destroy:
+            if str(scene["id"]) not in destroyed_scene_ids:
+                self.logger.debug(
+                    f"Scene {scene['title']} (ID: {scene['id']}) was already destroyed."
+                )
+            elif scene["reason"] == "found_locally":
+                self.logger.info(
+                    f"Scene {scene['title']} (ID: {scene['id']}) destroyed as it was found in the local Stash."
+                )
+            else:
                 self.logger.info(
-                    f"Scene {scene['title']} (ID: {created_scene_id}) created"
+                    f"Scene {scene['title']} (ID: {scene['id']}) destroyed as it was no longer found in {self.config.get('stashboxEndpoint')} scenes."
                 )
+        return len(destroyed_scene_ids)
 
-                # Update progress
-                created_scene_stash_id = scene["id"]
-                created_scenes_stash_ids.append(created_scene_stash_id)
-                progress = len(created_scenes_stash_ids) / total_scenes
-                self.logger.progress(progress)
+    def _create_scenes(self, scenes, missing_performers_by_stash_id) -> int:
+        new_scenes = []
+        for scene in scenes:
+            studio = scene.get("studio")
+            missing_performer_ids = [
+                missing_performers_by_stash_id[scene_performer["performer"]["id"]]
+                for scene_performer in scene["performers"]
+                if scene_performer["performer"]["id"] in missing_performers_by_stash_id
+            ]
+            new_scenes.append(
+                self.build_scene_input(
+                    scene,
+                    missing_performer_ids,
+                    self._get_missing_studio_id(studio["id"] if studio else None),
+                )
+            )
 
-        if len(created_scenes_stash_ids) > 0 or len(destroyed_scenes_stash_ids) > 0:
-            created_msg = f"{len(created_scenes_stash_ids)} new missing scenes created. " if len(created_scenes_stash_ids) > 0 else ""
-            destroyed_msg = f"{len(destroyed_scenes_stash_ids)} previously missing scenes destroyed." if len(destroyed_scenes_stash_ids) > 0 else ""
-            
-            if created_msg and destroyed_msg:
-                msg = f"{created_msg}{destroyed_msg}"
-            else:
-                msg = created_msg or destroyed_msg
-            
-            self.logger.info(f"Performer {local_performer_details['name']}: {msg}.")
-        else:
-            self.logger.info(f"Performer {local_performer_details['name']}: No changes detected.")
+        # Create the whole batch of scenes with a single request
+        created_scene_count = 0
+        created_scenes = self.missing_stash_client.create_scenes(new_scenes)
+        for scene, created_scene in zip(scenes, created_scenes):
+            if not created_scene:
+                self.logger.error(f"Failed to create scene '{scene['title']}'")
+                continue
 
-    def process_scene_by_id(self, scene_id: int):
-        scene = self.local_stash_client.find_scene_by_id(scene_id)
-        if not scene:
-            self.logger.error(f"Scene {scene_id} not found.")
-            return
+            self.logger.info(
+                f"Scene {scene['title']} (ID: {created_scene['id']}) created"
+            )
+            created_scene_count += 1
+        return created_scene_count
 
-        stashbox_id = next(
+    def _get_endpoint_stash_id(self, item):
+        return next(
             (
                 sid["stash_id"]
-                for sid in scene["stash_ids"]
+                for sid in item["stash_ids"]
                 if sid.get("endpoint") == self.config.get("stashboxEndpoint")
             ),
             None,
         )
-        if not stashbox_id:
-            self.logger.error(f"Scene {scene_id} does not have a stashbox ID.")
-            return
 
-        self.process_scene_by_stashbox_id(stashbox_id)
+    def _get_endpoint_stash_ids(self, items) -> set[str]:
+        return {
+            sid["stash_id"]
+            for item in items
+            for sid in item["stash_ids"]
+            if sid.get("endpoint") == self.config.get("stashboxEndpoint")
+        }
 
-    def process_scene_by_stashbox_id(self, stashbox_id: str):
-        scenes = self.missing_stash_client.find_scenes_by_stash_id(stashbox_id)
-        if scenes and len(scenes) > 0:
-            if len(scenes) > 1:
-                self.logger.warning(
-                    f"Multiple scenes found with stashbox ID {stashbox_id}. Using the first one."
-                )
+    def _get_work_chunks(self, local_performers):
+        # Without batch support there is nothing to gain from chunking and a
+        # single chunk keeps all workers busy until the very end.
+        if not self.stashbox_client.supports_scene_batches:
+            return [local_performers]
+
+        chunk_size = max(
+            self.config.get("stashboxBatchSize") or 1,
+            self.config.get("performerConcurrency") or 1,
+        )
+        return [
+            local_performers[start : start + chunk_size]
+            for start in range(0, len(local_performers), chunk_size)
+        ]
+
+    def _prefetch_stashbox_scenes(self, local_performers):
+        if not self.stashbox_client.supports_scene_batches:
+            return
 
-            scene = scenes[0]
-            self.missing_stash_client.destroy_scene(scene["id"])
+        performer_stash_ids = [
+            self._get_endpoint_stash_id(local_performer)
+            for local_performer in local_performers
+        ]
+        self.logger.debug(
+            f"Prefetching scenes for {len(performer_stash_ids)} performers from {self.config.get('stashboxEndpoint')}."
+        )
+        try:
+            self._prefetched_scenes.update(
+                self.stashbox_client.query_scenes_batch(performer_stash_ids)
+            )
+        except StashboxQueryError as e:
+            # Performers without prefetched scenes query them on their own, so
+            # only the performers which keep failing are skipped.
+            self.logger.warning(f"Failed to prefetch scenes: {str(e)}")
+
+    def _map_concurrently(self, func, items, item_description="items"):
+        concurrency = self.config.get("performerConcurrency") or 1
+        if concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        self.logger.debug(
+            f"Processing {len(items)} {item_description} with {concurrency} workers."
+        )
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(func, items))
+
+    def _with_progress(self, func):
+        def func_with_progress(item):
+            try:
+                return func(item)
+            finally:
+                self._complete_progress_steps()
+
+        return func_with_progress
+
+    def _start_progress_phase(self, phase_index: int, step_count: int):
+        with self._progress_lock:
+            self._progress_phase_index = phase_index
+            self._progress_step_count = max(step_count, 1)
+            self._progress_steps_done = 0
+
+    def _complete_progress_steps(self, step_count: int = 1):
+        # Planning and applying the plan each make up half of the progress,
+        # which stays monotonic even when steps finish out of order.
+        with self._progress_lock:
+            self._progress_steps_done += step_count
+            phase_progress = min(
+                self._progress_steps_done / self._progress_step_count, 1.0
+            )
+            self.logger.progress((self._progress_phase_index + phase_progress) / 2)
+
+    def process_scenes_by_ids(self, scene_ids: list):
+        """Destroys the missing scenes of several local scenes at once.
+
+        Used for queued scene hooks: one request finds the local scenes, one
+        finds their missing scenes, and one checks which still exist and
+        destroys them.
+        """
+        endpoint = self.config.get("stashboxEndpoint")
+        local_scenes = self.local_stash_client.find_scenes_by_ids(scene_ids)
+        stashbox_ids = list(self._get_endpoint_stash_ids(local_scenes))
+        self.logger.debug(
+            f"{len(stashbox_ids)} of {len(scene_ids)} local scenes have a stash ID for {endpoint}."
+        )
+        if not stashbox_ids:
+            return
+
+        missing_scenes = self.missing_stash_client.find_scenes_by_stash_ids(
+            stashbox_ids
+        )
+        missing_scenes_by_id = {scene["id"]: scene for scene in missing_scenes}
+        destroyed_scene_ids = self.missing_stash_client.destroy_scenes(
+            list(missing_scenes_by_id)
+        )
+        for scene in (missing_scenes_by_id[scene_id] for scene_id in destroyed_scene_ids):
             self.logger.info(
-                f"Scene {scene['title']} (ID: {scene['id']}, Stashbox ID: {stashbox_id}) destroyed as it was found in the local Stash."
+                f"Scene {scene['title']} (ID: {scene['id']}, Stashbox ID: {self._get_endpoint_stash_id(scene)}) destroyed as it was found in the local Stash."
             )
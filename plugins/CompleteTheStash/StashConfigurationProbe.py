@@ -0,0 +1,72 @@
+import json
+
+
+PLUGIN_ID = "CompleteTheStash"
+
+PROBE_TIMEOUT_SECONDS = 10
+
+# The parts of the local configuration the plugin uses. Fetching only these
+# is much cheaper than the full configuration.
+LOCAL_CONFIGURATION_FRAGMENT = f"""
+    general {{
+        apiKey
+        stashBoxes {{
+            endpoint
+            api_key
+            name
+        }}
+    }}
+    plugins(include: ["{PLUGIN_ID}"])
+"""
+
+MISSING_CONFIGURATION_FRAGMENT = "general { apiKey }"
+
+
+def get_graphql_url(server_connection: dict) -> str:
+    # Mirrors how StashInterface turns the plugin's server connection into a URL.
+    connection = {key.lower(): value for key, value in server_connection.items()}
+    host = connection.get("host", "localhost")
+    if host == "0.0.0.0":
+        host = "127.0.0.1"
+    return f"{connection.get('scheme', 'http')}://{host}:{connection.get('port', 9999)}/graphql"
+
+
+def query_stash(server_connection: dict, query: str, variables=None) -> dict:
+    """Sends a GraphQL query to Stash using only the standard library.
+
+    StashInterface and requests take a large share of the plugin's startup,
+    so small queries which decide whether there is anything to do at all are
+    sent with this instead.
+    """
+    # urllib.request takes a while to import, and hooks which are forwarded to
+    # the hook worker never get here.
+    import urllib.request
+
+    connection = {key.lower(): value for key, value in server_connection.items()}
+    headers = {"Content-Type": "application/json"}
+    if connection.get("apikey"):
+        headers["ApiKey"] = connection["apikey"]
+    if connection.get("sessioncookie"):
+        headers["Cookie"] = f"session={connection['sessioncookie']['Value']}"
+
+    request = urllib.request.Request(
+        get_graphql_url(server_connection),
+        data=json.dumps({"query": query, "variables": variables}).encode("utf-8"),
+        headers=headers,
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=PROBE_TIMEOUT_SECONDS) as response:
+        result = json.load(response)
+    if result.get("errors"):
+        raise ValueError(f"Stash query failed: {result['errors']}")
+    return result["data"]
+
+
+def fetch_plugin_settings(server_connection: dict) -> dict:
+    """Returns the settings of this plugin without fetching the whole configuration."""
+    data = query_stash(
+        server_connection,
+        "query PluginSettings($include: [ID!]) { configuration { plugins(include: $include) } }",
+        {"include": [PLUGIN_ID]},
+    )
+    return (data["configuration"]["plugins"] or {}).get(PLUGIN_ID) or {}
@@ -1,27 +1,274 @@
+from datetime import datetime
+import threading
+
 import requests
 import stashapi.log as logger
 
-from StashboxClient import StashboxClient
+from StashboxClient import (
+    SCENE_PROJECTION_FULL,
+    SCENE_PROJECTION_SLIM,
+    StashboxClient,
+    StashboxQueryError,
+    get_page_count,
+    map_pages_concurrently,
+    parse_timestamp,
+    remove_duplicate_scenes,
+    take_changed_scenes,
+)
+
+
+DEFAULT_PAGE_SIZE = 25
+
+# Largest page stash-box serves for queryScenes.
+MAX_PAGE_SIZE = 100
+
+SCENE_FIELDS_FRAGMENT = """
+    fragment SceneFields on Scene {
+        id
+        title
+        details
+        release_date
+        updated
+        urls {
+            url
+            site {
+                name
+                url
+            }
+        }
+        studio {
+            id
+            name
+            parent {
+                id
+                name
+            }
+        }
+        images {
+            id
+            url
+        }
+        performers {
+            performer {
+                id
+                name
+            }
+        }
+        duration
+        code
+        tags {
+            id
+            name
+        }
+    }
+"""
+
+SLIM_SCENE_FIELDS_FRAGMENT = """
+    fragment SceneFields on Scene {
+        id
+        title
+        updated
+        tags {
+            id
+            name
+        }
+    }
+"""
+
+SCENE_FIELDS_FRAGMENTS = {
+    SCENE_PROJECTION_FULL: SCENE_FIELDS_FRAGMENT,
+    SCENE_PROJECTION_SLIM: SLIM_SCENE_FIELDS_FRAGMENT,
+}
+
+FIND_PERFORMER_IMAGE_QUERY = """
+    query FindPerformer($id: ID!) {
+        findPerformer(id: $id) {
+            id
+            images {
+                id
+                url
+            }
+        }
+    }
+"""
+
+FIND_STUDIO_IMAGE_QUERY = """
+    query FindStudio($id: ID!) {
+        findStudio(id: $id) {
+            id
+            images {
+                id
+                url
+            }
+        }
+    }
+"""
+
+# Followed by the SceneFields fragment of the projection.
+QUERY_SCENES_QUERY = """
+    query QueryScenes($stash_ids: [ID!]!, $page: Int!, $per_page: Int!, $tags: MultiIDCriterionInput) {
+        queryScenes(
+            input: {
+                performers: {
+                    value: $stash_ids,
+                    modifier: INCLUDES
+                },
+                tags: $tags,
+                per_page: $per_page,
+                page: $page
+            }
+        ) {
+            scenes {
+                ...SceneFields
+            }
+            count
+        }
+    }
+"""
+
+# Followed by the SceneFields fragment of the projection.
+QUERY_SCENES_UPDATED_SINCE_QUERY = """
+    query QueryScenesUpdatedSince($stash_ids: [ID!]!, $page: Int!, $per_page: Int!, $tags: MultiIDCriterionInput) {
+        queryScenes(
+            input: {
+                performers: {
+                    value: $stash_ids,
+                    modifier: INCLUDES
+                },
+                tags: $tags,
+                sort: UPDATED_AT,
+                direction: DESC,
+                per_page: $per_page,
+                page: $page
+            }
+        ) {
+            scenes {
+                ...SceneFields
+            }
+            count
+        }
+    }
+"""
+
+
+def get_scene_updated_at(scene) -> datetime | None:
+    return parse_timestamp(scene.get("updated"))
+
+
+def get_scenes_page(result: dict | None, field: str = "queryScenes") -> dict | None:
+    """Returns a page of scenes from a query result, or None if it has none.
+
+    Stash-boxes answer GraphQL errors with status 200 and leave data or the
+    failed field null, so a successful response alone does not mean there is
+    a page.
+    """
+    if not result or not result.get("data"):
+        return None
+    return result["data"].get(field)
+
+
+def build_find_tags_request(tag_names: list[str]) -> tuple[str, dict]:
+    """Returns a query and its variables for the IDs of the tags with the given names."""
+    aliases = {f"t{index}": tag_name for index, tag_name in enumerate(tag_names)}
+    variable_definitions = ", ".join(f"${alias}: String!" for alias in aliases)
+    fields = " ".join(
+        f"{alias}: findTag(name: ${alias}) {{ id name }}" for alias in aliases
+    )
+    return f"query FindTags({variable_definitions}) {{ {fields} }}", aliases
+
+
+def get_exclude_tags_filter(
+    tag_names: list[str], result: dict | None, error: str | None = None
+) -> dict | None:
+    """Turns the result of a build_find_tags_request query into a queryScenes tag criterion.
+
+    Returns None if the query failed or none of the tags exist, in which case
+    the scenes are filtered by StashCompleter after downloading them instead.
+    """
+    if not result or not result.get("data"):
+        reason = f": {error}" if error else ""
+        logger.warning(
+            f"Failed to resolve the exclude tags{reason}. Excluded scenes are downloaded and filtered out afterwards."
+        )
+        return None
+
+    tag_ids = []
+    for index, tag_name in enumerate(tag_names):
+        tag = result["data"].get(f"t{index}")
+        if tag is None:
+            logger.warning(f"Exclude tag {tag_name} does not exist on StashDB.")
+            continue
+        tag_ids.append(tag["id"])
+    if not tag_ids:
+        return None
+    return {"value": tag_ids, "modifier": "EXCLUDES"}
+
+
+def build_find_scenes_request(scenes: list[dict]) -> tuple[str, dict]:
+    """Returns a query and its variables for the full fields of the given scenes."""
+    aliases = {f"s{index}": scene["id"] for index, scene in enumerate(scenes)}
+    variable_definitions = ", ".join(f"${alias}: ID!" for alias in aliases)
+    fields = " ".join(
+        f"{alias}: findScene(id: ${alias}) {{ ...SceneFields }}" for alias in aliases
+    )
+    return (
+        f"query FindScenes({variable_definitions}) {{ {fields} }}"
+        + SCENE_FIELDS_FRAGMENT,
+        aliases,
+    )
+
+
+def get_detailed_scenes(
+    scenes: list[dict], result: dict | None, endpoint: str
+) -> list[dict]:
+    """Returns the scenes of a build_find_scenes_request result in the order of scenes.
+
+    Scenes deleted from the stash-box since they were listed are left out.
+    """
+    if not result or not result.get("data"):
+        raise StashboxQueryError(f"Failed to query the details of {len(scenes)} scenes.")
+
+    detailed_scenes = []
+    for index, scene in enumerate(scenes):
+        detailed_scene = result["data"][f"s{index}"]
+        if detailed_scene is None:
+            logger.warning(
+                f"Scene {scene['title']} ({scene['id']}) no longer exists on {endpoint}."
+            )
+            continue
+        detailed_scenes.append(detailed_scene)
+    return detailed_scenes
 
 
 class StashDbClient(StashboxClient):
-    def __init__(self, endpoint, api_key):
+    supports_scene_batches = True
+
+    def __init__(
+        self,
+        endpoint,
+        api_key,
+        session: requests.Session | None = None,
+        batch_size: int = 10,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        page_concurrency: int = 1,
+        scene_projection: str = SCENE_PROJECTION_SLIM,
+        exclude_tag_names: list[str] | None = None,
+    ):
         self.endpoint = endpoint
         self.api_key = api_key
+        self.session = session or requests.Session()
+        self.batch_size = batch_size
+        self.page_size = min(page_size, MAX_PAGE_SIZE)
+        self.page_concurrency = page_concurrency
+        self.scene_projection = scene_projection
+        self.scene_fields_fragment = SCENE_FIELDS_FRAGMENTS[scene_projection]
+        self.excluded_tag_names = sorted(set(exclude_tag_names or []))
+        self._tags_filter_lock = threading.Lock()
+        self._tags_filter_resolved = False
+        self._tags_filter = None
 
     def query_performer_image(self, performer_stash_id):
-        query = """
-            query FindPerformer($id: ID!) {
-                findPerformer(id: $id) {
-                    id
-                    images {
-                        id
-                        url
-                    }
-                }
-            }
-        """
-        result = self._gql_query(query, {"id": performer_stash_id})
+        result = self._gql_query(FIND_PERFORMER_IMAGE_QUERY, {"id": performer_stash_id})
         if result:
             performer_data = result["data"]["findPerformer"]
             if (
@@ -40,18 +287,7 @@ class StashDbClient(StashboxClient):
         return None
 
     def query_studio_image(self, performer_stash_id):
-        query = """
-            query FindStudio($id: ID!) {
-                findStudio(id: $id) {
-                    id
-                    images {
-                        id
-                        url
-                    }
-                }
-            }
-        """
-        result = self._gql_query(query, {"id": performer_stash_id})
+        result = self._gql_query(FIND_STUDIO_IMAGE_QUERY, {"id": performer_stash_id})
         if result:
             performer_data = result["data"]["findStudio"]
             if (
@@ -70,96 +306,195 @@ class StashDbClient(StashboxClient):
         return None
 
     def query_scenes(self, performer_stash_id):
-        query = """
-            query QueryScenes($stash_ids: [ID!]!, $page: Int!) {
-                queryScenes(
-                    input: {
-                        performers: {
-                            value: $stash_ids,
+        return self._query_remaining_pages(
+            performer_stash_id, self._query_scenes_page(performer_stash_id, 1)
+        )
+
+    def query_scenes_batch(self, performer_stash_ids):
+        scenes_by_performer = {}
+        for start in range(0, len(performer_stash_ids), self.batch_size):
+            batch = performer_stash_ids[start : start + self.batch_size]
+            scenes_by_performer.update(self._query_first_pages(batch))
+        return scenes_by_performer
+
+    def _query_first_pages(self, performer_stash_ids):
+        # Each performer gets its own aliased queryScenes field so that the first
+        # pages of the whole batch are fetched in a single round trip.
+        aliases = {
+            f"p{index}": stash_id for index, stash_id in enumerate(performer_stash_ids)
+        }
+        variable_definitions = ", ".join(
+            [f"${alias}: [ID!]!" for alias in aliases] + ["$tags: MultiIDCriterionInput"]
+        )
+        fields = "".join(
+            f"""
+                {alias}: queryScenes(
+                    input: {{
+                        performers: {{
+                            value: ${alias},
                             modifier: INCLUDES
-                        },
-                        per_page: 25,
-                        page: $page
-                    }
-                ) {
-                    scenes {
-                        id
-                        title
-                        details
-                        release_date
-                        urls {
-                            url
-                            site {
-                                name
-                                url
-                            }
-                        }
-                        studio {
-                            id
-                            name
-                            parent {
-                                id
-                                name
-                            }
-                        }
-                        images {
-                            id
-                            url
-                        }
-                        performers {
-                            performer {
-                                id
-                                name
-                                gender
-                                aliases
-                                birth_date
-                                breast_type
-                                cup_size
-                                ethnicity
-                                country
-                                hair_color
-                                eye_color
-                                images {
-                                    id
-                                    url
-                                }
-                            }
-                        }
-                        duration
-                        code
-                        tags {
-                            id
-                            name
-                        }
-                    }
+                        }},
+                        tags: $tags,
+                        per_page: {self.page_size},
+                        page: 1
+                    }}
+                ) {{
+                    scenes {{
+                        ...SceneFields
+                    }}
                     count
-                }
+                }}"""
+            for alias in aliases
+        )
+        query = (
+            f"query QueryScenesBatch({variable_definitions}) {{{fields}\n}}"
+            + self.scene_fields_fragment
+        )
+
+        result = self._gql_query(
+            query,
+            {
+                **{alias: [stash_id] for alias, stash_id in aliases.items()},
+                "tags": self._get_tags_filter(),
+            },
+        )
+        if not result or not result.get("data"):
+            logger.warning(
+                f"Batched scene query for {len(performer_stash_ids)} performers failed. Querying performers one by one."
+            )
+            return {
+                stash_id: self.query_scenes(stash_id) for stash_id in performer_stash_ids
             }
+
+        scenes_by_performer = {}
+        for alias, stash_id in aliases.items():
+            first_page = get_scenes_page(result, alias)
+            if first_page is None:
+                logger.warning(
+                    f"Batched scene query for performer {stash_id} failed. Querying the performer on its own."
+                )
+                scenes_by_performer[stash_id] = self.query_scenes(stash_id)
+                continue
+            scenes_by_performer[stash_id] = self._query_remaining_pages(
+                stash_id, first_page
+            )
+        return scenes_by_performer
+
+    def _query_remaining_pages(self, performer_stash_id, first_page):
+        """Completes a listing from its first page.
+
+        The first page tells how many scenes there are, so all remaining
+        pages are requested at once with up to page_concurrency requests in
+        flight.
         """
-        scenes = []
+        if len(first_page["scenes"]) < self.page_size:
+            return list(first_page["scenes"])
+
+        remaining_pages = map_pages_concurrently(
+            lambda page: self._query_scenes_page(performer_stash_id, page)["scenes"],
+            range(2, get_page_count(first_page["count"], self.page_size) + 1),
+            self.page_concurrency,
+        )
+        return remove_duplicate_scenes(
+            first_page["scenes"] + [scene for scenes in remaining_pages for scene in scenes]
+        )
+
+    def _query_scenes_page(self, performer_stash_id, page):
+        result = self._gql_query(
+            QUERY_SCENES_QUERY + self.scene_fields_fragment,
+            {
+                "stash_ids": performer_stash_id,
+                "page": page,
+                "per_page": self.page_size,
+                "tags": self._get_tags_filter(),
+            },
+        )
+        scenes_data = get_scenes_page(result)
+        if scenes_data is None:
+            # A partial listing would make the missing scenes look removed
+            # from the stash-box.
+            raise StashboxQueryError(
+                f"Failed to query page {page} of the scenes of performer {performer_stash_id}."
+            )
+        return scenes_data
+
+    def query_scene_details(self, scenes):
+        if self.scene_projection == SCENE_PROJECTION_FULL:
+            return scenes
+
+        chunks = [
+            scenes[start : start + self.page_size]
+            for start in range(0, len(scenes), self.page_size)
+        ]
+        detailed_chunks = map_pages_concurrently(
+            self._query_scene_details_chunk, chunks, self.page_concurrency
+        )
+        return [scene for detailed_scenes in detailed_chunks for scene in detailed_scenes]
+
+    def _query_scene_details_chunk(self, scenes):
+        return get_detailed_scenes(
+            scenes, self._gql_query(*build_find_scenes_request(scenes)), self.endpoint
+        )
+
+    def query_scenes_updated_since(self, performer_stash_id, since: datetime):
+        # Scenes are ordered by last update so paging can stop at the first
+        # scene which has not changed since the previous run. The pages are
+        # fetched one by one as usually only the first one is needed.
+        updated_scenes = []
         page = 1
-        total_scenes = None
         while True:
             result = self._gql_query(
-                query, {"stash_ids": performer_stash_id, "page": page}
+                QUERY_SCENES_UPDATED_SINCE_QUERY + self.scene_fields_fragment,
+                {
+                    "stash_ids": performer_stash_id,
+                    "page": page,
+                    "per_page": self.page_size,
+                    "tags": self._get_tags_filter(),
+                },
             )
-            if result:
-                scenes_data = result["data"]["queryScenes"]
-                scenes.extend(scenes_data["scenes"])
-                total_scenes = total_scenes or scenes_data["count"]
-                if len(scenes) >= total_scenes or len(scenes_data["scenes"]) < 25:
-                    break
-                page += 1
-            else:
-                break
+            scenes_data = get_scenes_page(result)
+            if scenes_data is None:
+                return None
+
+            page_result = take_changed_scenes(
+                scenes_data["scenes"], since, get_scene_updated_at
+            )
+            if page_result is None:
+                return None
+            changed_scenes, reached_unchanged_scene = page_result
+            updated_scenes.extend(changed_scenes)
+            if reached_unchanged_scene or len(scenes_data["scenes"]) < self.page_size:
+                return updated_scenes, scenes_data["count"]
+            page += 1
+
+    def _get_tags_filter(self):
+        """Returns the tag criterion which leaves out scenes with an exclude tag.
+
+        The exclude tags are resolved to StashDB tag IDs with a single request
+        the first time they are needed. If that fails, the scenes are filtered
+        by StashCompleter after downloading them instead.
+        """
+        with self._tags_filter_lock:
+            if not self._tags_filter_resolved:
+                self._tags_filter = self._resolve_tags_filter()
+                self._tags_filter_resolved = True
+            return self._tags_filter
+
+    def _resolve_tags_filter(self):
+        if not self.excluded_tag_names:
+            return None
 
-        return scenes
+        try:
+            result = self._gql_query(*build_find_tags_request(self.excluded_tag_names))
+        except StashboxQueryError as e:
+            return get_exclude_tags_filter(self.excluded_tag_names, None, str(e))
+        return get_exclude_tags_filter(self.excluded_tag_names, result)
 
     def _gql_query(self, query, variables=None):
         headers = {"Content-Type": "application/json"}
         if self.api_key:
             headers["Apikey"] = self.api_key
-        response = requests.post(
+        response = self.session.post(
             self.endpoint,
             json={"query": query, "variables": variables},
             headers=headers,
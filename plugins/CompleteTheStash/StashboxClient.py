@@ -1,7 +1,91 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+def parse_timestamp(value) -> datetime | None:
+    """Parses an ISO 8601 timestamp from a stash-box into an aware datetime."""
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+# Scene listings of a slim projection only carry what comparing them needs,
+# which is the ID, title, tags and last update. The fields needed to create a
+# scene are fetched with query_scene_details for the scenes actually created.
+SCENE_PROJECTION_FULL = "full"
+SCENE_PROJECTION_SLIM = "slim"
+
+
+def get_page_count(total_items: int, page_size: int) -> int:
+    return max((total_items + page_size - 1) // page_size, 1)
+
+
+def map_pages_concurrently(query_page, pages, concurrency: int) -> list:
+    """Queries pages with up to concurrency requests at a time.
+
+    The results are returned in the order of pages regardless of which
+    request finishes first. An exception raised for any page is re-raised.
+    """
+    pages = list(pages)
+    if concurrency <= 1 or len(pages) <= 1:
+        return [query_page(page) for page in pages]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(pages))) as executor:
+        return list(executor.map(query_page, pages))
+
+
+def remove_duplicate_scenes(scenes: list) -> list:
+    # Scenes added while the pages are fetched shift the later pages, so the
+    # same scene can show up on two of them.
+    scenes_by_id = {}
+    for scene in scenes:
+        scenes_by_id.setdefault(scene["id"], scene)
+    return list(scenes_by_id.values())
+
+
+def take_changed_scenes(scenes: list, since: datetime, get_changed_at):
+    """Splits off the scenes of a page ordered by change time which changed after since.
+
+    Returns the changed scenes and whether the page reached a scene which did
+    not change, so that no further pages are needed. Returns None if a scene
+    has no change time, in which case the listing has to be queried in full.
+    """
+    changed_scenes = []
+    for scene in scenes:
+        changed_at = get_changed_at(scene)
+        if changed_at is None:
+            return None
+        if changed_at <= since:
+            return changed_scenes, True
+        changed_scenes.append(scene)
+    return changed_scenes, False
+
+
+class StashboxQueryError(Exception):
+    """Raised when a stash-box could not be queried, even after retrying.
+
+    Callers must not treat this like an empty result, otherwise scenes would
+    be destroyed just because the stash-box was unavailable.
+    """
 
 
 class StashboxClient(ABC):
+    # Clients which can fetch several performers' scenes in one request set this
+    # so that callers know it is worth collecting performers into batches.
+    supports_scene_batches = False
+
+    scene_projection = SCENE_PROJECTION_FULL
+
+    # Clients which leave scenes with these tags out of their listings on the
+    # stash-box set this, as their listings depend on it.
+    excluded_tag_names = ()
+
     @abstractmethod
     def query_performer_image(self, performer_stash_id):
         pass
@@ -13,3 +97,30 @@ class StashboxClient(ABC):
     @abstractmethod
     def query_scenes(self, performer_stash_id):
         pass
+
+    def query_scenes_batch(self, performer_stash_ids):
+        """Queries the scenes of several performers, keyed by performer stash ID."""
+        return {
+            performer_stash_id: self.query_scenes(performer_stash_id)
+            for performer_stash_id in performer_stash_ids
+        }
+
+    def query_scene_details(self, scenes):
+        """Returns the scenes with every field needed to create them, in the same order.
+
+        Listings of the full projection already have all fields, so they are
+        returned as they are.
+        """
+        return scenes
+
+    def query_scenes_updated_since(self, performer_stash_id, since: datetime):
+        """Queries only the scenes of a performer which changed after since.
+
+        Returns a tuple of the changed scenes and the total number of scenes the
+        performer has, or None if the stash-box does not support incremental
+        queries and the caller has to fall back to query_scenes.
+        """
+        return None
+
+    def close(self):
+        """Releases the connections and caches held by the client."""
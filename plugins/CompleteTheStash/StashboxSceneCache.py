@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class StashboxSceneCache:
+    """SQLite-backed cache of stash-box scene listings.
+
+    Entries are keyed by stash-box endpoint and performer stash ID. The cache
+    holds at most max_entries listings and evicts the least recently used
+    ones when it grows past that.
+    """
+
+    def __init__(self, database_path: str, max_entries: int):
+        os.makedirs(os.path.dirname(database_path), exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            database_path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scenes (
+                    endpoint TEXT NOT NULL,
+                    performer_stash_id TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    payload BLOB NOT NULL,
+                    watermark TEXT,
+                    PRIMARY KEY (endpoint, performer_stash_id)
+                )
+                """
+            )
+
+    def get(self, endpoint: str, performer_stash_id: str, max_age_seconds: float):
+        """Returns the cached scenes or None if missing or older than max_age_seconds."""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT fetched_at, payload FROM scenes WHERE endpoint = ? AND performer_stash_id = ?",
+                (endpoint, performer_stash_id),
+            ).fetchone()
+            if row is None:
+                return None
+
+            fetched_at, payload = row
+            if time.time() - fetched_at > max_age_seconds:
+                return None
+
+            self._connection.execute(
+                "UPDATE scenes SET accessed_at = ? WHERE endpoint = ? AND performer_stash_id = ?",
+                (time.time(), endpoint, performer_stash_id),
+            )
+        return json.loads(zlib.decompress(payload))
+
+    def get_with_watermark(self, endpoint: str, performer_stash_id: str):
+        """Returns the last known scenes and their watermark regardless of age.
+
+        Returns None if there is no entry or the entry has no watermark.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT payload, watermark FROM scenes WHERE endpoint = ? AND performer_stash_id = ?",
+                (endpoint, performer_stash_id),
+            ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        payload, watermark = row
+        return json.loads(zlib.decompress(payload)), watermark
+
+    def put(
+        self,
+        endpoint: str,
+        performer_stash_id: str,
+        scenes: list,
+        watermark: str | None = None,
+    ) -> None:
+        payload = zlib.compress(json.dumps(scenes).encode("utf-8"))
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO scenes (endpoint, performer_stash_id, fetched_at, accessed_at, payload, watermark) VALUES (?, ?, ?, ?, ?, ?)",
+                (endpoint, performer_stash_id, now, now, payload, watermark),
+            )
+            self._connection.execute(
+                """
+                DELETE FROM scenes WHERE rowid IN (
+                    SELECT rowid FROM scenes ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,48 @@
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class SyncPlan:
+    """Everything a run changes in the missing Stash of one source.
+
+    The plan is computed from read-only queries across all selected performers
+    and only holds plain data, so it can be written out as JSON for a dry run
+    and applied later. Scenes and studios shared by several performers appear
+    only once.
+    """
+
+    endpoint: str
+    tags_to_create: list[str] = field(default_factory=list)
+    # Each studio is {"stash_id", "name", "parent_stash_id"}. Parents come
+    # before their children.
+    studios_to_create: list[dict] = field(default_factory=list)
+    # Each upsert is {"stash_id", "missing_performer_id", "local_performer"}
+    # where a missing_performer_id of None means the performer is created.
+    performers_to_upsert: list[dict] = field(default_factory=list)
+    # Each scene is {"id", "title", "stash_id", "reason"}.
+    scenes_to_destroy: list[dict] = field(default_factory=list)
+    # Stash-box scenes as returned by the stash-box client.
+    scenes_to_create: list[dict] = field(default_factory=list)
+    # Names of the performers whose scenes could not be queried.
+    skipped_performers: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def get_summary(self) -> str:
+        performers_to_create = sum(
+            1
+            for performer_upsert in self.performers_to_upsert
+            if performer_upsert["missing_performer_id"] is None
+        )
+        summary = (
+            f"{len(self.scenes_to_create)} scenes to create, "
+            f"{len(self.scenes_to_destroy)} scenes to destroy, "
+            f"{performers_to_create} performers to create, "
+            f"{len(self.performers_to_upsert) - performers_to_create} performers to update, "
+            f"{len(self.studios_to_create)} studios to create and "
+            f"{len(self.tags_to_create)} tags to create"
+        )
+        if self.skipped_performers:
+            summary += f", {len(self.skipped_performers)} performers skipped"
+        return f"{summary}."
@@ -2,151 +2,244 @@ import json
 import requests
 import stashapi.log as logger
 
-from StashboxClient import StashboxClient
+from StashboxClient import (
+    StashboxClient,
+    map_pages_concurrently,
+    remove_duplicate_scenes,
+)
+from TpdbRecordCache import PERFORMER_RECORD, SITE_RECORD, TpdbRecordCache
 
 
-class TpdbClient(StashboxClient):
-    def __init__(self, endpoint, api_key):
-        self.endpoint = endpoint
-        self.api_key = api_key
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
+DEFAULT_PAGE_SIZE = 25
+
+# Largest page TPDB serves for scene listings.
+MAX_PAGE_SIZE = 100
+
+
+def convert_scene(scene_data):
+    studio = {
+        "id": scene_data.get("site", {}).get("uuid"),
+        "name": scene_data.get("site", {}).get("name"),
+    }
+    if scene_data.get("site", {}).get("network"):
+        studio["parent"] = {
+            "id": scene_data.get("site", {}).get("network", {}).get("uuid"),
+            "name": scene_data.get("site", {}).get("network", {}).get("name"),
         }
 
-    def query_performer_image(self, performer_stash_id):
-        response = requests.get(
-            f"https://api.theporndb.net/performers/{performer_stash_id}",
-            headers=self.headers,
+    performers = [
+        {
+            "performer": {
+                "id": scene_data_performer.get("parent").get("id"),
+                "name": scene_data_performer.get("parent").get("name"),
+            }
+        }
+        for scene_data_performer in scene_data.get("performers", [])
+        if scene_data_performer.get("parent") is not None
+    ]
+
+    return {
+        "id": scene_data.get("id"),
+        "title": scene_data.get("title"),
+        "details": scene_data.get("description"),
+        "release_date": scene_data.get("date"),
+        "updated": scene_data.get("updated_at") or scene_data.get("created_at"),
+        "urls": [
+            {
+                "url": scene_data.get("url"),
+                "site": {"name": "Studio", "url": ""},
+            }
+        ],
+        "studio": studio,
+        "images": [
+            {
+                "url": scene_data.get("background", {}).get("full"),
+            }
+        ],
+        "performers": performers,
+        "duration": scene_data.get("duration"),
+        "code": scene_data.get("external_id"),
+        "tags": scene_data.get("tags"),
+    }
+
+
+def convert_performer(performer_data):
+    return {
+        "_id": performer_data["_id"],
+        "name": performer_data["name"],
+        "image": performer_data.get("image"),
+    }
+
+
+def get_site_records(scenes_data) -> dict:
+    """Returns the site and network records embedded in a page of scenes by UUID."""
+    site_records = {}
+    for scene_data in scenes_data.get("data", []):
+        site = scene_data.get("site") or {}
+        for site_data in [site, site.get("network") or {}]:
+            if site_data.get("uuid") and "logo" in site_data:
+                site_records[site_data["uuid"]] = {
+                    "name": site_data.get("name"),
+                    "logo": site_data["logo"],
+                }
+    return site_records
+
+
+def get_headers(api_key: str) -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+
+
+def build_performer_url(performer_stash_id) -> str:
+    return f"https://api.theporndb.net/performers/{performer_stash_id}"
+
+
+def build_site_url(studio_stash_id) -> str:
+    return f"https://api.theporndb.net/sites/{studio_stash_id}"
+
+
+def build_scenes_page_url(performer: dict, page: int, page_size: int) -> str:
+    return f"https://api.theporndb.net/scenes?performers[{performer['_id']}]={performer['name']}&page={page}&per_page={page_size}"
+
+
+def get_performer_record(performer_stash_id, performer_data: dict | None) -> dict | None:
+    """Turns the response of a build_performer_url request into a performer record.
+
+    Returns None if the request failed or the performer does not exist.
+    """
+    if performer_data is None:
+        return None
+    if not performer_data.get("data"):
+        logger.error(
+            f"No performer found for performer with Stash ID {performer_stash_id}."
         )
-        if response.status_code == 200:
-            performer_data = response.json()
-            if performer_data.get("data"):
-                return performer_data["data"]["image"]
-            else:
-                logger.error(
-                    f"No image found for performer with Stash ID {performer_stash_id}."
-                )
-        else:
-            logger.error(
-                f"Query failed with status code {response.status_code}: {response.text}"
-            )
+        return None
+    return convert_performer(performer_data["data"])
+
+
+def get_site_record(studio_stash_id, studio_data: dict | None) -> dict | None:
+    """Turns the response of a build_site_url request into a site record.
 
+    Returns None if the request failed or the site does not exist.
+    """
+    if studio_data is None:
         return None
+    if not studio_data.get("data"):
+        logger.error(f"No image found for studio with Stash ID {studio_stash_id}.")
+        return None
+    return {
+        "name": studio_data["data"].get("name"),
+        "logo": studio_data["data"]["logo"],
+    }
 
-    def query_studio_image(self, studio_stash_id):
-        response = requests.get(
-            f"https://api.theporndb.net/sites/{studio_stash_id}",
-            headers=self.headers,
-        )
-        if response.status_code == 200:
-            studio_data = response.json()
-            if studio_data.get("data"):
-                return studio_data["data"]["logo"]
-            else:
-                logger.error(
-                    f"No image found for studio with Stash ID {studio_stash_id}."
-                )
-        else:
-            logger.error(
-                f"Query failed with status code {response.status_code}: {response.text}"
-            )
 
+def get_last_page(first_page: dict) -> int:
+    return first_page.get("meta", {}).get("last_page") or 1
+
+
+def get_scenes_from_pages(performer: dict, pages: list[dict | None]) -> list | None:
+    """Converts the pages of a performer's listing into scenes.
+
+    Returns None if any of the pages failed, as a partial listing would make
+    the missing scenes look removed from TPDB.
+    """
+    if any(scenes_data is None for scenes_data in pages):
         return None
 
-    def query_scenes(self, performer_stash_id):
-        performer_response = requests.get(
-            f"https://api.theporndb.net/performers/{performer_stash_id}",
-            headers=self.headers,
-        )
+    scenes = remove_duplicate_scenes(
+        [
+            convert_scene(scene_data)
+            for scenes_data in pages
+            for scene_data in scenes_data.get("data", [])
+        ]
+    )
+    logger.debug(f"Found {len(scenes)} scenes for performer {performer['name']}.")
+    return scenes
 
-        if performer_response.status_code == 200:
-            performer_data = performer_response.json()
-            if performer_data.get("data"):
-                performer_internal_id = performer_data["data"]["_id"]
-                performer_name = performer_data["data"]["name"]
-            else:
-                logger.error(
-                    f"No performer found for performer with Stash ID {performer_stash_id}."
-                )
-                return None
-        else:
-            logger.error(
-                f"Query failed with status code {performer_response.status_code}: {performer_response.text}"
-            )
+
+class TpdbClient(StashboxClient):
+    def __init__(
+        self,
+        endpoint,
+        api_key,
+        session: requests.Session | None = None,
+        record_cache: TpdbRecordCache | None = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        page_concurrency: int = 1,
+    ):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.session = session or requests.Session()
+        self.record_cache = record_cache or TpdbRecordCache()
+        self.page_size = min(page_size, MAX_PAGE_SIZE)
+        self.page_concurrency = page_concurrency
+        self.headers = get_headers(self.api_key)
+
+    def query_performer_image(self, performer_stash_id):
+        performer = self._get_performer(performer_stash_id)
+        if performer is None:
             return None
+        return performer["image"]
 
-        scenes = []
-        page = 1
-        while True:
-            url = f"https://api.theporndb.net/scenes?performers[{performer_internal_id}]={performer_name}&page={page}&per_page=25"
-            logger.debug(f"Querying scenes for performer {performer_name} from {url}")
-            response = requests.get(
-                url,
-                headers=self.headers,
+    def query_studio_image(self, studio_stash_id):
+        # Sites of all scenes listed so far are known without a request.
+        site = self.record_cache.get(SITE_RECORD, studio_stash_id)
+        if site is None:
+            site = get_site_record(
+                studio_stash_id, self._get(build_site_url(studio_stash_id))
             )
-            if response.status_code == 200:
-                scenes_data = response.json()
-                for scene_data in scenes_data.get("data", []):
-                    studio = {
-                        "id": scene_data.get("site", {}).get("uuid"),
-                        "name": scene_data.get("site", {}).get("name"),
-                    }
-                    if scene_data.get("site", {}).get("network"):
-                        studio["parent"] = {
-                            "id": scene_data.get("site", {})
-                            .get("network", {})
-                            .get("uuid"),
-                            "name": scene_data.get("site", {})
-                            .get("network", {})
-                            .get("name"),
-                        }
-
-                    performers = [
-                        {
-                            "performer": {
-                                "id": scene_data_performer.get("parent").get("id"),
-                                "name": scene_data_performer.get("parent").get("name"),
-                            }
-                        }
-                        for scene_data_performer in scene_data.get("performers", [])
-                        if scene_data_performer.get("parent") is not None
-                    ]
-
-                    scene = {
-                        "id": scene_data.get("id"),
-                        "title": scene_data.get("title"),
-                        "details": scene_data.get("description"),
-                        "release_date": scene_data.get("date"),
-                        "urls": [
-                            {
-                                "url": scene_data.get("url"),
-                                "site": {"name": "Studio", "url": ""},
-                            }
-                        ],
-                        "studio": studio,
-                        "images": [
-                            {
-                                "url": scene_data.get("background", {}).get("full"),
-                            }
-                        ],
-                        "performers": performers,
-                        "duration": scene_data.get("duration"),
-                        "code": scene_data.get("external_id"),
-                        "tags": scene_data.get("tags"),
-                    }
-                    scenes.append(scene)
-
-                if scenes_data.get("meta", {}).get("last_page") == page:
-                    break
-
-                page += 1
-            else:
-                logger.error(
-                    f"Query failed with status code {response.status_code}: {response.text}"
-                )
+            if site is None:
                 return None
+            self.record_cache.put(SITE_RECORD, studio_stash_id, site)
+        return site["logo"]
 
-        logger.debug(f"Found {len(scenes)} scenes for performer {performer_name}.")
+    def query_scenes(self, performer_stash_id):
+        performer = self._get_performer(performer_stash_id)
+        if performer is None:
+            return None
+
+        first_page = self._query_scenes_page(performer, 1)
+        if first_page is None:
+            return None
 
-        return scenes
+        # The first page tells how many pages there are, so all remaining
+        # pages are requested at once with up to page_concurrency requests in
+        # flight.
+        remaining_pages = map_pages_concurrently(
+            lambda page: self._query_scenes_page(performer, page),
+            range(2, get_last_page(first_page) + 1),
+            self.page_concurrency,
+        )
+        return get_scenes_from_pages(performer, [first_page] + remaining_pages)
+
+    def close(self):
+        self.record_cache.close()
+
+    def _query_scenes_page(self, performer, page):
+        url = build_scenes_page_url(performer, page, self.page_size)
+        logger.debug(f"Querying scenes for performer {performer['name']} from {url}")
+        scenes_data = self._get(url)
+        if scenes_data is not None:
+            self.record_cache.put_many(SITE_RECORD, get_site_records(scenes_data))
+        return scenes_data
+
+    def _get_performer(self, performer_stash_id):
+        performer = self.record_cache.get(PERFORMER_RECORD, performer_stash_id)
+        if performer is None:
+            performer = get_performer_record(
+                performer_stash_id, self._get(build_performer_url(performer_stash_id))
+            )
+            if performer is not None:
+                self.record_cache.put(PERFORMER_RECORD, performer_stash_id, performer)
+        return performer
+
+    def _get(self, url):
+        response = self.session.get(url, headers=self.headers)
+        if response.status_code != 200:
+            logger.error(
+                f"Query failed with status code {response.status_code}: {response.text}"
+            )
+            return None
+        return response.json()
@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+PERFORMER_RECORD = "performer"
+SITE_RECORD = "site"
+
+
+class TpdbRecordCache:
+    """Memo of TPDB performer and site records.
+
+    Scene queries and image lookups of a performer all need the same
+    performer record, and studio logos are part of the site records embedded
+    in every scene listing, so each record only has to be fetched once. Records are kept in memory for the lifetime of the client.
+    With a database path they are also stored in SQLite and reused by later
+    runs until they are older than ttl_seconds.
+    """
+
+    def __init__(self, database_path: str | None = None, ttl_seconds: float = 0):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._records = {}
+        self._connection = None
+        if database_path is None or ttl_seconds <= 0:
+            return
+
+        os.makedirs(os.path.dirname(database_path), exist_ok=True)
+        self._connection = sqlite3.connect(
+            database_path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS records (
+                    kind TEXT NOT NULL,
+                    record_id TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (kind, record_id)
+                )
+                """
+            )
+            self._connection.execute(
+                "DELETE FROM records WHERE fetched_at < ?",
+                (time.time() - ttl_seconds,),
+            )
+
+    def get(self, kind: str, record_id: str) -> dict | None:
+        key = (kind, str(record_id))
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None or self._connection is None:
+                return record
+
+            row = self._connection.execute(
+                "SELECT payload FROM records WHERE kind = ? AND record_id = ? AND fetched_at >= ?",
+                (*key, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            record = self._records[key] = json.loads(row[0])
+            return record
+
+    def put(self, kind: str, record_id: str, record: dict) -> None:
+        self.put_many(kind, {record_id: record})
+
+    def put_many(self, kind: str, records_by_id: dict) -> None:
+        with self._lock:
+            # Records seen on every page of a listing are only written once.
+            changed_records = {
+                (kind, str(record_id)): record
+                for record_id, record in records_by_id.items()
+                if self._records.get((kind, str(record_id))) != record
+            }
+            self._records.update(changed_records)
+            if self._connection is None or not changed_records:
+                return
+
+            now = time.time()
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO records (kind, record_id, fetched_at, payload) VALUES (?, ?, ?, ?)",
+                    [
+                        (kind, record_id, now, json.dumps(record))
+                        for (kind, record_id), record in changed_records.items()
+                    ],
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
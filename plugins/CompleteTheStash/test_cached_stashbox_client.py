@@ -0,0 +1,203 @@
+import sqlite3
+
+import pytest
+
+import StashboxSceneCache as stashbox_scene_cache_module
+from CachedStashboxClient import CachedStashboxClient
+from StashboxClient import SCENE_PROJECTION_SLIM, StashboxClient
+from StashboxSceneCache import StashboxSceneCache
+
+
+ENDPOINT = "https://stashdb.org/graphql"
+TTL_SECONDS = 60
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeStashboxClient(StashboxClient):
+    """Serves listings by performer stash ID and records the queries made."""
+
+    def __init__(self, scenes_by_performer, changes_by_performer=None):
+        self.endpoint = ENDPOINT
+        self.scenes_by_performer = scenes_by_performer
+        self.changes_by_performer = changes_by_performer or {}
+        self.queries = []
+
+    def query_performer_image(self, performer_stash_id):
+        return None
+
+    def query_studio_image(self, performer_stash_id):
+        return None
+
+    def query_scenes(self, performer_stash_id):
+        self.queries.append(("query_scenes", performer_stash_id))
+        return self.scenes_by_performer[performer_stash_id]
+
+    def query_scenes_updated_since(self, performer_stash_id, since):
+        self.queries.append(("query_scenes_updated_since", performer_stash_id, since))
+        return self.changes_by_performer.get(performer_stash_id)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(stashbox_scene_cache_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = StashboxSceneCache(str(tmp_path / "stashbox-scenes.sqlite"), 100)
+    yield cache
+    cache.close()
+
+
+def scene(scene_id, updated, title=None):
+    return {
+        "id": scene_id,
+        "title": title or f"Scene {scene_id}",
+        "updated": f"2024-05-{updated:02d}T10:00:00Z",
+    }
+
+
+def test_cached_scenes_are_served_until_they_expire(clock, cache):
+    stashbox_client = FakeStashboxClient({"performer": [scene("1", 1)]})
+    cached_client = CachedStashboxClient(stashbox_client, cache, TTL_SECONDS)
+
+    assert cached_client.query_scenes("performer") == [scene("1", 1)]
+    clock.now += TTL_SECONDS
+    assert cached_client.query_scenes("performer") == [scene("1", 1)]
+    assert len(stashbox_client.queries) == 1
+
+    clock.now += 1
+    cached_client.query_scenes("performer")
+    assert stashbox_client.queries == [("query_scenes", "performer")] * 2
+
+
+def test_refresh_ignores_cached_scenes(clock, cache):
+    stashbox_client = FakeStashboxClient({"performer": [scene("1", 1)]})
+    CachedStashboxClient(stashbox_client, cache, TTL_SECONDS).query_scenes("performer")
+
+    CachedStashboxClient(
+        stashbox_client, cache, TTL_SECONDS, force_refresh=True
+    ).query_scenes("performer")
+
+    assert len(stashbox_client.queries) == 2
+
+
+def test_uncached_scenes_of_a_batch_are_queried_together(clock, cache):
+    stashbox_client = FakeStashboxClient(
+        {"performer-1": [scene("1", 1)], "performer-2": [scene("2", 1)]}
+    )
+    cached_client = CachedStashboxClient(stashbox_client, cache, TTL_SECONDS)
+    cached_client.query_scenes("performer-1")
+
+    assert cached_client.query_scenes_batch(["performer-1", "performer-2"]) == {
+        "performer-1": [scene("1", 1)],
+        "performer-2": [scene("2", 1)],
+    }
+    assert stashbox_client.queries == [
+        ("query_scenes", "performer-1"),
+        ("query_scenes", "performer-2"),
+    ]
+
+
+def test_listings_are_cached_per_projection_and_excluded_tags(clock, cache):
+    stashbox_client = FakeStashboxClient({"performer": [scene("1", 1)]})
+    stashbox_client.scene_projection = SCENE_PROJECTION_SLIM
+    stashbox_client.excluded_tag_names = ("Compilation", "Behind The Scenes")
+    CachedStashboxClient(stashbox_client, cache, TTL_SECONDS).query_scenes("performer")
+
+    assert cache.get(ENDPOINT, "performer", TTL_SECONDS) is None
+    assert cache.get(
+        f"{ENDPOINT}#slim#exclude=Behind The Scenes,Compilation",
+        "performer",
+        TTL_SECONDS,
+    ) == [scene("1", 1)]
+
+
+def test_expired_scenes_are_merged_with_changed_scenes(clock, cache):
+    stashbox_client = FakeStashboxClient(
+        {"performer": [scene("1", 1), scene("2", 2)]},
+        {
+            "performer": (
+                [scene("2", 5, title="Renamed"), scene("3", 4)],
+                3,
+            )
+        },
+    )
+    cached_client = CachedStashboxClient(
+        stashbox_client, cache, TTL_SECONDS, incremental=True
+    )
+    cached_client.query_scenes("performer")
+    clock.now += TTL_SECONDS + 1
+
+    merged_scenes = [scene("1", 1), scene("2", 5, title="Renamed"), scene("3", 4)]
+    assert cached_client.query_scenes("performer") == merged_scenes
+
+    _, _, since = stashbox_client.queries[1]
+    assert since.isoformat() == "2024-05-02T10:00:00+00:00"
+    assert cache.get_with_watermark(ENDPOINT, "performer") == (
+        merged_scenes,
+        "2024-05-05T10:00:00+00:00",
+    )
+    assert len(stashbox_client.queries) == 2
+
+
+def test_all_scenes_are_queried_when_the_merged_count_is_off(clock, cache):
+    # Scene 2 was deleted on the stash-box, which no incremental query reveals.
+    stashbox_client = FakeStashboxClient(
+        {"performer": [scene("1", 1), scene("2", 2)]},
+        {"performer": ([scene("3", 4)], 2)},
+    )
+    cached_client = CachedStashboxClient(
+        stashbox_client, cache, TTL_SECONDS, incremental=True
+    )
+    cached_client.query_scenes("performer")
+    clock.now += TTL_SECONDS + 1
+    stashbox_client.scenes_by_performer["performer"] = [scene("1", 1), scene("3", 4)]
+
+    assert cached_client.query_scenes("performer") == [scene("1", 1), scene("3", 4)]
+    assert [query[0] for query in stashbox_client.queries] == [
+        "query_scenes",
+        "query_scenes_updated_since",
+        "query_scenes",
+    ]
+    assert cache.get(ENDPOINT, "performer", TTL_SECONDS) == [
+        scene("1", 1),
+        scene("3", 4),
+    ]
+
+
+def test_all_scenes_are_queried_without_incremental_support(clock, cache):
+    stashbox_client = FakeStashboxClient({"performer": [scene("1", 1)]})
+    cached_client = CachedStashboxClient(
+        stashbox_client, cache, TTL_SECONDS, incremental=True
+    )
+    cached_client.query_scenes("performer")
+    clock.now += TTL_SECONDS + 1
+
+    cached_client.query_scenes("performer")
+    assert [query[0] for query in stashbox_client.queries] == [
+        "query_scenes",
+        "query_scenes_updated_since",
+        "query_scenes",
+    ]
+
+
+def test_closing_closes_the_client_and_the_cache(clock, cache):
+    stashbox_client = FakeStashboxClient({})
+    closed = []
+    stashbox_client.close = lambda: closed.append(True)
+
+    CachedStashboxClient(stashbox_client, cache, TTL_SECONDS).close()
+
+    assert closed == [True]
+    with pytest.raises(sqlite3.ProgrammingError):
+        cache.get(ENDPOINT, "performer", TTL_SECONDS)
@@ -0,0 +1,159 @@
+import pytest
+
+import CompleteTheStash
+import HookEventQueue as hook_event_queue_module
+from HookEventQueue import MAX_DEBOUNCE_SECONDS, STALE_CLAIM_SECONDS, HookEventQueue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(hook_event_queue_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def create_queue(tmp_path):
+    queues = []
+
+    def create_queue(debounce_seconds=2.0):
+        queue = HookEventQueue(str(tmp_path / "hook-events.sqlite"), debounce_seconds)
+        queues.append(queue)
+        return queue
+
+    yield create_queue
+    for queue in queues:
+        queue.close()
+
+
+def test_events_are_handed_out_once_they_settle(clock, create_queue):
+    queue = create_queue(debounce_seconds=2.0)
+    queue.put(1)
+    clock.advance(1)
+    queue.put(2)
+
+    assert queue.claim() == (clock.now, [])
+    assert queue.seconds_until_ready() == 2.0
+
+    clock.advance(2)
+    assert queue.seconds_until_ready() == 0.0
+    assert queue.claim() == (clock.now, ["1", "2"])
+
+
+def test_events_are_handed_out_after_the_maximum_debounce(clock, create_queue):
+    queue = create_queue(debounce_seconds=2.0)
+    for scene_id in range(int(MAX_DEBOUNCE_SECONDS)):
+        queue.put(scene_id)
+        assert queue.claim()[1] == []
+        clock.advance(1)
+
+    assert len(queue.claim()[1]) == MAX_DEBOUNCE_SECONDS
+
+
+def test_events_without_debounce_are_handed_out_right_away(clock, create_queue):
+    queue = create_queue(debounce_seconds=0)
+    queue.put(1)
+
+    assert queue.claim()[1] == ["1"]
+
+
+def test_events_of_the_same_scene_are_coalesced(clock, create_queue):
+    queue = create_queue(debounce_seconds=0)
+    queue.put(1)
+    queue.put("1")
+    queue.put(2)
+
+    assert queue.claim()[1] == ["1", "2"]
+
+
+def test_claims_are_limited_to_the_batch_size(clock, create_queue):
+    queue = create_queue(debounce_seconds=0)
+    for scene_id in range(5):
+        queue.put(scene_id)
+
+    assert queue.claim(limit=3)[1] == ["0", "1", "2"]
+    assert queue.claim(limit=3)[1] == ["3", "4"]
+    assert queue.claim(limit=3)[1] == []
+
+
+def test_completed_events_are_removed(clock, create_queue):
+    queue = create_queue(debounce_seconds=0)
+    queue.put(1)
+    claimed_at, scene_ids = queue.claim()
+    queue.complete(claimed_at, scene_ids)
+
+    clock.advance(STALE_CLAIM_SECONDS + 1)
+    assert queue.seconds_until_ready() is None
+    assert queue.claim()[1] == []
+
+
+def test_events_queued_again_while_processing_stay_queued(clock, create_queue):
+    queue = create_queue(debounce_seconds=0)
+    queue.put(1)
+    claimed_at, scene_ids = queue.claim()
+    clock.advance(1)
+    queue.put(1)
+    queue.complete(claimed_at, scene_ids)
+
+    assert queue.claim()[1] == ["1"]
+
+
+def test_claimed_events_are_handed_out_again_once_the_claim_is_stale(
+    clock, create_queue
+):
+    queue = create_queue(debounce_seconds=0)
+    queue.put(1)
+    queue.claim()
+
+    # Another process sharing the queue must not get the claimed events.
+    other_queue = create_queue(debounce_seconds=0)
+    clock.advance(STALE_CLAIM_SECONDS - 1)
+    assert other_queue.claim()[1] == []
+
+    clock.advance(2)
+    assert other_queue.claim()[1] == ["1"]
+
+
+class FakeStashCompleter:
+    def __init__(self):
+        self.processed_scene_ids = []
+
+    def process_scenes_by_ids(self, scene_ids):
+        self.processed_scene_ids.append(scene_ids)
+
+
+def test_hook_events_are_processed_right_away_without_the_hook_worker(
+    clock, create_queue
+):
+    queue = create_queue(debounce_seconds=0)
+    stash_completer = FakeStashCompleter()
+    loads = []
+
+    def get_stash_completers():
+        loads.append(True)
+        return [stash_completer]
+
+    hook_input = {"args": {"hookContext": {"type": "Scene.Update.Post", "id": 7}}}
+    CompleteTheStash.process_hook_event(hook_input, queue, get_stash_completers)
+
+    assert stash_completer.processed_scene_ids == [["7"]]
+    assert queue.seconds_until_ready() is None
+
+    # Without an event there is nothing to claim, so no Stash is connected to.
+    CompleteTheStash.process_hook_event(
+        {"args": {"hookContext": {"type": "Scene.Update.Post"}}},
+        queue,
+        get_stash_completers,
+    )
+    assert len(loads) == 1
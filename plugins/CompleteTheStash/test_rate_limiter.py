@@ -0,0 +1,146 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import HttpSession
+import RateLimiter as rate_limiter_module
+from HttpSession import RateLimitedSession
+from RateLimiter import MAX_BACKOFF_SECONDS, RateLimiter, get_retry_delay, parse_retry_after
+from StashboxClient import StashboxQueryError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter_module, "time", clock)
+    monkeypatch.setattr(HttpSession, "time", clock)
+    return clock
+
+
+def test_retry_after_is_parsed_from_seconds_and_dates():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+
+def test_retry_delay_prefers_retry_after_and_caps_the_backoff():
+    assert get_retry_delay(10, retry_after=5.0) == 5.0
+    for attempt in range(10):
+        assert 0 <= get_retry_delay(attempt) <= min(MAX_BACKOFF_SECONDS, 2**attempt)
+
+
+def test_requests_are_let_through_in_bursts_and_then_paced(clock):
+    rate_limiter = RateLimiter(requests_per_second=2, burst=2)
+
+    assert rate_limiter.reserve("stashdb.org") == 0.0
+    assert rate_limiter.reserve("stashdb.org") == 0.0
+    assert rate_limiter.reserve("stashdb.org") == 0.5
+    assert rate_limiter.reserve("stashdb.org") == 1.0
+
+    # Every host has its own bucket.
+    assert rate_limiter.reserve("theporndb.net") == 0.0
+
+    clock.now += 1.5
+    assert rate_limiter.reserve("stashdb.org") == 0.0
+
+
+def test_pauses_hold_back_requests_even_without_a_limit(clock):
+    rate_limiter = RateLimiter()
+    rate_limiter.pause("stashdb.org", 10)
+
+    rate_limiter.acquire("stashdb.org")
+    rate_limiter.acquire("theporndb.net")
+
+    assert clock.sleeps == [10]
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def send(monkeypatch):
+    """Replaces the sent requests with the given responses or exceptions."""
+    requested_urls = []
+
+    def send(*responses):
+        remaining = list(responses)
+
+        def request(session, method, url, *args, **kwargs):
+            requested_urls.append(url)
+            response = remaining.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        monkeypatch.setattr(requests.Session, "request", request)
+        return requested_urls
+
+    return send
+
+
+def test_transient_failures_are_retried(clock, send):
+    response = FakeResponse(200)
+    failed_response = FakeResponse(502)
+    requested_urls = send(
+        requests.ConnectionError("connection reset"), failed_response, response
+    )
+    session = RateLimitedSession(RateLimiter(), max_retries=2)
+
+    assert session.request("POST", "https://stashdb.org/graphql") is response
+    assert len(requested_urls) == 3
+    assert len(clock.sleeps) == 2
+    assert failed_response.closed
+
+
+def test_retry_after_pauses_the_host(clock, send):
+    send(FakeResponse(429, {"Retry-After": "7"}), FakeResponse(200))
+    session = RateLimitedSession(RateLimiter(), max_retries=1)
+
+    session.request("POST", "https://stashdb.org/graphql")
+
+    # The backoff already waits out the pause, so the retry is sent right away.
+    assert clock.sleeps == [7.0]
+
+
+def test_other_failures_are_not_retried(clock, send):
+    response = FakeResponse(400)
+    requested_urls = send(response)
+    session = RateLimitedSession(RateLimiter(), max_retries=5)
+
+    assert session.request("POST", "https://stashdb.org/graphql") is response
+    assert len(requested_urls) == 1
+
+
+def test_error_is_raised_once_retries_are_used_up(clock, send):
+    requested_urls = send(FakeResponse(503), FakeResponse(503), FakeResponse(503))
+    session = RateLimitedSession(RateLimiter(), max_retries=2)
+
+    with pytest.raises(StashboxQueryError, match="after 3 attempts with status code 503"):
+        session.request("POST", "https://stashdb.org/graphql")
+    assert len(requested_urls) == 3
@@ -0,0 +1,548 @@
+import json
+
+import pytest
+
+from LocalStashClient import PerformerImageOptions
+from StashCompleter import StashCompleter
+from StashboxClient import StashboxClient, StashboxQueryError
+from SyncPlan import SyncPlan
+
+
+ENDPOINT = "https://stashdb.org/graphql"
+
+
+def stash_ids(stash_id, endpoint=ENDPOINT):
+    return [{"endpoint": endpoint, "stash_id": stash_id}]
+
+
+def local_performer(performer_id, name, stash_id):
+    return {
+        "id": performer_id,
+        "name": name,
+        "stash_ids": stash_ids(stash_id),
+        "tags": [{"name": "Completionist"}],
+        "custom_fields": {},
+    }
+
+
+def stashbox_scene(stash_id, performer_stash_ids=(), studio=None, tags=()):
+    return {
+        "id": stash_id,
+        "title": f"Scene {stash_id}",
+        "code": None,
+        "details": None,
+        "release_date": "2024-01-02",
+        "urls": [],
+        "images": [],
+        "studio": studio,
+        "performers": [
+            {"performer": {"id": performer_stash_id, "name": performer_stash_id}}
+            for performer_stash_id in performer_stash_ids
+        ],
+        "tags": [{"name": tag} for tag in tags],
+    }
+
+
+def missing_scene(scene_id, stash_id):
+    return {
+        "id": scene_id,
+        "title": f"Missing {stash_id}",
+        "stash_ids": stash_ids(stash_id),
+    }
+
+
+class FakeLogger:
+    def __init__(self):
+        self.messages = []
+
+    def trace(self, message):
+        pass
+
+    def debug(self, message):
+        pass
+
+    def info(self, message):
+        self.messages.append(message)
+
+    def warning(self, message):
+        self.messages.append(message)
+
+    def error(self, message):
+        self.messages.append(message)
+
+    def progress(self, progress):
+        pass
+
+
+class FakeLocalStashClient:
+    def __init__(self, performers, scenes_by_performer_id=None, scene_stash_ids=()):
+        self.performers = performers
+        self.scenes_by_performer_id = scenes_by_performer_id or {}
+        self.scene_stash_ids = scene_stash_ids
+        self.images = {}
+
+    def find_tag(self, tag_name):
+        return {"id": "1", "name": tag_name}
+
+    def find_performers(self, performer_filter, filter, image_options=None):
+        start = (filter["page"] - 1) * filter["per_page"]
+        return self.performers[start : start + filter["per_page"]]
+
+    def find_performer(self, performer_id):
+        return {"scenes": self.scenes_by_performer_id.get(performer_id, [])}
+
+    def iter_scene_stash_ids(self, endpoint):
+        return iter(self.scene_stash_ids)
+
+    def get_performer_image_data_url(self, performer, image_options):
+        return self.images.get(performer["id"])
+
+
+class FakeMissingStashClient:
+    url = "http://missing:9999/graphql"
+
+    def __init__(
+        self,
+        performers_by_stash_id=None,
+        scenes_by_performer_id=None,
+        tag_names=(),
+        studio_stash_ids=(),
+    ):
+        self.performers_by_stash_id = performers_by_stash_id or {}
+        self.scenes_by_performer_id = scenes_by_performer_id or {}
+        self.tag_names = {tag_name.lower() for tag_name in tag_names}
+        self.studios = {
+            stash_id: {"id": f"studio-{stash_id}"} for stash_id in studio_stash_ids
+        }
+        self.existing_scene_ids = {
+            scene["id"]
+            for scenes in self.scenes_by_performer_id.values()
+            for scene in scenes
+        }
+        self.calls = []
+
+    def find_performers_by_stash_id(self, stash_id):
+        performer_id = self.performers_by_stash_id.get(stash_id)
+        return [{"id": performer_id}] if performer_id else []
+
+    def find_performer(self, performer_id):
+        return {"scenes": self.scenes_by_performer_id.get(performer_id, [])}
+
+    def iter_scene_pages(self):
+        yield [
+            scene for scenes in self.scenes_by_performer_id.values() for scene in scenes
+        ]
+
+    def find_new_tag_names(self, tag_names):
+        new_tag_names = {}
+        for tag_name in tag_names:
+            if tag_name.lower() not in self.tag_names:
+                new_tag_names.setdefault(tag_name.lower(), tag_name)
+        return list(new_tag_names.values())
+
+    def get_or_create_tags(self, tag_names):
+        self.tag_names.update(tag_name.lower() for tag_name in tag_names)
+        return [{"id": f"tag-{tag_name}"} for tag_name in tag_names]
+
+    def find_studio_by_stash_id(self, stash_id, endpoint=None):
+        return self.studios.get(stash_id)
+
+    def create_studio(self, studio_data):
+        stash_id = studio_data["stash_ids"][0]["stash_id"]
+        self.calls.append(("create_studio", stash_id, studio_data.get("parent_id")))
+        studio = self.studios[stash_id] = {"id": f"studio-{stash_id}"}
+        return studio
+
+    def create_performer(self, performer_data):
+        self.calls.append(("create_performer", performer_data["name"]))
+        return {"id": f"performer-{performer_data['name']}"}
+
+    def update_performer(self, performer_data):
+        self.calls.append(("update_performer", performer_data["name"]))
+        return performer_data
+
+    def destroy_scenes(self, scene_ids):
+        destroyed_scene_ids = [
+            str(scene_id) for scene_id in scene_ids if scene_id in self.existing_scene_ids
+        ]
+        self.calls.append(("destroy_scenes", destroyed_scene_ids))
+        return destroyed_scene_ids
+
+    def create_scenes(self, scenes_data):
+        self.calls.append(
+            (
+                "create_scenes",
+                [scene_data["stash_ids"][0]["stash_id"] for scene_data in scenes_data],
+            )
+        )
+        return [{"id": f"new-{index}"} for index, _ in enumerate(scenes_data)]
+
+
+class FakeStashboxClient(StashboxClient):
+    """Serves listings by performer stash ID. Listings which are exceptions are raised."""
+
+    def __init__(self, scenes_by_performer, studio_images=None):
+        self.endpoint = ENDPOINT
+        self.scenes_by_performer = scenes_by_performer
+        self.studio_images = studio_images or {}
+
+    def query_performer_image(self, performer_stash_id):
+        return None
+
+    def query_studio_image(self, studio_stash_id):
+        image = self.studio_images.get(studio_stash_id)
+        if isinstance(image, Exception):
+            raise image
+        return image
+
+    def query_scenes(self, performer_stash_id):
+        scenes = self.scenes_by_performer.get(performer_stash_id, [])
+        if isinstance(scenes, Exception):
+            raise scenes
+        return scenes
+
+
+class FakePerformerImageCache:
+    def __init__(self):
+        self.pushed = set()
+
+    def is_pushed(self, url, missing_performer_id, image_hash):
+        return (missing_performer_id, image_hash) in self.pushed
+
+    def mark_pushed(self, url, missing_performer_id, image_hash):
+        self.pushed.add((missing_performer_id, image_hash))
+
+
+def create_stash_completer(
+    local_stash_client,
+    missing_stash_client,
+    stashbox_client,
+    performer_image_options=None,
+    **config,
+):
+    return StashCompleter(
+        {
+            "performerTags": ["Completionist"],
+            "stashboxEndpoint": ENDPOINT,
+            "sceneExcludeTags": [],
+            "performerConcurrency": 1,
+            "stashboxBatchSize": 10,
+            "sceneBatchSize": 2,
+            **config,
+        },
+        FakeLogger(),
+        stashbox_client,
+        local_stash_client,
+        missing_stash_client,
+        performer_image_options,
+    )
+
+
+def test_plan_sync_creates_scenes_shared_by_performers_once():
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient(
+            [local_performer("1", "Alice", "pa"), local_performer("2", "Bea", "pb")]
+        ),
+        FakeMissingStashClient(),
+        FakeStashboxClient(
+            {
+                "pa": [stashbox_scene("s1", ["pa", "pb"])],
+                "pb": [stashbox_scene("s1", ["pa", "pb"]), stashbox_scene("s2", ["pb"])],
+            }
+        ),
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert [scene["id"] for scene in sync_plan.scenes_to_create] == ["s1", "s2"]
+    assert [
+        performer_upsert["stash_id"] for performer_upsert in sync_plan.performers_to_upsert
+    ] == ["pa", "pb"]
+    assert sync_plan.scenes_to_destroy == []
+
+
+def test_plan_sync_does_not_create_scenes_which_exist_through_another_performer():
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient(
+            [local_performer("1", "Alice", "pa"), local_performer("2", "Bea", "pb")]
+        ),
+        FakeMissingStashClient(
+            performers_by_stash_id={"pa": "m1"},
+            scenes_by_performer_id={"m1": [missing_scene("10", "s1")]},
+        ),
+        FakeStashboxClient(
+            {
+                "pa": [stashbox_scene("s1", ["pa", "pb"])],
+                "pb": [stashbox_scene("s1", ["pa", "pb"])],
+            }
+        ),
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert sync_plan.scenes_to_create == []
+    assert sync_plan.performers_to_upsert[0]["missing_performer_id"] == "m1"
+    assert sync_plan.performers_to_upsert[1]["missing_performer_id"] is None
+
+
+def test_plan_sync_keeps_scenes_which_another_performer_still_lists():
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient(
+            [local_performer("1", "Alice", "pa"), local_performer("2", "Bea", "pb")]
+        ),
+        FakeMissingStashClient(
+            performers_by_stash_id={"pa": "m1"},
+            scenes_by_performer_id={
+                "m1": [missing_scene("10", "s1"), missing_scene("11", "s9")]
+            },
+        ),
+        FakeStashboxClient({"pa": [], "pb": [stashbox_scene("s1", ["pb"])]}),
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert sync_plan.scenes_to_destroy == [
+        {
+            "id": "11",
+            "title": "Missing s9",
+            "stash_id": "s9",
+            "reason": "missing_from_stashbox",
+        }
+    ]
+
+
+def test_plan_sync_destroys_missing_scenes_found_locally():
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient(
+            [local_performer("1", "Alice", "pa")],
+            scenes_by_performer_id={"1": [{"stash_ids": stash_ids("s1")}]},
+            scene_stash_ids=["s1", "s2"],
+        ),
+        FakeMissingStashClient(
+            performers_by_stash_id={"pa": "m1", "px": "m2"},
+            scenes_by_performer_id={
+                "m1": [missing_scene("10", "s1")],
+                # Belongs to a performer which is not selected.
+                "m2": [missing_scene("20", "s2")],
+            },
+        ),
+        FakeStashboxClient(
+            {"pa": [stashbox_scene("s1", ["pa"]), stashbox_scene("s2", ["pa"])]}
+        ),
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert sync_plan.scenes_to_create == []
+    assert [
+        (scene["id"], scene["reason"]) for scene in sync_plan.scenes_to_destroy
+    ] == [("10", "found_locally"), ("20", "found_locally")]
+
+
+def test_plan_sync_skips_performers_whose_scenes_cannot_be_queried():
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient(
+            [local_performer("1", "Alice", "pa"), local_performer("2", "Bea", "pb")]
+        ),
+        FakeMissingStashClient(
+            performers_by_stash_id={"pb": "m2"},
+            scenes_by_performer_id={"m2": [missing_scene("20", "s2")]},
+        ),
+        FakeStashboxClient(
+            {
+                "pa": [stashbox_scene("s1", ["pa"])],
+                "pb": StashboxQueryError("Request failed after 6 attempts."),
+            }
+        ),
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert sync_plan.skipped_performers == ["Bea"]
+    assert [scene["id"] for scene in sync_plan.scenes_to_create] == ["s1"]
+    # The scenes of a skipped performer must not look removed from the stash-box.
+    assert sync_plan.scenes_to_destroy == []
+    assert len(sync_plan.performers_to_upsert) == 2
+
+
+def test_plan_sync_leaves_out_scenes_with_exclude_tags():
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient([local_performer("1", "Alice", "pa")]),
+        FakeMissingStashClient(),
+        FakeStashboxClient(
+            {
+                "pa": [
+                    stashbox_scene("s1", ["pa"], tags=["Compilation"]),
+                    stashbox_scene("s2", ["pa"], tags=["Outdoor"]),
+                ]
+            }
+        ),
+        sceneExcludeTags=["Compilation"],
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert [scene["id"] for scene in sync_plan.scenes_to_create] == ["s2"]
+
+
+def test_plan_sync_plans_new_studios_parents_first_and_new_tags_once():
+    network = {"id": "net", "name": "Network"}
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient([local_performer("1", "Alice", "pa")]),
+        FakeMissingStashClient(tag_names=["Completionist"], studio_stash_ids=["old"]),
+        FakeStashboxClient(
+            {
+                "pa": [
+                    stashbox_scene(
+                        "s1",
+                        ["pa"],
+                        studio={"id": "site", "name": "Site", "parent": network},
+                        tags=["Outdoor"],
+                    ),
+                    stashbox_scene(
+                        "s2", ["pa"], studio={"id": "old", "name": "Old"}, tags=["outdoor"]
+                    ),
+                ]
+            }
+        ),
+    )
+
+    sync_plan = stash_completer.plan_sync()
+
+    assert sync_plan.studios_to_create == [
+        {"stash_id": "net", "name": "Network", "parent_stash_id": None},
+        {"stash_id": "site", "name": "Site", "parent_stash_id": "net"},
+    ]
+    assert sync_plan.tags_to_create == ["Outdoor"]
+
+
+def test_sync_plan_can_be_written_as_json_and_summarized():
+    sync_plan = SyncPlan(
+        ENDPOINT,
+        tags_to_create=["Outdoor"],
+        performers_to_upsert=[
+            {"stash_id": "pa", "missing_performer_id": None, "local_performer": {}},
+            {"stash_id": "pb", "missing_performer_id": "m2", "local_performer": {}},
+        ],
+        scenes_to_create=[stashbox_scene("s1")],
+        skipped_performers=["Bea"],
+    )
+
+    assert json.loads(json.dumps(sync_plan.to_dict()))["endpoint"] == ENDPOINT
+    assert sync_plan.get_summary() == (
+        "1 scenes to create, 0 scenes to destroy, 1 performers to create, "
+        "1 performers to update, 0 studios to create and 1 tags to create, "
+        "1 performers skipped."
+    )
+
+
+@pytest.mark.parametrize("performer_concurrency", [1, 4])
+def test_apply_sync_plan_creates_dependencies_first(performer_concurrency):
+    missing_stash_client = FakeMissingStashClient()
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient([]),
+        missing_stash_client,
+        FakeStashboxClient({}),
+        performerConcurrency=performer_concurrency,
+    )
+    sync_plan = SyncPlan(
+        ENDPOINT,
+        studios_to_create=[
+            {"stash_id": "net", "name": "Network", "parent_stash_id": None},
+            {"stash_id": "site", "name": "Site", "parent_stash_id": "net"},
+        ],
+        performers_to_upsert=[
+            {
+                "stash_id": "pa",
+                "missing_performer_id": None,
+                "local_performer": local_performer("1", "Alice", "pa"),
+            }
+        ],
+        scenes_to_create=[
+            stashbox_scene("s1", ["pa"], studio={"id": "site", "name": "Site"})
+        ],
+    )
+
+    stash_completer.apply_sync_plan(sync_plan)
+
+    assert missing_stash_client.calls == [
+        ("create_studio", "net", None),
+        ("create_studio", "site", "studio-net"),
+        ("create_performer", "Alice"),
+        ("create_scenes", ["s1"]),
+    ]
+
+
+def test_apply_sync_plan_creates_studios_without_image_when_it_cannot_be_queried():
+    missing_stash_client = FakeMissingStashClient()
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient([]),
+        missing_stash_client,
+        FakeStashboxClient(
+            {}, studio_images={"site": StashboxQueryError("Request failed.")}
+        ),
+    )
+
+    stash_completer.apply_sync_plan(
+        SyncPlan(
+            ENDPOINT,
+            studios_to_create=[
+                {"stash_id": "site", "name": "Site", "parent_stash_id": None}
+            ],
+            scenes_to_create=[stashbox_scene("s1", studio={"id": "site", "name": "Site"})],
+        )
+    )
+
+    assert missing_stash_client.calls == [
+        ("create_studio", "site", None),
+        ("create_scenes", ["s1"]),
+    ]
+
+
+def test_apply_sync_plan_only_reports_scenes_which_still_existed():
+    missing_stash_client = FakeMissingStashClient(
+        scenes_by_performer_id={"m1": [missing_scene("10", "s1")]}
+    )
+    stash_completer = create_stash_completer(
+        FakeLocalStashClient([]), missing_stash_client, FakeStashboxClient({})
+    )
+
+    stash_completer.apply_sync_plan(
+        SyncPlan(
+            ENDPOINT,
+            scenes_to_destroy=[
+                {"id": "10", "title": "Ten", "stash_id": "s1", "reason": "found_locally"},
+                {"id": "11", "title": "Gone", "stash_id": "s2", "reason": "found_locally"},
+            ],
+        )
+    )
+
+    assert missing_stash_client.calls == [("destroy_scenes", ["10"])]
+    assert (
+        "0 new missing scenes created. 1 previously missing scenes destroyed."
+        in stash_completer.logger.messages
+    )
+
+
+def test_upsert_missing_performer_only_marks_uploaded_images_as_pushed():
+    local_stash_client = FakeLocalStashClient([])
+    performer_image_cache = FakePerformerImageCache()
+    stash_completer = create_stash_completer(
+        local_stash_client,
+        FakeMissingStashClient(),
+        FakeStashboxClient({}),
+        PerformerImageOptions(cache=performer_image_cache),
+    )
+    performer = {**local_performer("1", "Alice", "pa"), "image_hash": "hash"}
+    performer_upsert = {
+        "stash_id": "pa",
+        "missing_performer_id": "m1",
+        "local_performer": performer,
+    }
+
+    stash_completer.upsert_missing_performer(performer_upsert)
+    assert performer_image_cache.pushed == set()
+
+    local_stash_client.images["1"] = "data:image/jpeg;base64,"
+    stash_completer.upsert_missing_performer(performer_upsert)
+    assert performer_image_cache.pushed == {("m1", "hash")}
@@ -0,0 +1,91 @@
+import pytest
+
+import StashboxSceneCache as stashbox_scene_cache_module
+from StashboxSceneCache import StashboxSceneCache
+
+
+ENDPOINT = "https://stashdb.org/graphql"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(stashbox_scene_cache_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def create_cache(tmp_path):
+    caches = []
+
+    def create_cache(max_entries=10):
+        cache = StashboxSceneCache(
+            str(tmp_path / "cache" / "stashbox-scenes.sqlite"), max_entries
+        )
+        caches.append(cache)
+        return cache
+
+    yield create_cache
+    for cache in caches:
+        cache.close()
+
+
+def scenes(*scene_ids):
+    return [{"id": scene_id, "title": f"Scene {scene_id}"} for scene_id in scene_ids]
+
+
+def test_scenes_are_served_until_they_expire(clock, create_cache):
+    cache = create_cache()
+    cache.put(ENDPOINT, "performer", scenes("1", "2"))
+
+    clock.now += 60
+    assert cache.get(ENDPOINT, "performer", max_age_seconds=60) == scenes("1", "2")
+    assert cache.get(ENDPOINT, "other-performer", max_age_seconds=60) is None
+    assert cache.get("https://theporndb.net/graphql", "performer", 60) is None
+
+    clock.now += 1
+    assert cache.get(ENDPOINT, "performer", max_age_seconds=60) is None
+
+
+def test_scenes_are_kept_between_runs(clock, create_cache):
+    create_cache().put(ENDPOINT, "performer", scenes("1"))
+
+    assert create_cache().get(ENDPOINT, "performer", 60) == scenes("1")
+
+
+def test_least_recently_used_scenes_are_evicted(clock, create_cache):
+    cache = create_cache(max_entries=2)
+    cache.put(ENDPOINT, "performer-1", scenes("1"))
+    clock.now += 1
+    cache.put(ENDPOINT, "performer-2", scenes("2"))
+    clock.now += 1
+    cache.get(ENDPOINT, "performer-1", 60)
+    clock.now += 1
+    cache.put(ENDPOINT, "performer-3", scenes("3"))
+
+    assert cache.get(ENDPOINT, "performer-1", 60) == scenes("1")
+    assert cache.get(ENDPOINT, "performer-2", 60) is None
+    assert cache.get(ENDPOINT, "performer-3", 60) == scenes("3")
+
+
+def test_expired_scenes_are_served_with_their_watermark(clock, create_cache):
+    cache = create_cache()
+    cache.put(ENDPOINT, "performer", scenes("1"), "2024-05-01T10:00:00+00:00")
+    cache.put(ENDPOINT, "performer-without-watermark", scenes("2"))
+
+    clock.now += 3600
+    assert cache.get(ENDPOINT, "performer", 60) is None
+    assert cache.get_with_watermark(ENDPOINT, "performer") == (
+        scenes("1"),
+        "2024-05-01T10:00:00+00:00",
+    )
+    assert cache.get_with_watermark(ENDPOINT, "performer-without-watermark") is None
+    assert cache.get_with_watermark(ENDPOINT, "other-performer") is None